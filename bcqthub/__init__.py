@@ -1,4 +1,9 @@
 # ./bcqt_hub
 
-from . import drivers
-from . import src
+# subpackages are imported on first use, see _lazy.py
+from ._lazy import lazy_submodules
+
+__getattr__, __dir__ = lazy_submodules(__name__, {
+    "drivers" : ".drivers",
+    "src" : ".src",
+})
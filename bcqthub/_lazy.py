@@ -0,0 +1,30 @@
+import importlib
+
+
+def lazy_submodules(package_name, submodules):
+    """
+        returns (__getattr__, __dir__) for a package __init__.py that imports
+            its submodules on first attribute access instead of at import time
+            
+            submodules = {attribute name : module path relative to the package}
+            
+            e.g. in bcqthub/drivers/__init__.py
+            
+                __getattr__, __dir__ = lazy_submodules(__name__, {"VNA_Keysight" : ".instruments.VNA_Keysight"})
+                
+            `bcqthub.drivers.VNA_Keysight` then imports VNA_Keysight (and pyvisa) 
+                the first time it is used, and caches it in the package namespace
+    """
+    namespace = importlib.import_module(package_name).__dict__
+    
+    def __getattr__(name):
+        if name not in submodules:
+            raise AttributeError(f"module {package_name!r} has no attribute {name!r}")
+        module = importlib.import_module(submodules[name], package_name)
+        namespace[name] = module
+        return module
+    
+    def __dir__():
+        return sorted({*namespace, *submodules})
+    
+    return __getattr__, __dir__
@@ -1,11 +1,69 @@
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from collections import deque
 import numpy as np
-import pyvisa, time
+import pyvisa, time, asyncio
+
+if __name__ == "__main__":
+    from VisaSessionPool import visa_pool
+    from IOTracer import IOTracer
+else:
+    from .VisaSessionPool import visa_pool
+    from .IOTracer import IOTracer
+
+# IEEE-488.2 binary block datatypes -> numpy types (byte order is added later)
+#    "f" = FORMat:DATA REAL,32      "d" = FORMat:DATA REAL,64
+_BINARY_DATATYPES = {"f" : "f4", "d" : "f8"}
+
+# default max number of characters in one compound SCPI message, see batch_writes()
+_DEFAULT_BATCH_LENGTH = 1024
+
+# commands that put the instrument back into a known/unknown state, any of 
+#   these wipes the shadow state cache, see update_state_cache()
+#   (written in the normalized form returned by split_scpi_setting)
+_STATE_RESET_HEADERS = ("*RST", "*RCL", "SYST1:PRES1", "SYST1:UPR1", "SYST1:FPR1", "MMEM1:LOAD1")
+
+# VisaIOError codes that mean the session is gone for good and has to be reopened,
+#   see is_session_lost() (InvalidSession and ConnectionError always count)
+_SESSION_LOST_CODES = (pyvisa.constants.StatusCode.error_connection_lost, 
+                       pyvisa.constants.StatusCode.error_invalid_object,
+                       pyvisa.constants.StatusCode.error_closing_failed)
+
+# commands that are NOT safe to send twice, everything else (queries and plain
+#   settings) is replayed after a reconnect, see is_replayable()
+_NON_REPLAYABLE_HEADERS = ("INIT1", "*TRG", "*OPC", "*RST", "*RCL", "*SAV", "SENS1:AVER1:CLE1", 
+                           "SENS1:SWE1:MODE1", "MMEM1:STOR1", *_STATE_RESET_HEADERS)
+
+# settings that are cached but not re-sent after a reconnect, the data transfer
+#   format is chosen around every transfer (see VNA set_data_transfer_format)
+_NOT_REAPPLIED_HEADERS = ("FORM1",)
+
+# SCPI nodes of commands that do something (define, delete, store, clear, ...)
+#   instead of setting a value, they are never cached, see is_cacheable()
+_ACTION_NODES = ("DEF", "DEL", "MEM", "STOR", "LOAD", "CLE", "IMM", "ALL")
+
+# reconnect policy, every value can be overridden with the same key in configs
+_DEFAULT_RECONNECT_POLICY = {
+    "reconnect_attempts" : 5,       # tries per dropped session
+    "reconnect_delay" : 1.0,        # seconds before the first try, doubles every try
+    "reconnect_max_delay" : 60.0,   # cap on the delay between tries
+    "reconnect_budget" : 10,        # max reconnects within reconnect_window seconds
+    "reconnect_window" : 3600.0,
+    "reapply_state" : True,         # re-send the shadow state cache after reconnecting
+}
+
+# operation timeout = expected duration * factor + margin, see operation_timeout()
+_DEFAULT_TIMEOUT_FACTOR = 1.5
+_DEFAULT_TIMEOUT_MARGIN = 10.0
 
 # Abstract Base Class (ABC) for creating drivers for instruments
 class BaseDriver():
 # class BaseDriver(ABC):
     
+    # {name : (query, fmt)} read by snapshot(), see __init_subclass__
+    snapshot_parameters = {}
+    snapshot_registry = {}
+    
     def __init__(self, InstrConfig_Dict, instr_resource=None, instr_address=None, debug=False, **kwargs):
         """
             rm_backend = "@py" or None, depending on if using pyvisa or pyvisa-py
@@ -14,6 +72,28 @@ class BaseDriver():
         self.debug = debug
         self.configs = InstrConfig_Dict        
         self.instrument_name = self.configs["instrument_name"].upper()
+        
+        # write_check buffers into this list while inside batch_writes()
+        self.write_batch = None
+        
+        # last value written for each SCPI header, see write_setting(), and the
+        #   command it was written with, which is what reconnect() re-sends
+        self.state_cache = {}
+        self.state_commands = {}
+        
+        # None until we find out if the backend can wait on service requests
+        self.srq_supported = None
+        
+        # opt-in IOTracer, see enable_io_tracing()
+        self.io_tracer = None
+        
+        # times of recent reconnects, for the retry budget of recover_session()
+        self.reconnect_history = deque()
+        
+        # True while we hold a reference to a session in the shared visa_pool
+        self.rm = None
+        self.pooled_session = False
+        
         self.rm_backend = self.configs["rm_backend"] if "rm_backend" in self.configs else None
 
         # pick between address and resource
@@ -23,8 +103,10 @@ class BaseDriver():
         # if self.debug is True:
             # pyvisa.log_to_screen()
             
-        # Open the pyvisa resource manager 
-        self.open_pyvisa_backend()
+        # Open the pyvisa resource manager, not needed when we were handed a 
+        #   resource (e.g. a SimulatedPNAX on a PC without a VISA library)
+        if self.instr_resource is None:
+            self.open_pyvisa_backend()
         
         # now connect to instrument
         self.open_pyvisa_resource()
@@ -51,8 +133,19 @@ class BaseDriver():
         """
         Deconstructor to free resources
         """
-        if self.rm:
-            self.rm.close()
+        self.close()
+            
+    def close(self):
+        """
+            give the session and resource manager back to the shared visa_pool,
+                they are only really closed once no other driver is using them
+        """
+        if getattr(self, "pooled_session", False) is True:
+            visa_pool.release_resource(self.instr_address, self.rm_backend, self.resource)
+            self.pooled_session = False
+        if getattr(self, "rm", None) is not None:
+            visa_pool.release_resource_manager(self.rm_backend)
+            self.rm = None
             
             
             
@@ -62,15 +155,45 @@ class BaseDriver():
     ####################################################
     
     def read_check(self, fmt = str):
-        ret = self.resource.read()
+        self.flush_writes()
+        try:
+            if self.io_tracer is None:
+                ret = self.resource.read()
+            else:
+                ret = self.traced_io("read_check", "", self.resource.read)
+        except Exception as e:
+            # the reply we were waiting for died with the session, never replayable
+            if self.recover_session("", e) is False:
+                raise
         return fmt(ret)
     
     def write_check(self, cmd: str):
-        self.resource.write(cmd)
+        self.update_state_cache(cmd)
+        if self.write_batch is not None:
+            self.write_batch.append(cmd)
+            return
+        try:
+            if self.io_tracer is None:
+                self.resource.write(cmd)
+            else:
+                self.traced_io("write_check", cmd, self.resource.write, cmd)
+        except Exception as e:
+            if self.recover_session(cmd, e) is False:
+                raise
+            return self.write_check(cmd)
         return 
     
     def query_check(self, cmd, fmt = str):
-        ret = self.resource.query(cmd)
+        self.flush_writes()
+        try:
+            if self.io_tracer is None:
+                ret = self.resource.query(cmd)
+            else:
+                ret = self.traced_io("query_check", cmd, self.resource.query, cmd)
+        except Exception as e:
+            if self.recover_session(cmd, e) is False:
+                raise
+            return self.query_check(cmd, fmt)
         return fmt(ret)
     
     # def check_instr_error_queue(self, print_output=False):
@@ -113,55 +236,409 @@ class BaseDriver():
     def query_check_ascii(self, cmd : str, container = np.array):
         """
         Sends a query command `cmd` and checks for errors, but
-            returns via query_ascii_values
+            returns the comma separated values as an array
+            
+            (same result as pyvisa's query_ascii_values, but parsed by numpy
+             in one go, and we get to see how many bytes came over the wire)
         """
         
+        self.flush_writes()
         try:
-            ret = self.resource.query_ascii_values(cmd, container=container)
-            return ret
+            if self.io_tracer is None:
+                raw = self.resource.query(cmd)
+            else:
+                raw = self.traced_io("query_check_ascii", cmd, self.resource.query, cmd)
             
         except Exception as e:  
-            if type(e) == pyvisa.InvalidSession:    # catch a stupid bug 
-                self.handle_InvalidSession_error(cmd, e)
-                ret = self.resource.query(cmd)
-                return ret
+            if self.recover_session(cmd, e) is True:
+                return self.query_check_ascii(cmd, container)
             if type(e) == pyvisa.VisaIOError:   # likely a timeout
                 self.handle_VisaIOError(cmd, e)
-                raise e
+            raise e
+        
+        try:
+            ret = np.array(raw.strip().split(","), dtype=float)
+        except ValueError as e:
+            reply = raw if len(raw) <= 200 else f"{raw[:200]}... ({len(raw)} characters)"
+            raise ValueError(f"Could not parse the reply to '{cmd}' as comma separated numbers: {reply!r}") from e
+        return ret if container is np.array else container(ret)
             
-    def query_check_binary(self, cmd : str, container = np.array):
+    def query_check_binary(self, cmd : str, datatype : str = "d", is_big_endian : bool = False, 
+                           expect_termination : bool = True, out : np.ndarray = None):
         """
         Sends a query command `cmd` and checks for errors, but
-            returns via query_binary
+            returns an IEEE-488.2 definite-length binary block
+            
+            the block looks like  #<N><length><payload><term>
+                e.g.  #6240008<240008 bytes of REAL,64>\n
+                
+            datatype = "f" for REAL,32 or "d" for REAL,64
+            is_big_endian = True for FORMat:BORDer NORMal, False for SWAPped
+            out = optional preallocated np.ndarray to read the payload into,
+                    otherwise a new array is allocated for every call
         """
-        return NotImplemented
         
-    @abstractmethod
-    def return_instrument_parameters(self, print_output=False):
+        self.flush_writes()
+        try:
+            if self.io_tracer is not None:
+                return self.traced_io("query_check_binary", cmd, self._query_binary_block, cmd, 
+                                      datatype, is_big_endian, expect_termination, out)
+            self.resource.write(cmd)
+            return self.read_binary_block(datatype, is_big_endian, expect_termination, out)
+            
+        except Exception as e:  
+            if self.recover_session(cmd, e) is True:
+                return self.query_check_binary(cmd, datatype, is_big_endian, expect_termination, out)
+            if type(e) == pyvisa.VisaIOError:   # likely a timeout
+                self.handle_VisaIOError(cmd, e)
+            raise e
         
-        # get all methods that start with "get_" and save as list
-        all_get_methods = [method_name for method_name in dir(self) 
-                           if callable(getattr(self, method_name)) 
-                            and "get_" in method_name]
+    def _query_binary_block(self, cmd, *args):
+        self.resource.write(cmd)
+        return self.read_binary_block(*args)
+        
+    def read_binary_block(self, datatype : str = "d", is_big_endian : bool = False, 
+                          expect_termination : bool = True, out : np.ndarray = None):
+        """
+            reads one IEEE-488.2 block from the resource and parses the payload
+                directly into a numpy buffer, chunk by chunk, so that we never
+                build python floats or an intermediate list like query_ascii_values
+        """
+        
+        if datatype not in _BINARY_DATATYPES:
+            raise ValueError(f"Unknown binary datatype '{datatype}', use 'f' (REAL,32) or 'd' (REAL,64)")
+        dtype = np.dtype(_BINARY_DATATYPES[datatype]).newbyteorder(">" if is_big_endian else "<")
+        
+        # header is '#' followed by a single digit N, then N digits giving the payload length
+        header = self.resource.read_bytes(2)
+        if header[:1] != b"#":
+            raise ValueError(f"Expected IEEE-488.2 block header '#', received {header!r}")
+        
+        num_digits = int(header[1:2])
+        if num_digits == 0:
+            # indefinite-length block, terminated by the message end
+            payload = self.resource.read_raw()
+            payload = payload[:len(payload) - len(payload) % dtype.itemsize]
+            data = np.frombuffer(payload, dtype=dtype).astype(dtype.newbyteorder("="))
+            return data if out is None else self._copy_into_buffer(data, out)
+        
+        num_bytes = int(self.resource.read_bytes(num_digits))
+        num_values = num_bytes // dtype.itemsize
+        
+        if out is not None and out.size < num_values:
+            raise ValueError(f"Preallocated buffer is too small ({out.size}) for {num_values} values")
+        
+        # read the payload in raw byte-space directly into the array memory, if the 
+        #   given buffer has a different byte order we need one temporary array
+        if out is not None and out.dtype == dtype:
+            block = out[:num_values]
+        else:
+            block = np.empty(num_values, dtype=dtype)
+        raw = block.view(np.uint8)
+        
+        chunk_size = getattr(self.resource, "chunk_size", 20*1024)
+        n_read = 0
+        while n_read < num_bytes:
+            chunk = self.resource.read_bytes(min(chunk_size, num_bytes - n_read))
+            raw[n_read:n_read+len(chunk)] = np.frombuffer(chunk, dtype=np.uint8)
+            n_read += len(chunk)
+        
+        # consume the trailing termination character(s) so the next read starts clean
+        term = getattr(self.resource, "read_termination", None)
+        if expect_termination and term:
+            self.resource.read_bytes(len(term))
+        
+        if out is None:
+            # hand back native byte order, pandas does not like big-endian arrays
+            return block if block.dtype.isnative else block.astype(block.dtype.newbyteorder("="))
+        
+        return self._copy_into_buffer(block, out)
+    
+    def _copy_into_buffer(self, data, out):
+        if out.size < data.size:
+            raise ValueError(f"Preallocated buffer is too small ({out.size}) for {data.size} values")
+        if not np.shares_memory(data, out):
+            out[:data.size] = data
+        return out[:data.size]
         
-        # run through list and call each method using gettattr()
-        # all_methods_and_results = []
-        # for method in all_get_methods:
-        #     # avoid infinite loop :)
-        #     if "return_instrument_parameters" in method:
-        #         continue
-        #     self.print_debug(f"running {method}")
-        #     result = getattr(self, method)()
-        #     all_methods_and_results.append( (method, result) )
+    @contextmanager
+    def batch_writes(self, max_length : int = None, check_errors : bool = False):
+        """
+            Context manager that buffers every write_check() and sends them
+                as compound SCPI messages joined by ';' when the block ends,
+                instead of one VISA transaction per write
+            
+                with self.batch_writes(check_errors=True):
+                    self.write_check('SOUR1:POW1 -30')
+                    self.write_check('SENSe1:AVERage:Count 10')
+                    
+            max_length = max number of characters per message, defaults to 
+                configs["batch_max_length"] or _DEFAULT_BATCH_LENGTH
+            check_errors = send one *OPC? and SYST:ERR? after the final flush,
+                raises RuntimeError if the instrument reports an error
+            
+            Any query/read inside the block flushes the buffer first, so the
+                order of commands seen by the instrument never changes. 
+                Set configs["batch_writes"] = False to disable batching.
+        """
+        
+        nested = self.write_batch is not None
+        if nested is False and self.configs.get("batch_writes", True) is not False:
+            self.write_batch = []
+            self.batch_max_length = max_length or self.configs.get("batch_max_length", _DEFAULT_BATCH_LENGTH)
+            
+        try:
+            yield
+        finally:
+            if nested is False:
+                self.flush_writes()
+                self.write_batch = None
+        
+        if check_errors is True:
+            self.flush_writes()
+            self.query_check("*OPC?")
+            status, description = self.check_instr_error_queue()
+            if int(self.strip_specials(status)) != 0:
+                raise RuntimeError(f"[{self.instrument_name}] instrument reported an error after batched writes: {status},{description}")
+    
+    def flush_writes(self):
+        """
+            send everything buffered by batch_writes(), does nothing otherwise
+        """
+        if not self.write_batch:
+            return
+        
+        commands, self.write_batch = self.write_batch, []
+        for message in self.join_scpi_commands(commands, self.batch_max_length):
+            try:
+                if self.io_tracer is None:
+                    self.resource.write(message)
+                else:
+                    self.traced_io("write_check", message, self.resource.write, message)
+            except Exception as e:
+                if self.recover_session(message, e) is False:
+                    raise
+                self.resource.write(message)
+    
+    def join_scpi_commands(self, commands, max_length=_DEFAULT_BATCH_LENGTH):
+        """
+            joins SCPI commands into as few compound messages as possible
+            
+            every subsystem command gets a leading ':' so the instrument
+                resets its header path, otherwise e.g. 'SENS1:BAND 1e3;SOUR1:POW1 -30'
+                would be parsed as SENS1:SOUR1:POW1. Common commands like *CLS
+                do not need it. A command longer than max_length is sent alone.
+        """
+        messages, current = [], ""
+        for cmd in commands:
+            cmd = cmd.strip()
+            if not cmd.startswith((":", "*")):
+                cmd = f":{cmd}"
+            if current and len(current) + len(cmd) + 1 > max_length:
+                messages.append(current)
+                current = ""
+            current = cmd if not current else f"{current};{cmd}"
+        if current:
+            messages.append(current)
+        return messages
+        
+    def write_setting(self, cmd: str):
+        """
+            write_check() that is skipped when the shadow state cache says
+                the instrument already has this value, returns True if the 
+                command was actually sent
+                
+            only use this for settings (SOUR1:POW1 -30, SENS1:BAND 1000HZ),
+                never for events like INIT:IMM or *CLS, which must always be sent.
+            every write_check() updates the cache, so the cache stays correct 
+                as long as nothing talks to the instrument behind our back
+        """
+        header, value = self.split_scpi_setting(cmd)
+        if value is not None and self.state_cache.get(header) == value:
+            self.print_debug(f"write_setting skipped '{cmd}', already set")
+            return False
+        
+        self.write_check(cmd)
+        return True
+    
+    def update_state_cache(self, cmd: str):
+        """
+            record every 'HEADER value' setting in a written command, and wipe the
+                cache for anything that resets the instrument (*RST, SYST:UPR, ...)
+        """
+        for single_cmd in cmd.split(";"):
+            header, value = self.split_scpi_setting(single_cmd)
+            if header.startswith(_STATE_RESET_HEADERS):
+                self.invalidate_state_cache()
+            elif value is not None and self.is_cacheable(header):
+                self.state_cache[header] = value
+                self.state_commands[header] = single_cmd.strip()
+    
+    def is_cacheable(self, header: str):
+        """
+            True for plain settings, False for common commands (*ESE, ...),
+                triggers and actions like MMEM:STOR or CALC:MEAS:DEF, which
+                have to be sent every time even with the same argument
+        """
+        if header.startswith(("*", *_NON_REPLAYABLE_HEADERS)):
+            return False
+        return not any(node.rstrip("0123456789") in _ACTION_NODES for node in header.split(":"))
+    
+    def invalidate_state_cache(self, prefixes=None):
+        """
+            forget cached settings so the next write_setting() is always sent,
+                either everything or only headers that start with `prefixes`
+        """
+        if prefixes is None:
+            self.print_debug("Invalidating entire state cache")
+            self.state_cache.clear()
+            self.state_commands.clear()
+            return
+        
+        if isinstance(prefixes, str):
+            prefixes = [prefixes]
+        prefixes = tuple(self.split_scpi_setting(prefix)[0] for prefix in prefixes)
+        for header in [h for h in self.state_cache if h.startswith(prefixes)]:
+            del self.state_cache[header]
+            self.state_commands.pop(header, None)
+    
+    def split_scpi_setting(self, cmd: str):
+        """
+            split a SCPI command into a normalized header and value, so that 
+                'SENSe1:AVERage:Count 10' and 'sens:aver:coun 10.0' give the
+                same key ('SENS1:AVER1:COUN1', (10.0,))
             
-        # one liner w/ list comprehension
-        all_methods_and_results = [(name, getattr(self, name)()) for name in all_get_methods if ("return_instrument_parameters" not in name and "__" not in name)]
+            every node is shortened to its SCPI short form (first four letters,
+                or three if the fourth is a vowel) and a missing numeric suffix
+                defaults to 1. Optional nodes like FORMat[:DATA] are not handled.
+            value is None for commands without an argument
+        """
+        parts = cmd.strip().split(maxsplit=1)
+        if len(parts) == 0:
+            return "", None
+        
+        header = parts[0].lstrip(":").upper()
+        if not header.startswith("*"):
+            nodes = []
+            for node in header.split(":"):
+                name, suffix = node.rstrip("0123456789"), node[len(node.rstrip("0123456789")):]
+                if len(name) > 4:
+                    name = name[:3] if name[3] in "AEIOU" else name[:4]
+                nodes.append(f"{name}{suffix or 1}")
+            header = ":".join(nodes)
+        
+        if len(parts) == 1:
+            return header, None
+        
+        value = []
+        for token in parts[1].split(","):
+            token = token.strip().upper()
+            try:
+                value.append(float(token))
+            except ValueError:
+                value.append(token)
+        
+        return header, tuple(value)
+        
+    ####################################################
+    ##############  instrument snapshot  ###############
+    ####################################################
+    
+    def __init_subclass__(cls, **kwargs):
+        """
+            merge the `snapshot_parameters` of the class and its parents into 
+                `snapshot_registry` once, when the driver class is created
+        """
+        super().__init_subclass__(**kwargs)
+        registry = {}
+        for base in reversed(cls.__mro__):
+            registry.update(base.__dict__.get("snapshot_parameters", {}))
+        cls.snapshot_registry = registry
+    
+    def snapshot(self, max_length : int = None):
+        """
+            read every parameter in `snapshot_registry` with compound queries,
+                so a full snapshot is one or two round trips instead of one per
+                parameter, e.g.  'SENS1:BAND?;:SOUR1:POW1?'  ->  '+1.0E+03;-3.0E+01'
+            
+            drivers declare their parameters as a class attribute
+            
+                snapshot_parameters = {
+                    "if_bandwidth" : ("SENS1:BAND?", float),
+                    "output" : ("OUTP:STAT?", bool),
+                }
+                
+            returns {name : value}, value is None if the instrument did not answer
+        """
+        names = list(self.snapshot_registry)
+        queries = [self.snapshot_registry[name][0] for name in names]
+        max_length = max_length or self.configs.get("batch_max_length", _DEFAULT_BATCH_LENGTH)
+        
+        replies, idx = [], 0
+        for message in self.join_scpi_commands(queries, max_length):
+            num_queries = message.count(";") + 1
+            message_replies = self.query_check(message).split(";")
+            if len(message_replies) != num_queries:
+                # something in this message was not understood, ask one by one
+                self.print_warning(f"snapshot got {len(message_replies)} replies for {num_queries} queries, "
+                                   f"falling back to single queries")
+                message_replies = [self.query_snapshot_parameter(query) for query in queries[idx:idx+num_queries]]
+            replies.extend(message_replies)
+            idx += num_queries
+        
+        return {name : self.parse_reply(reply, self.snapshot_registry[name][1]) 
+                for name, reply in zip(names, replies)}
+    
+    def query_snapshot_parameter(self, query):
+        try:
+            return self.query_check(query)
+        except pyvisa.VisaIOError as e:
+            self.print_warning(f"snapshot query '{query}' failed: {e}")
+            return None
+    
+    def parse_reply(self, reply, fmt = str):
+        """
+            '+1.0E+03' -> 1000.0,  '+201' or '2.01E+02' -> 201,  'ON' or '1' -> True
+        """
+        if reply is None:
+            return None
+        reply = reply.strip().strip('"')
+        try:
+            if fmt is bool:
+                return reply.upper() in ("1", "+1", "ON")
+            if fmt is int:
+                return int(float(reply))
+            return fmt(reply)
+        except ValueError:
+            self.print_warning(f"could not parse '{reply}' as {fmt.__name__}")
+            return None
+    
+    @abstractmethod
+    def return_instrument_parameters(self, print_output=False):
+        """
+            list of ("get_{name}", value) for every parameter in `snapshot_registry`,
+                read with snapshot(). The names are those of the get_ methods
+                this used to call, drivers without snapshot_parameters still 
+                call every get_ method
+        """
+        if not self.snapshot_registry:
+            return [(name, getattr(self, name)()) for name in dir(self) 
+                    if callable(getattr(self, name)) and "get_" in name 
+                    and "return_instrument_parameters" not in name and "__" not in name]
         
-        return all_methods_and_results
+        instr_params = [(f"get_{name}", value) for name, value in self.snapshot().items()]
+        if print_output is True:
+            for name, value in instr_params:
+                self.print_console(f"     {name} = {value}")
+        return instr_params
+    
     
+    ####################################################
+    ##############  completion waiting  ################
+    ####################################################
     
     # @abstractmethod
-    def send_cmd_and_wait(self, cmd: str):
+    def send_cmd_and_wait(self, cmd: str, expected_duration : float = 0, timeout : float = None, use_srq : bool = None):
         """
             Instead of wrestling with *OPC?, this method uses the 
             Event Status Register (ESR) to let the instrument 
@@ -174,57 +651,300 @@ class BaseDriver():
             based on flowchart from R&S guide on command synchronizing
             
             https://www.rohde-schwarz.com/us/driver-pages/remote-control/measurements-synchronization_231248.html
+            
+            If the VISA backend supports it, the OPC bit is routed to a 
+            service request (*ESE 1, *SRE 32) and we block in wait_on_event
+            instead of polling at all. Otherwise *ESR? is polled with 
+            poll_until(), whose first check is at `expected_duration` seconds.
+            
+            timeout defaults to operation_timeout(expected_duration), so a 
+            20000 average sweep gets hours and a 2 average sweep seconds
+            
+            returns the elapsed time in seconds
         """
         
-        # write a 1 to the Event Status Register and then query it
-        # to reset the ESR entirely
+        use_srq = self.configs.get("use_srq", True) if use_srq is None else use_srq
+        timeout = self.operation_timeout(expected_duration) if timeout is None else timeout
+        
+        # clear the status registers, then let the OPC bit of the ESR 
+        # propagate to the ESB bit (32) of the status byte -> SRQ
+        self.write_check("*CLS")
         self.write_check("*ESE 1") 
-        self.query_check("*ESR?") 
         
         # now synchronize the instrument by sending the command
         # we want to synchronize. By adding *OPC at the end,
         # we tell the instrument that it needs to update the
         # ESR once it has finished that string of commands
-        
         if not cmd.endswith("*OPC"):
             cmd += ";*OPC"
         
-        # send command to be synchronized with *OPC
-        self.write_check(cmd)
-
-        # start querying every 0.1s (or every 1s after 1000 tries) to see if
-        # the instrument is finished with its command
+        tstart = time.perf_counter()
+        self.print_debug(f"Sending {cmd} and waiting:")
+        
+        with self.temporary_timeout(timeout):
+            if use_srq is True and self.enable_srq_events() is True:
+                self.write_check("*SRE 32")
+                self.write_check(cmd)
+                if self.wait_on_srq(timeout) is True:
+                    self.query_check("*ESR?")   # reading the ESR clears the OPC bit for next time
+                    return time.perf_counter() - tstart
+                # backend accepted enable_event but can't actually wait -> poll instead
+                remaining = max(0, expected_duration - (time.perf_counter() - tstart))
+            else:
+                self.write_check(cmd)
+                remaining = expected_duration
+            
+            self.poll_until(self.check_opc_bit, expected_duration=remaining, timeout=timeout)
+        return time.perf_counter() - tstart
+    
+    def check_opc_bit(self):
+        """
+            query *ESR? and return True once the operation complete bit is set
+        """
+        esr = self.query_check("*ESR?")
+        return bool(int(float(self.strip_specials(esr).strip())) & 1)
+    
+    def enable_srq_events(self):
+        """
+            start queueing service request events on the resource, returns 
+                False (and remembers it) if the backend does not support them
+        """
+        if self.srq_supported is False:
+            return False
+        
         try:
-            self.print_console(f"Sending {cmd} and waiting:")
-            count = 0
-            check_if_finished = False
-            while check_if_finished is False:
-                self.print_console(f"    [{count}]")
-                # at count = 10, 100, 1000, increase delay between queries
-                # log10(10) = 1.0     =>  delay = 0.1s
-                # log10(100) = 2.0    =>   delay = 1s
-                # log10(1000) = 3.0   =>   delay = 10s
-                #    ... etc
-                #  Honestly, I think querying every 1s is slow enough for any scenario
-                count += 1
-                
-                if count <= 100:
-                    time.sleep(0.1)
-                else:
-                    time.sleep(1)
-                    
-                status = self.read_check("*STB?")
-                
-                # status should be something like "+1\n"
-                if "1" in status: 
-                    check_if_finished = True
-                
-                return True
+            self.resource.enable_event(pyvisa.constants.EventType.service_request, 
+                                       pyvisa.constants.EventMechanism.queue)
+            self.resource.discard_events(pyvisa.constants.EventType.service_request, 
+                                         pyvisa.constants.EventMechanism.queue)
+            self.srq_supported = True
+        except (pyvisa.VisaIOError, NotImplementedError, AttributeError) as e:
+            self.print_debug(f"SRQ events not supported ({e}), falling back to polling")
+            self.srq_supported = False
             
-        except Exception as e:
-            self.print_console
+        return self.srq_supported
+    
+    def wait_on_srq(self, timeout : float = None):
+        """
+            block until the instrument raises a service request, returns
+                False if the backend turns out not to support waiting on events
+                and raises TimeoutError if nothing arrives within `timeout` seconds
+        """
+        event_type = pyvisa.constants.EventType.service_request
+        timeout_ms = pyvisa.constants.VI_TMO_INFINITE if timeout is None else int(timeout*1000)
+        
+        try:
+            self.resource.wait_on_event(event_type, timeout_ms)
+            return True
+        except pyvisa.VisaIOError as e:
+            if e.error_code == pyvisa.constants.StatusCode.error_timeout:
+                raise TimeoutError(f"[{self.instrument_name}] no service request after {timeout} seconds") from e
+            self.print_debug(f"wait_on_event failed ({e}), falling back to polling")
+            self.srq_supported = False
+            return False
+        except NotImplementedError:
+            self.srq_supported = False
+            return False
+        finally:
+            try:
+                self.resource.disable_event(event_type, pyvisa.constants.EventMechanism.queue)
+            except (pyvisa.VisaIOError, NotImplementedError):
+                pass
+    
+    def poll_until(self, is_finished, expected_duration : float = 0, timeout : float = None,
+                   min_interval : float = 0.01, max_interval : float = 1.0, verbose : bool = False):
+        """
+            adaptive polling fallback for when we can't use service requests
             
-        # return traceData
+            sleeps until the operation should be done (`expected_duration`, e.g. from
+                the sweep time the instrument reports), then calls `is_finished()`
+                with an interval that starts at a few percent of the expected 
+                duration and grows by 1.5x up to `max_interval`. Short sweeps get
+                checked every ~10ms, hour-long averages every second.
+            
+            returns the elapsed time in seconds, raises TimeoutError after `timeout`,
+                which defaults to operation_timeout(expected_duration)
+        """
+        tstart = time.perf_counter()
+        timeout = self.operation_timeout(expected_duration) if timeout is None else timeout
+        if expected_duration > 0:
+            time.sleep(expected_duration)
+        
+        interval = min(max_interval, max(min_interval, 0.02*expected_duration))
+        with self.temporary_timeout(timeout):
+            while not is_finished():
+                t_elapsed = time.perf_counter() - tstart
+                if timeout is not None and t_elapsed > timeout:
+                    raise TimeoutError(f"[{self.instrument_name}] operation not finished after {t_elapsed:1.2f} seconds")
+                if verbose is True:
+                    self.print_console(" "*20 + f"Time elapsed: [{t_elapsed:1.2f}s]", end="\r")
+                time.sleep(interval)
+                interval = min(max_interval, interval*1.5)
+        
+        return time.perf_counter() - tstart
+    
+    def operation_timeout(self, expected_duration : float):
+        """
+            how long to wait for an operation expected to take `expected_duration`
+                seconds before giving up, configs["timeout_factor"] * expected 
+                + configs["timeout_margin"], None (wait forever) if unknown
+        """
+        if not expected_duration or expected_duration <= 0:
+            return None
+        factor = self.configs.get("timeout_factor", _DEFAULT_TIMEOUT_FACTOR)
+        margin = self.configs.get("timeout_margin", _DEFAULT_TIMEOUT_MARGIN)
+        return expected_duration * factor + margin
+    
+    @contextmanager
+    def temporary_timeout(self, timeout : float):
+        """
+            raise the VISA timeout of the resource to at least `timeout` seconds
+                inside the block, for instruments that hold back replies while 
+                they are busy (a query sent mid-sweep would otherwise VisaIOError)
+        """
+        resource = self.resource
+        old_timeout = getattr(resource, "timeout", None)
+        if timeout is None or old_timeout is None or old_timeout >= timeout*1000:
+            yield
+            return
+        
+        resource.timeout = int(timeout*1000)
+        try:
+            yield
+        finally:
+            # reconnect() may have swapped the resource in the meantime
+            if self.resource is resource:
+                resource.timeout = old_timeout
+    
+    ####################################################
+    ################  I/O tracing  #####################
+    ####################################################
+    
+    def enable_io_tracing(self, io_tracer : IOTracer = None, maxlen : int = 100_000):
+        """
+            start recording every read/write/query of this driver, pass the same
+                IOTracer to every instrument to get one trace for the experiment
+        """
+        self.io_tracer = IOTracer(maxlen) if io_tracer is None else io_tracer
+        return self.io_tracer
+    
+    def disable_io_tracing(self):
+        io_tracer, self.io_tracer = self.io_tracer, None
+        return io_tracer
+    
+    def traced_io(self, method, cmd, func, *args):
+        """
+            call func(*args) and record duration, bytes and errors in self.io_tracer
+        """
+        error, ret = "", None
+        tstart = time.perf_counter()
+        try:
+            ret = func(*args)
+            return ret
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            duration = time.perf_counter() - tstart
+            if isinstance(ret, np.ndarray):
+                bytes_in = ret.nbytes
+            else:
+                bytes_in = len(ret) if isinstance(ret, (str, bytes)) else 0
+            self.io_tracer.record(self.instrument_name, method, cmd, tstart, duration, 
+                                  bytes_out=len(cmd), bytes_in=bytes_in, error=error)
+    
+    ####################################################
+    ###############  async operation  ##################
+    ####################################################
+    
+    # asyncio versions of the I/O methods, so one experiment can talk to 
+    #   several instruments at once, e.g. retune the SG while the VNA is
+    #   still transferring a trace:
+    #
+    #       await asyncio.gather(
+    #           VNA.async_query_check_binary('CALC1:DATA? FDATA'),
+    #           SG.async_write_check(f'SOUR:FREQ:CW {freq} HZ'),
+    #       )
+    #
+    # every blocking VISA call runs in this driver's own single-thread
+    #   executor, so commands to one resource keep the order they were 
+    #   awaited in while different instruments run in parallel
+    
+    def run_in_io_thread(self, func, *args, **kwargs):
+        """
+            schedule a blocking driver method on the I/O thread of our session,
+                returns an awaitable. Drivers sharing a session share the 
+                thread too, see visa_pool.io_executor()
+        """
+        executor = visa_pool.io_executor(self.resource, thread_name_prefix=self.instrument_name)
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(executor, lambda: func(*args, **kwargs))
+    
+    async def async_write_check(self, cmd: str):
+        return await self.run_in_io_thread(self.write_check, cmd)
+    
+    async def async_query_check(self, cmd: str, fmt = str):
+        return await self.run_in_io_thread(self.query_check, cmd, fmt)
+    
+    async def async_query_check_ascii(self, cmd: str, container = np.array):
+        return await self.run_in_io_thread(self.query_check_ascii, cmd, container)
+    
+    async def async_query_check_binary(self, cmd: str, datatype : str = "d", is_big_endian : bool = False, 
+                                       expect_termination : bool = True, out : np.ndarray = None):
+        return await self.run_in_io_thread(self.query_check_binary, cmd, datatype, is_big_endian, 
+                                           expect_termination, out)
+    
+    async def async_poll_until(self, is_finished, expected_duration : float = 0, timeout : float = None,
+                               min_interval : float = 0.01, max_interval : float = 1.0):
+        """
+            same schedule as poll_until(), but the sleeps are asyncio.sleep so 
+                other instruments keep working, and only `is_finished` (which
+                talks to the instrument) runs on the I/O thread, inside the 
+                same temporary_timeout() as the blocking version
+        """
+        tstart = time.perf_counter()
+        timeout = self.operation_timeout(expected_duration) if timeout is None else timeout
+        if expected_duration > 0:
+            await asyncio.sleep(expected_duration)
+        
+        def check():
+            with self.temporary_timeout(timeout):
+                return is_finished()
+        
+        interval = min(max_interval, max(min_interval, 0.02*expected_duration))
+        while not await self.run_in_io_thread(check):
+            t_elapsed = time.perf_counter() - tstart
+            if timeout is not None and t_elapsed > timeout:
+                raise TimeoutError(f"[{self.instrument_name}] operation not finished after {t_elapsed:1.2f} seconds")
+            await asyncio.sleep(interval)
+            interval = min(max_interval, interval*1.5)
+        
+        return time.perf_counter() - tstart
+    
+    async def async_send_cmd_and_wait(self, cmd: str, expected_duration : float = 0, timeout : float = None, use_srq : bool = None):
+        """
+            async send_cmd_and_wait(). Waiting on a service request blocks the 
+                I/O thread (which is fine, this instrument is busy anyway), 
+                the polling fallback uses async_poll_until()
+        """
+        use_srq = self.configs.get("use_srq", True) if use_srq is None else use_srq
+        timeout = self.operation_timeout(expected_duration) if timeout is None else timeout
+        if use_srq is True and self.srq_supported is not False:
+            return await self.run_in_io_thread(self.send_cmd_and_wait, cmd, expected_duration, timeout, use_srq)
+        
+        if not cmd.endswith("*OPC"):
+            cmd += ";*OPC"
+        
+        def write_cmd():
+            with self.temporary_timeout(timeout):
+                self.write_check(cmd)
+        
+        tstart = time.perf_counter()
+        await self.async_write_check("*CLS")
+        await self.async_write_check("*ESE 1")
+        await self.run_in_io_thread(write_cmd)
+        await self.async_poll_until(self.check_opc_bit, expected_duration=expected_duration, timeout=timeout)
+        return time.perf_counter() - tstart
     
     ####################################################
     ################  obj helpers  #####################
@@ -246,13 +966,15 @@ class BaseDriver():
             self.print_debug(f"setattr -> self.{k} = {v}")
 
     def open_pyvisa_backend(self):
+        """
+            borrow the process-wide ResourceManager for self.rm_backend from
+                visa_pool, instead of opening a new one for every driver
+        """
         self.print_console(f"Initializing pyvisa backend `{self.rm_backend}`")
-        if self.rm_backend is not None:
-            rm = pyvisa.ResourceManager(self.rm_backend)
-        else:
-            rm = pyvisa.ResourceManager()
+        if self.rm is not None:
+            visa_pool.release_resource_manager(self.rm_backend)
+        self.rm = visa_pool.acquire_resource_manager(self.rm_backend)
         self.print_debug(f"Pyvisa resource manager successfully initialized")
-        self.rm = rm
 
     def open_pyvisa_resource(self):
         self.print_console(f"Opening resource using backend `{self.rm}`")
@@ -262,8 +984,14 @@ class BaseDriver():
                 self.print_debug(f"{self.rm = }, calling self.open_pyvisa_backend()")
                 self.open_pyvisa_backend()
             else:
-                self.print_debug(f"Found {self.rm = }, calling self.rm.open_resource()")
-            resource = self.rm.open_resource(self.instr_address)  # Open the instrument object
+                self.print_debug(f"Found {self.rm = }, asking visa_pool for a session")
+            
+            # give back our old session first, a dead one is reopened by the pool
+            if self.pooled_session is True:
+                visa_pool.release_resource(self.instr_address, self.rm_backend, self.resource)
+                self.pooled_session = False
+            resource = visa_pool.acquire_resource(self.instr_address, self.rm_backend)  # Open (or share) the instrument object
+            self.pooled_session = True
             
         elif self.instr_resource is not None and self.instr_address is None:
             self.print_console(f"open_pyvisa_resource() was called, but already found instrument resource? {self.instr_resource = }")
@@ -275,6 +1003,9 @@ class BaseDriver():
                              \n            {self.instr_address = }\n            {self.instr_resource = }
                              \n        Provide only one the address or the resource to use this driver.""")
         self.resource = resource
+        
+        # new session -> we have no idea what state the instrument is in
+        self.invalidate_state_cache()
     
     
     
@@ -361,18 +1092,139 @@ class BaseDriver():
         self.print_console(self.check_instr_error_queue())
     
     def handle_InvalidSession_error(self, cmd, err):
-        self.print_warning("Caught InvalidSession exception:  ", cmd, err)
-        self.print_console(f"Waiting one second and restarting backend/resource...")
-        
-        time.sleep(1)
-        self.rm = self.open_pyvisa_backend()
-        if self.rm is None: 
-            self.handle_InvalidSession_error()
-        
-        time.sleep(1)
-        self.resource = self.open_pyvisa_resource()
-        if self.resource is None: 
-            self.handle_InvalidSession_error()
+        """
+            kept for old scripts, reconnects according to the reconnect policy
+        """
+        return self.recover_session(cmd, err)
+    
+    def recover_session(self, cmd, err):
+        """
+            called from the I/O methods with the exception `err` raised while 
+                sending `cmd`
+            
+            returns False if `err` is not a dead session (the caller re-raises it),
+                True once the session was reopened and `cmd` can simply be sent 
+                again, and raises ConnectionError if reconnecting failed or `cmd` 
+                is not safe to replay (e.g. INIT:IMM, or a read whose query was lost)
+        """
+        if not self.is_session_lost(err):
+            return False
+        
+        self.print_warning(f"Lost the session while sending '{cmd}' ({type(err).__name__}: {err})")
+        self.reconnect()
+        
+        if not self.is_replayable(cmd):
+            raise ConnectionError(f"[{self.instrument_name}] session was reopened, but '{cmd}' is not safe "
+                                  f"to send twice, repeat the operation") from err
+        self.print_console(f"Session restored, replaying '{cmd}'")
+        return True
+    
+    def is_session_lost(self, err):
+        if isinstance(err, (pyvisa.InvalidSession, ConnectionError)):
+            return True
+        return isinstance(err, pyvisa.VisaIOError) and err.error_code in _SESSION_LOST_CODES
+    
+    def is_replayable(self, cmd):
+        """
+            queries and plain settings are idempotent, triggers and resets are not
+        """
+        if not cmd.strip():
+            return False
+        for single_cmd in cmd.split(";"):
+            header, value = self.split_scpi_setting(single_cmd)
+            if header.rstrip("?").startswith(_NON_REPLAYABLE_HEADERS) and "?" not in single_cmd:
+                return False
+        return True
+    
+    def reconnect(self):
+        """
+            reopen the session with exponential backoff, then re-apply the shadow
+                state cache so the instrument is where we left it
+            
+            raises ConnectionError when every attempt failed, or when more than
+                configs["reconnect_budget"] reconnects happened within 
+                configs["reconnect_window"] seconds (a flapping link should stop 
+                the experiment instead of retrying forever)
+        """
+        policy = {k : self.configs.get(k, v) for k, v in _DEFAULT_RECONNECT_POLICY.items()}
+        
+        now = time.monotonic()
+        while self.reconnect_history and now - self.reconnect_history[0] > policy["reconnect_window"]:
+            self.reconnect_history.popleft()
+        if len(self.reconnect_history) >= policy["reconnect_budget"]:
+            raise ConnectionError(f"[{self.instrument_name}] reconnect budget exhausted, {len(self.reconnect_history)} "
+                                  f"reconnects in the last {policy['reconnect_window']:.0f} seconds")
+        self.reconnect_history.append(now)
+        
+        # open_pyvisa_resource() wipes the cache, keep a copy to re-apply
+        cached_state, cached_commands = dict(self.state_cache), dict(self.state_commands)
+        self.write_batch = None
+        self.srq_supported = None
+        
+        last_err = None
+        for attempt in range(policy["reconnect_attempts"]):
+            delay = min(policy["reconnect_max_delay"], policy["reconnect_delay"] * 2**attempt)
+            self.print_console(f"Reconnect attempt {attempt+1}/{policy['reconnect_attempts']} in {delay:1.1f}s")
+            time.sleep(delay)
+            
+            try:
+                self.reopen_resource()
+                self.resource.query("*IDN?")
+                # the new session only has what was re-sent, everything else is unknown
+                if policy["reapply_state"] is True:
+                    reapplied = self.reapply_state_cache(cached_state, cached_commands)
+                    self.state_cache.update({header : cached_state[header] for header in reapplied})
+                    self.state_commands.update(reapplied)
+                return
+            except Exception as e:
+                if not self.is_session_lost(e) and not isinstance(e, (pyvisa.VisaIOError, OSError)):
+                    raise
+                last_err = e
+                self.print_warning(f"Reconnect attempt {attempt+1} failed: {e}")
+        
+        raise ConnectionError(f"[{self.instrument_name}] could not reopen the session after "
+                              f"{policy['reconnect_attempts']} attempts") from last_err
+    
+    def reopen_resource(self):
+        """
+            drop the dead session from visa_pool and open a fresh one, or reopen
+                a resource we were handed in instr_resource
+        """
+        if self.pooled_session is True:
+            visa_pool.discard_resource(self.instr_address, self.rm_backend, self.resource)
+            self.pooled_session = False
+            self.open_pyvisa_resource()
+        else:
+            self.resource.open()
+            self.invalidate_state_cache()
+    
+    def reapply_state_cache(self, cached_state, cached_commands):
+        """
+            re-send every cached setting, in the order it was first written, as
+                a few compound messages straight to the resource
+            
+            every setting is re-sent exactly as it was written (cached_commands),
+                the normalized headers of the cache are only keys: a node suffix 
+                the instrument does not take is a header error, and quoted
+                measurement names are case sensitive
+            
+            triggers, actions (MMEM:STOR, CALC:MEAS:DEF, ...), the transfer
+                format and settings without a recorded command are skipped, see 
+                is_replayable() and is_cacheable(). returns {header : command}
+                of the entries that were re-sent
+        """
+        reapplied = {}
+        for header in cached_state:
+            cmd = cached_commands.get(header)
+            if cmd is None or header.startswith(_NOT_REAPPLIED_HEADERS) or not self.is_cacheable(header):
+                continue
+            if self.is_replayable(cmd):
+                reapplied[header] = cmd
+        
+        for message in self.join_scpi_commands(list(reapplied.values()), self.configs.get("batch_max_length", _DEFAULT_BATCH_LENGTH)):
+            self.resource.write(message)
+        self.print_debug(f"Re-applied {len(reapplied)} cached settings")
+        return reapplied
     
     def strip_specials(self, msg):
         return msg.replace("\\r","").replace("\\n","").replace("+","")
@@ -41,12 +41,17 @@ class Example_Driver(BaseDriver):
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     
     # should begin with "get" or "set" so that other
-    #   methods can find them easily, for example, 
-    #   the `return_instrument_parameters` method 
-    #   iterating and calling all "get_" methods
+    #   methods can find them easily. Every "get_" query
+    #   should also go into `snapshot_parameters`, which
+    #   `return_instrument_parameters` reads with compound
+    #   queries in one round trip
 
     # examples: 
     
+    snapshot_parameters = {
+        "IF_bandwidth" : ("SENS:BAND?", float),
+    }
+    
     def get_IF_bandwidth(self, fmt=float):
         return ...
     
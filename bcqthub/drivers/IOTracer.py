@@ -0,0 +1,133 @@
+from collections import deque
+from contextlib import contextmanager
+import numpy as np
+import json
+
+
+# one entry in the ring buffer, kept as a plain tuple so recording stays cheap
+_RECORD_FIELDS = ("t_start", "instrument", "method", "command", "phase",
+                  "duration", "bytes_out", "bytes_in", "error")
+
+
+class IOTracer():
+    """
+        Opt-in per-command I/O tracing for BaseDriver
+
+        Every read_check/write_check/query_check/query_check_ascii/query_check_binary
+            of a driver with tracing enabled appends one record to a ring buffer:
+
+            (t_start, instrument, method, command, phase, duration, bytes_out, bytes_in, error)
+
+        One tracer can be shared by every instrument of an experiment, and the
+            current experiment phase ("setup", "wait", "transfer", ...) is set with
+
+            with tracer.phase("setup"):
+                VNA.setup_s2p_measurement()
+
+        summary() gives per-command count/p50/p95/total, phase_totals() gives the
+            time spent per phase, and to_csv()/to_json() export the raw records.
+
+        When a driver has no tracer (the default) the only cost is one
+            `if self.io_tracer is None` per I/O call.
+    """
+
+    def __init__(self, maxlen : int = 100_000):
+        self.records = deque(maxlen=maxlen)
+        self.current_phase = ""
+
+
+    ####################################################
+    ##################  recording  #####################
+    ####################################################
+
+    def record(self, instrument, method, command, t_start, duration, bytes_out=0, bytes_in=0, error=""):
+        self.records.append((t_start, instrument, method, command, self.current_phase,
+                             duration, bytes_out, bytes_in, error))
+
+    @contextmanager
+    def phase(self, name : str):
+        """
+            label every record made inside the block with `name`, phases can be nested
+        """
+        previous_phase, self.current_phase = self.current_phase, name
+        try:
+            yield self
+        finally:
+            self.current_phase = previous_phase
+
+    def clear(self):
+        self.records.clear()
+
+
+    ####################################################
+    ##################  summaries  #####################
+    ####################################################
+
+    def command_header(self, command):
+        """
+            group commands by their header so 'SOUR1:POW1 -30' and 'SOUR1:POW1 -33'
+                end up in the same row of the summary
+        """
+        parts = command.strip().split(maxsplit=1)
+        return parts[0] if parts else ""
+
+    def summary(self, by_phase : bool = False):
+        """
+            returns a DataFrame with one row per (instrument, method, command header),
+                sorted by total time spent
+        """
+        import pandas as pd
+
+        groups = {}
+        for rec in self.records:
+            key = (rec[1], rec[2], self.command_header(rec[3]))
+            if by_phase is True:
+                key = (rec[4], *key)
+            entry = groups.setdefault(key, ([], [0, 0, 0]))
+            entry[0].append(rec[5])
+            entry[1][0] += rec[6]
+            entry[1][1] += rec[7]
+            entry[1][2] += bool(rec[8])
+
+        rows = []
+        for key, (durations, (bytes_out, bytes_in, errors)) in groups.items():
+            durations = np.asarray(durations)
+            p50, p95 = np.percentile(durations, [50, 95])
+            rows.append((*key, len(durations), p50, p95, durations.max(), durations.sum(),
+                         bytes_out, bytes_in, errors))
+
+        columns = ["instrument", "method", "command", "count", "p50_s", "p95_s", "max_s",
+                   "total_s", "bytes_out", "bytes_in", "errors"]
+        if by_phase is True:
+            columns = ["phase", *columns]
+
+        df = pd.DataFrame(rows, columns=columns)
+        return df.sort_values("total_s", ascending=False, ignore_index=True)
+
+    def phase_totals(self):
+        """
+            total I/O time, number of calls and bytes per experiment phase
+        """
+        df = self.to_dataframe()
+        return df.groupby("phase").agg(count=("duration", "size"), total_s=("duration", "sum"),
+                                       bytes_out=("bytes_out", "sum"), bytes_in=("bytes_in", "sum"))
+
+    def print_summary(self, top : int = 20):
+        print(self.summary().head(top).to_string(index=False))
+
+
+    ####################################################
+    ###################  export  #######################
+    ####################################################
+
+    def to_dataframe(self):
+        import pandas as pd
+        return pd.DataFrame(list(self.records), columns=_RECORD_FIELDS)
+
+    def to_csv(self, path):
+        self.to_dataframe().to_csv(path, index=False)
+
+    def to_json(self, path):
+        records = [dict(zip(_RECORD_FIELDS, rec)) for rec in self.records]
+        with open(path, "w") as f:
+            json.dump(records, f, indent=1)
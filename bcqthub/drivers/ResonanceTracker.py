@@ -0,0 +1,145 @@
+import numpy as np
+
+
+def estimate_resonance(freqs, s21, edge_fraction=0.1, min_contrast=20, refinements=2):
+    """
+        cheap estimate of the resonance frequency and linewidth (FWHM, Hz) of a
+            notch resonance, a few linear least squares and no iterative fit
+
+        the background is a complex line through the outer `edge_fraction` of
+            the trace on both sides, so |1 - s21/background|^2 is a Lorentzian
+            (also for a DCM resonator with an impedance mismatch phi). Near the
+            peak 1/Lorentzian is a parabola, one weighted polyfit gives both the
+            center and the width. Every refinement fits the background again
+            together with the Lorentzian of the last estimate, which removes
+            the bias from resonance tails that reach into the edges.
+
+        returns (f_res, linewidth), linewidth is None if the resonance is
+            narrower than the point spacing, or None if there is no resonance
+            that stands `min_contrast` times above the noise of the edges
+    """
+    freqs = np.asarray(freqs, dtype=np.float64)
+    s21 = np.asarray(s21, dtype=np.complex128)
+
+    # work in units of the span around the middle, keeps the polyfits well conditioned
+    f_mid, f_span = (freqs[0] + freqs[-1])/2, np.ptp(freqs)
+    x = (freqs - f_mid) / f_span
+
+    n_edge = max(2, int(edge_fraction * freqs.size))
+    edges = np.r_[:n_edge, freqs.size - n_edge:freqs.size]
+    background = np.polyval(np.polyfit(x[edges], s21[edges], 1), x)
+
+    dip = np.abs(1 - s21/background)**2
+    peak = int(np.argmax(dip))
+    if dip[peak] <= min_contrast * np.mean(dip[edges]):
+        return None
+
+    estimate = _fit_lorentzian_peak(x, dip, peak)
+    for _ in range(refinements if estimate is not None else 0):
+        # s21 = background line + c * Lorentzian, linear in the background and c
+        x_res, width = estimate
+        lorentzian = 1 / (1 + 2j*(x - x_res)/width)
+        basis = np.stack([np.ones_like(x), x, lorentzian], axis=1)
+        coeffs = np.linalg.lstsq(basis, s21, rcond=None)[0]
+        dip = np.abs(1 - s21/(coeffs[0] + coeffs[1]*x))**2
+        estimate = _fit_lorentzian_peak(x, dip, int(np.argmax(dip))) or estimate
+
+    if estimate is None:
+        return freqs[peak], None
+    return f_mid + estimate[0]*f_span, estimate[1]*f_span
+
+
+def _fit_lorentzian_peak(x, dip, peak):
+    """
+        (center, FWHM) of the Lorentzian peak of `dip` at index `peak`, in units
+            of x, or None if fewer than 3 points resolve it
+    """
+    # contiguous points around the peak that are above a quarter of it
+    above = dip >= dip[peak]/4
+    lo = peak - np.argmin(above[peak::-1]) + 1 if not above[:peak+1].all() else 0
+    hi = peak + np.argmin(above[peak:]) if not above[peak:].all() else x.size
+    if hi - lo < 3:
+        return None
+
+    # 1/dip = c2*x^2 + c1*x + c0, weighted by dip^2 since the noise of 1/dip grows like 1/dip^2
+    c2, c1, c0 = np.polyfit(x[lo:hi], 1/dip[lo:hi], 2, w=dip[lo:hi]**2)
+    if c2 <= 0:
+        return None
+
+    x_res = -c1 / (2*c2)
+    c_min = c0 - c1**2 / (4*c2)
+    if c_min <= 0 or not x[0] <= x_res <= x[-1]:
+        return None
+    return x_res, 2*np.sqrt(c_min/c2)
+
+
+class ResonanceTracker():
+    """
+        Closed-loop re-centering of a single resonance between traces
+
+        After every trace update(freqs, s21) estimates f_res and the linewidth
+            (see estimate_resonance) and returns the configs for the next trace,
+            which keep `linewidths` linewidths in view with `points_per_linewidth`
+            points per linewidth:
+
+            tracker = ResonanceTracker(linewidths=10)
+            for power in powers:
+                VNA.update_configs(power=power, **next_configs)
+                ...
+                next_configs = tracker.update(data.freqs, data["S21"])
+
+            or VNA_Keysight.run_tracked_measurements(sweep_settings, tracker)
+
+        If the resonance is lost (or narrower than the point spacing) the span
+            stays centered on the last estimate and grows (shrinks) by
+            `zoom_factor`, within min_span/max_span and min_points/max_points.
+
+        history = (f_res, linewidth) of every trace, None where it was lost
+    """
+
+    def __init__(self, linewidths=10, points_per_linewidth=10, min_points=21, max_points=5001,
+                 min_span=1e3, max_span=None, zoom_factor=4):
+        self.linewidths = linewidths
+        self.points_per_linewidth = points_per_linewidth
+        self.min_points = min_points
+        self.max_points = max_points
+        self.min_span = min_span
+        self.max_span = max_span
+        self.zoom_factor = zoom_factor
+        self.history = []
+
+    @property
+    def f_res(self):
+        found = [est[0] for est in self.history if est is not None]
+        return found[-1] if found else None
+
+    def update(self, freqs, s21):
+        """
+            fold in a trace, returns {"f_center", "f_span", "n_points"} for the next one
+        """
+        freqs = np.asarray(freqs, dtype=np.float64)
+        f_span = np.ptp(freqs)
+        resolution = f_span / max(1, freqs.size - 1)
+
+        estimate = estimate_resonance(freqs, s21)
+        self.history.append(estimate)
+
+        if estimate is None:
+            # lost it, look around the last known position with a wider span at the same resolution
+            f_center = self.f_res if self.f_res is not None else (freqs[0] + freqs[-1])/2
+            f_span = f_span * self.zoom_factor
+        elif estimate[1] is None:
+            # narrower than the point spacing, zoom in at the same number of points
+            f_center = estimate[0]
+            f_span, resolution = f_span / self.zoom_factor, resolution / self.zoom_factor
+        else:
+            f_center, linewidth = estimate
+            f_span = self.linewidths * linewidth
+            resolution = linewidth / self.points_per_linewidth
+
+        f_span = max(f_span, self.min_span)
+        if self.max_span is not None:
+            f_span = min(f_span, self.max_span)
+        n_points = int(np.clip(np.round(f_span / resolution) + 1, self.min_points, self.max_points))
+
+        return {"f_center" : float(f_center), "f_span" : float(f_span), "n_points" : n_points}
@@ -0,0 +1,157 @@
+import numpy as np
+
+
+# one row of SENSe1:SEGMent:LIST SSTOP, ifbw/power are NaN unless they are in `columns`
+SEGMENT_DTYPE = np.dtype([("state", np.int8), ("points", np.int64), ("start", np.float64),
+                          ("stop", np.float64), ("ifbw", np.float64), ("power", np.float64)])
+
+# optional columns of the segment table, in the order the VNA expects them
+_OPTIONAL_COLUMNS = ("ifbw", "power")
+
+
+class SegmentTable():
+    """
+        Numeric VNA segment table, backed by a NumPy structured array
+
+        compute_homophasal_segments used to render segments as f-strings, and
+            every download parsed them back to build the frequency axis. Now the
+            table is the single source of truth for both:
+
+            - to_scpi() gives the argument of SENSe1:SEGMent:LIST SSTOP
+            - frequency_axis() is computed once, with no python loop, and cached
+
+        columns = which optional columns ("ifbw", "power") every segment carries,
+            see VNA_Keysight.segment_settings
+
+        Iterating gives the old ',1,<points>,<start>,<stop>' strings, so code that
+            treats configs["segments"] as a list of strings keeps working. The table
+            is meant to be immutable, build a new one (or call invalidate()) after
+            changing `table` in place.
+    """
+
+    def __init__(self, table=None, columns=()):
+        self.columns = tuple(col for col in _OPTIONAL_COLUMNS if col in columns)
+        self.table = np.zeros(0, dtype=SEGMENT_DTYPE) if table is None else np.asarray(table, dtype=SEGMENT_DTYPE)
+        self.freqs = None
+
+
+    ####################################################
+    ################  constructors  ####################
+    ####################################################
+
+    @classmethod
+    def from_rows(cls, rows, columns=()):
+        """
+            rows = iterable of (points, start, stop, {"ifbw" : .., "power" : ..}),
+                the dict only needs the entries in `columns`
+        """
+        rows = list(rows)
+        table = np.zeros(len(rows), dtype=SEGMENT_DTYPE)
+        table["state"] = 1
+        table["ifbw"] = table["power"] = np.nan
+        for idx, (points, start, stop, settings) in enumerate(rows):
+            table["points"][idx], table["start"][idx], table["stop"][idx] = points, start, stop
+            for col in columns:
+                table[col][idx] = settings[col]
+        return cls(table, columns)
+
+    @classmethod
+    def from_strings(cls, segments, columns=()):
+        """
+            parse ',<state>,<points>,<start>,<stop>[,<ifbw>][,<power>]' strings,
+                e.g. hand-written configs["segments"]
+        """
+        columns = tuple(col for col in _OPTIONAL_COLUMNS if col in columns)
+        table = np.zeros(len(segments), dtype=SEGMENT_DTYPE)
+        table["ifbw"] = table["power"] = np.nan
+        for idx, segment in enumerate(segments):
+            values = [float(x) for x in segment.replace(" ", "").strip(",").split(",")]
+            if len(values) != 4 + len(columns):
+                raise ValueError(f"Segment '{segment}' does not match the columns (state, points, start, stop, {columns})")
+            table["state"][idx], table["points"][idx], table["start"][idx], table["stop"][idx] = values[:4]
+            for col, value in zip(columns, values[4:]):
+                table[col][idx] = value
+        return cls(table, columns)
+
+    @classmethod
+    def concatenate(cls, tables):
+        tables = list(tables)
+        columns = tables[0].columns if tables else ()
+        if any(t.columns != columns for t in tables):
+            raise ValueError("Can not concatenate segment tables with different columns")
+        return cls(np.concatenate([t.table for t in tables]) if tables else None, columns)
+
+
+    ####################################################
+    ###############  sequence of strings  ##############
+    ####################################################
+
+    def __len__(self):
+        return len(self.table)
+
+    def __iter__(self):
+        return iter(self.to_strings())
+
+    def __getitem__(self, idx):
+        return self.to_strings()[idx]
+
+    def __repr__(self):
+        return f"SegmentTable({len(self)} segments, {self.num_points} points, columns={self.columns})"
+
+    def to_strings(self):
+        return [self.format_row(row) for row in self.table]
+
+    def format_row(self, row):
+        segment = f',{int(row["state"])},{int(row["points"])},{float(row["start"])},{float(row["stop"])}'
+        for col in self.columns:
+            segment += f',{float(row[col])}'
+        return segment
+
+    def to_scpi(self):
+        """
+            the argument of SENSe1:SEGMent:LIST, 'SSTOP, <num segments>,<segment 1>,...'
+        """
+        return f'SSTOP, {len(self)}{"".join(self.to_strings())}'
+
+
+    ####################################################
+    ################  derived values  ##################
+    ####################################################
+
+    @property
+    def enabled(self):
+        return self.table[self.table["state"] != 0]
+
+    @property
+    def num_points(self):
+        return int(self.enabled["points"].sum())
+
+    def frequency_axis(self):
+        """
+            frequency of every point of the enabled segments, cached until invalidate()
+        """
+        if self.freqs is None:
+            segs = self.enabled
+            points = segs["points"]
+
+            # index of every point inside its own segment, then one linspace for all of them
+            offsets = np.repeat(np.cumsum(points) - points, points)
+            idx_in_segment = np.arange(points.sum()) - offsets
+            step = np.divide(segs["stop"] - segs["start"], points - 1,
+                             out=np.zeros(len(segs)), where=points > 1)
+
+            self.freqs = np.repeat(segs["start"], points) + idx_in_segment * np.repeat(step, points)
+            self.freqs.flags.writeable = False
+        return self.freqs
+
+    def sweep_time(self, if_bandwidth):
+        """
+            points / IFBW summed over the enabled segments, using the per-segment
+                IFBW if the table has one and `if_bandwidth` otherwise
+        """
+        segs = self.enabled
+        ifbw = segs["ifbw"] if "ifbw" in self.columns else if_bandwidth
+        return float(np.sum(segs["points"] / ifbw))
+
+    def invalidate(self):
+        self.freqs = None
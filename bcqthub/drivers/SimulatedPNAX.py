@@ -0,0 +1,643 @@
+from collections import deque
+import numpy as np
+import copy, re
+import pyvisa, time
+
+
+# the SCPI subset understood by SimulatedPNAX, as spelled in the programming guide
+#   (the upper case part is the short form), and whether the node takes a
+#   numeric suffix (channel, measurement, window, port, ...)
+_MNEMONICS = {
+    "SENSe" : True, "CALCulate" : True, "SOURce" : True, "INITiate" : True, 
+    "MEASure" : True, "WINDow" : True, "TRACe" : True, "CHANnel" : True, 
+    "AUXiliary" : True, "POWer" : True, "AVERaging" : True, "SEGMent" : True,
+    "FREQuency" : False, "STARt" : False, "STOP" : False, "CENTer" : False, 
+    "SPAN" : False, "CW" : False, "SWEep" : False, "POINts" : False, "TYPE" : False,
+    "MODE" : False, "TIME" : False, "AUTO" : False, "DWELl" : False, 
+    "GENeration" : False, "GROups" : False, "COUNt" : False, "AVERage" : False,
+    "STATe" : False, "CLEar" : False, "BANDwidth" : False, "BWIDth" : False, 
+    "CONTrol" : False, "LIST" : False, "OUTPut" : False, "FORMat" : False, 
+    "DATA" : False, "BORDer" : False, "MFD" : False, "CORRection" : False, 
+    "EDELay" : False, "DEFine" : False, "PARameter" : False, "MNUMber" : False,
+    "CATalog" : False, "EXTended" : False, "DELete" : False, "ALL" : False, 
+    "MATH" : False, "MEMorize" : False, "DISPlay" : False, "FEED" : False, 
+    "Y" : False, "SCALe" : False, "CONTinuous" : False, "IMMediate" : False, 
+    "MMEMory" : False, "LOAD" : False, "STORe" : False, "SYSTem" : False, 
+    "ERRor" : False, "PRESet" : False, "UPRESet" : False, "FPRESet" : False, 
+    "STATus" : False, "OPERation" : False, "CONDition" : False, "TRIGger" : False,
+    "INTerval" : False, "POSition" : False,
+}
+
+# short and long spelling -> (short form, takes a suffix), AVERage and 
+#   AVERaging share their short form
+_NODES = {}
+for _long_form, _takes_suffix in _MNEMONICS.items():
+    _short_form = re.match("[A-Z]*", _long_form).group()
+    for _spelling in (_short_form, _long_form.upper()):
+        _NODES[_spelling] = (_short_form, _takes_suffix or _NODES.get(_spelling, (None, False))[1])
+
+# internal keys are the short form of every node with the numeric suffix, 
+#   defaulting to 1, see _parse_header()
+_FREQ_HEADERS = ("SENS1:FREQ1:STAR1", "SENS1:FREQ1:STOP1", "SENS1:FREQ1:CENT1", "SENS1:FREQ1:SPAN1")
+
+# formats of CALC:MEAS:FORM / CALC:FORM that FDATA knows how to produce
+_FDATA_FORMATS = ("MLOG", "MLIN", "PHAS", "UPH", "REAL", "IMAG")
+
+
+def _parse_header(header):
+    """
+        parse a SCPI header the way the instrument does: every node must be 
+            the short or the long form of a mnemonic in _MNEMONICS (any case),
+            and only nodes that take one may carry a numeric suffix
+
+        returns the internal key, e.g. 'SENSe1:FREQuency:STARt?' and 'sens:freq:star?'
+            both give 'SENS1:FREQ1:STAR1?', and raises ValueError with the 
+            SYST:ERR? entry (-113/-114) for anything the instrument would reject
+    """
+    header = header.strip().lstrip(":").upper()
+    if header.startswith("*"):
+        return header
+
+    nodes = []
+    for node in header.rstrip("?").split(":"):
+        name = node.rstrip("0123456789")
+        suffix = node[len(name):]
+        if name not in _NODES:
+            raise ValueError(f'-113,"Undefined header; {node}"')
+        short_form, takes_suffix = _NODES[name]
+        if suffix and not takes_suffix:
+            raise ValueError(f'-114,"Header suffix out of range; {node}"')
+        nodes.append(f"{short_form}{suffix or 1}")
+    return ":".join(nodes) + ("?" if header.endswith("?") else "")
+
+
+def dcm_resonator(freqs, fc, Qi, Qc, phi=0.0):
+    """
+        diameter correction method (DCM) model of a notch resonator
+
+            S21 = 1 - (Q/|Qc|) e^{i phi} / (1 + 2iQ (f - fc)/fc)
+
+            with 1/Q = 1/Qi + cos(phi)/|Qc|
+    """
+    Q = 1 / (1/Qi + np.cos(phi)/Qc)
+    x = (freqs - fc) / fc
+    return 1 - (Q/Qc) * np.exp(1j*phi) / (1 + 2j*Q*x)
+
+
+class SimulatedPNAX():
+    """
+        In-process stand-in for a Keysight PNA-X, to run VNA_Keysight and
+            the experiment scripts without the real instrument
+
+        Behaves like a pyvisa MessageBasedResource (write/read/query/read_bytes/...)
+            so it can be handed to any driver as its resource:
+
+            PNA_X = SimulatedPNAX(resonators=[{"fc" : 6.0e9, "Qi" : 2e5, "Qc" : 5e4}], noise=1e-3)
+            VNA = VNA_Keysight({"instrument_name" : "VNA", "instr_resource" : PNA_X, ...})
+
+        Understands the SCPI subset VNA_Keysight uses: linear sweeps and segment
+            tables, averaging with the STAT:OPER:AVER1:COND? completion bit, group
+            sweeps with *OPC/*ESR?, FDATA/SDATA/FMEM/SMEM and MFD? transfers
+            in ASCII or REAL,32/64 binary blocks, and MMEM:STOR/LOAD/CAT? of 
+            instrument state files. Headers are parsed like on the instrument
+            (short or long form of every node, suffixes only where allowed,
+            see _parse_header), anything else built from known mnemonics is
+            accepted and remembered (so queries of it work). Bad headers and
+            unknown queries push an error into SYST:ERR?.
+
+        The trace is the product of DCM resonators (see dcm_resonator) times a
+            cable background (amplitude, phase, delay), plus complex gaussian
+            noise that shrinks as 1/sqrt(averages). Sweeps take "real" time,
+            points / IFBW * sweep_time_scale, so polling and timeouts behave
+            like on the instrument, and every write can be given a latency.
+
+        resonators = list of dicts with fc, Qi, Qc and optional phi (rad) and
+                        kerr (Hz/mW, fc shifts down by kerr * power)
+        noise = std of the complex noise of a single sweep, in linear units of S21
+        latency = seconds added to every write, like a round trip over LAN
+        transfer_rate = bytes/second when reading replies, None for instant
+        sweep_time_scale = multiplies the simulated sweep time, 0 for instant sweeps
+    """
+
+    def __init__(self, resonators=None, noise=1e-3, latency=0.0, transfer_rate=None,
+                 sweep_time_scale=1.0, background=(1.0, 0.0, 0.0), seed=None):
+        self.resonators = [] if resonators is None else list(resonators)
+        self.noise = noise
+        self.latency = latency
+        self.transfer_rate = transfer_rate
+        self.sweep_time_scale = sweep_time_scale
+        self.background = background    # (amplitude, phase_rad, cable delay_s)
+        self.rng = np.random.default_rng(seed)
+
+        # pyvisa attributes that BaseDriver touches
+        self.read_termination = "\n"
+        self.write_termination = "\n"
+        self.chunk_size = 20*1024
+        self.timeout = 2000
+        self.closed = False
+        self._buffer = b""
+
+        self.idn = "Keysight Technologies,N5222B,SIM00000,A.17.20.07"
+        self.written = deque(maxlen=10_000)
+        self.files = {}     # MMEM:STOR state files, they survive *RST like on the disk
+        self.transfers = [] # (data type, sweep running?) of every MFD? download, to check pipelining
+        self.reset()
+
+    def reset(self):
+        """
+            *RST / SYST:PRES state: one S11 measurement, 201 point linear sweep
+        """
+        self.settings = {
+            "SENS1:FREQ1:STAR1" : 10e6,
+            "SENS1:FREQ1:STOP1" : 26.5e9,
+            "SENS1:SWE1:POIN1" : 201,
+            "SENS1:SWE1:TYPE1" : "LIN",
+            "SENS1:BAND1" : 100e3,
+            "SENS1:AVER1:STAT1" : "OFF",
+            "SENS1:AVER1:COUN1" : 1,
+            "SENS1:SWE1:GRO1:COUN1" : 1,
+            "SOUR1:POW1" : -15.0,
+            "FORM1:DATA1" : "ASC",
+            "FORM1:BORD1" : "NORM",
+        }
+        self.segments = []
+        self.measurements = {1 : ["S11", "MLOG"]}
+        self.selected_mnum = 1
+        self.memory = {}
+        self.error_queue = deque()
+        self.esr = 0
+
+        # sweep bookkeeping, see sweep_progress()
+        self.sweep_start = None
+        self.sweep_count = None
+        self.opc_pending = False
+
+
+    ####################################################
+    ###############  pyvisa interface  #################
+    ####################################################
+
+    @property
+    def session(self):
+        if self.closed:
+            raise pyvisa.InvalidSession()
+        return 1
+
+    def close(self):
+        self.closed = True
+
+    def open(self):
+        # like a dropped LAN link, the instrument keeps its state
+        self.closed = False
+
+    def write(self, message):
+        if self.closed:
+            raise pyvisa.InvalidSession()
+        if self.latency > 0:
+            time.sleep(self.latency)
+        self.written.append(message)
+
+        replies = []
+        for cmd in message.strip().split(";"):
+            if not cmd.strip():
+                continue
+            reply = self.execute(cmd.strip())
+            if reply is not None:
+                replies.append(reply)
+
+        # several queries in one message come back as one ';' separated reply
+        if len(replies) == 1 and isinstance(replies[0], bytes):
+            self._queue_reply(replies[0])
+        elif replies:
+            self._queue_reply(";".join(replies).encode() + b"\n")
+        return len(message)
+
+    def read_bytes(self, count):
+        chunk, self._buffer = self._buffer[:count], self._buffer[count:]
+        self._transfer_delay(len(chunk))
+        return chunk
+
+    def read_raw(self):
+        chunk, self._buffer = self._buffer, b""
+        self._transfer_delay(len(chunk))
+        return chunk
+
+    def read(self):
+        if not self._buffer:
+            raise pyvisa.VisaIOError(pyvisa.constants.StatusCode.error_timeout)
+        message, _, self._buffer = self._buffer.partition(b"\n")
+        self._transfer_delay(len(message) + 1)
+        return message.decode()
+
+    def query(self, message):
+        self.write(message)
+        return self.read()
+
+    def query_ascii_values(self, message, container=list):
+        return container([float(x) for x in self.query(message).split(",")])
+
+    def clear(self):
+        self._buffer = b""
+
+    def _queue_reply(self, reply):
+        self._buffer += reply
+
+    def _transfer_delay(self, num_bytes):
+        if self.transfer_rate:
+            time.sleep(num_bytes / self.transfer_rate)
+
+
+    ####################################################
+    ###############  SCPI interpreter  #################
+    ####################################################
+
+    def execute(self, cmd):
+        """
+            run a single SCPI command, returns the reply (str, or bytes for
+                binary blocks) for queries and None otherwise
+        """
+        parts = cmd.split(maxsplit=1)
+        try:
+            header = _parse_header(parts[0])
+        except ValueError as e:
+            self.error_queue.append(str(e))
+            return "0" if parts[0].endswith("?") else None
+        args = [a.strip() for a in parts[1].split(",")] if len(parts) > 1 else []
+        is_query = header.endswith("?")
+        header = header.rstrip("?")
+
+        handler = self.common_commands().get(header)
+        if handler is not None:
+            return handler(is_query)
+
+        if header.startswith("CALC1"):
+            return self.execute_calculate(header, args, is_query)
+        if header == "SENS1:SEGM1:LIST1":
+            return self.execute_segment_list(args, is_query)
+        if header.startswith(("SENS1", "SOUR1", "FORM1")):
+            return self.execute_setting(header, args, is_query)
+        if header == "STAT1:OPER1:AVER1:COND1" and is_query:
+            return "+2" if self.sweep_progress() >= 1 else "+0"
+        if header.startswith("INIT1"):
+            return self.execute_initiate(header, args)
+        if header.startswith("MMEM1"):
+            return self.execute_mass_memory(header, args, is_query)
+        if header.startswith(("DISP", "OUTP", "SYST1:UPR1", "SYST1:FPR1", "SYST1:PRES1")):
+            if header.startswith("SYST"):
+                self.reset()
+            return "1" if is_query else None
+
+        if is_query:
+            self.error_queue.append('-113,"Undefined header"')
+            return "0"
+        self.settings[header] = args[0] if len(args) == 1 else args
+        return None
+
+    def common_commands(self):
+        return {
+            "*IDN" : lambda is_query : self.idn,
+            "*RST" : lambda is_query : self.reset(),
+            "*CLS" : lambda is_query : self._clear_status(),
+            "*ESE" : lambda is_query : "+1" if is_query else None,
+            "*SRE" : lambda is_query : "+0" if is_query else None,
+            "*OPC" : self._opc,
+            "*ESR" : lambda is_query : self._read_esr(),
+            "*WAI" : lambda is_query : None,
+            "SYST1:ERR1" : lambda is_query : self.error_queue.popleft() if self.error_queue else '+0,"No error"',
+        }
+
+    def _clear_status(self):
+        self.esr = 0
+        self.error_queue.clear()
+
+    def _opc(self, is_query):
+        # the real '*OPC?' blocks until pending operations are done, we just answer
+        if is_query:
+            return "+1"
+        self.opc_pending = True
+        return None
+
+    def _read_esr(self):
+        if self.opc_pending and self.sweep_progress() >= 1:
+            self.esr |= 1
+            self.opc_pending = False
+        esr, self.esr = self.esr, 0
+        return f"+{esr}"
+
+    def execute_setting(self, header, args, is_query):
+        if is_query:
+            if header == "SENS1:SWE1:TIME1":
+                return f"{self.sweep_time():+.10E}"
+            if header == "FORM1" or header == "FORM1:DATA1":
+                return "ASC,0" if self.settings["FORM1:DATA1"].startswith("ASC") else f"REAL,{self.real_bits()}"
+            value = self.frequency_settings().get(header, self.settings.get(header, 0))
+            return f"{value:+.10E}" if isinstance(value, float) else str(value)
+
+        if header in _FREQ_HEADERS:
+            self.set_frequency(header, self.parse_number(args[0]))
+        elif header == "FORM1" or header == "FORM1:DATA1":
+            self.settings["FORM1:DATA1"] = "ASC" if args[0].upper().startswith("ASC") else f"REAL,{args[1] if len(args) > 1 else 64}"
+        elif header == "SENS1:SWE1:TYPE1":
+            self.settings[header] = args[0].upper()[:4]
+        elif header == "SENS1:AVER1:CLE1":
+            self.restart_sweep(continuous=self.sweep_count is None)
+        elif header == "SENS1:SWE1:MODE1":
+            self.execute_sweep_mode(args[0].upper())
+        else:
+            value = self.parse_number(args[0]) if len(args) == 1 else args
+            self.settings[header] = int(value) if header.endswith(("POIN1", "COUN1")) else value
+        return None
+
+    def execute_initiate(self, header, args):
+        if header == "INIT1:CONT1":
+            self.settings[header] = args[0].upper()
+            if args[0].upper() in ("ON", "1"):
+                self.restart_sweep(continuous=True)
+        elif header == "INIT1:IMM1" or header == "INIT1":
+            self.restart_sweep(continuous=False, num_sweeps=1)
+        return None
+
+    def execute_mass_memory(self, header, args, is_query):
+        """
+            MMEM:STOR/LOAD "<file>" save and recall the channel state,
+                MMEM:CAT? lists the saved files
+        """
+        if header == "MMEM1:CAT1" and is_query:
+            return '"' + ",".join(self.files) + '"'
+        
+        filename = args[0].strip('"') if args else ""
+        if header == "MMEM1:STOR1":
+            self.files[filename] = copy.deepcopy((self.settings, self.segments, self.measurements))
+        elif header == "MMEM1:LOAD1":
+            if filename not in self.files:
+                self.error_queue.append(f'-256,"File name not found; {filename}"')
+                return None
+            self.settings, self.segments, self.measurements = copy.deepcopy(self.files[filename])
+            self.memory = {}
+        return None
+
+    def execute_sweep_mode(self, mode):
+        if mode.startswith("GRO"):
+            self.restart_sweep(continuous=False, num_sweeps=int(self.settings["SENS1:SWE1:GRO1:COUN1"]))
+        elif mode.startswith("SING"):
+            self.restart_sweep(continuous=False, num_sweeps=1)
+        elif mode.startswith("CONT"):
+            self.restart_sweep(continuous=True)
+        self.settings["SENS1:SWE1:MODE1"] = mode
+
+    def execute_segment_list(self, args, is_query):
+        """
+            SENS1:SEGM:LIST SSTOP, <num>, [<state>, <points>, <start>, <stop>, (<ifbw>), (<dwell>), (<power>)] ...
+
+            the optional columns are present when SENS:SEGM:BWID:CONT,
+                SENS:SEGM:SWE:TIME:CONT and SENS:SEGM:POW:CONT are ON
+        """
+        columns = self.segment_columns()
+        if is_query:
+            rows = [",".join(f"{seg[col]:+.10E}" for col in columns) for seg in self.segments]
+            return ",".join([str(len(self.segments)), *rows])
+
+        num_segments = int(float(args[1]))
+        values = [float(x) for x in args[2:]]
+        if len(values) != num_segments * len(columns):
+            self.error_queue.append('-109,"Missing parameter"')
+            return None
+
+        self.segments = [dict(zip(columns, values[idx*len(columns):(idx+1)*len(columns)]))
+                         for idx in range(num_segments)]
+        return None
+
+    def segment_columns(self):
+        columns = ["state", "points", "start", "stop"]
+        for header, column in [("SENS1:SEGM1:BWID1:CONT1", "ifbw"), ("SENS1:SEGM1:SWE1:TIME1:CONT1", "dwell"),
+                               ("SENS1:SEGM1:POW1:CONT1", "power")]:
+            if str(self.settings.get(header, "OFF")).upper() in ("ON", "1", "1.0"):
+                columns.append(column)
+        return columns
+
+    def execute_calculate(self, header, args, is_query):
+        # CALC1:MEAS<n>:..., strip the measurement number but remember it
+        nodes = header.split(":")
+        mnum = self.selected_mnum
+        if len(nodes) > 1 and nodes[1].startswith("MEAS"):
+            mnum = int(nodes[1][4:])
+            nodes = [nodes[0], *nodes[2:]]
+        header = ":".join(nodes)
+
+        if header == "CALC1:PAR1:CAT1:EXT1" and is_query:
+            catalog = ",".join(f"CH1_S{mnum}_{mnum},{sparam}" for mnum, (sparam, fmt) in self.measurements.items())
+            return f'"{catalog}"' if catalog else '"NO CATALOG"'
+        if header == "CALC1:PAR1:DEL1:ALL1":
+            self.measurements.clear()
+            self.memory.clear()
+        elif header == "CALC1:DEF1":
+            self.measurements[mnum] = [args[0].strip('"').upper(), "MLOG"]
+        elif header == "CALC1:PAR1:MNUM1":
+            if is_query:
+                return str(self.selected_mnum)
+            self.selected_mnum = int(float(args[0]))
+        elif header == "CALC1:FORM1":
+            if is_query:
+                return self.measurements[mnum][1]
+            self.measurements[mnum][1] = args[0].upper()[:4].rstrip("A")
+        elif header == "CALC1:MATH1:MEM1":
+            self.memory[mnum] = (self.frequency_axis(), self.measurement_trace(mnum))
+        elif header == "CALC1:DATA1" and is_query:
+            return self.trace_reply(self.trace_data(mnum, args[0].upper()))
+        elif header == "CALC1:DATA1:MFD1" and is_query:
+            mnums = [int(m) for m in ",".join(args[:-1]).strip('"').split(",")]
+            self.transfers.append((args[-1].upper(), self.sweep_start is not None and self.sweep_progress() < 1))
+            return self.trace_reply(np.concatenate([self.trace_data(m, args[-1].upper()) for m in mnums]))
+        else:
+            self.settings[header] = args[0] if len(args) == 1 else args
+        return None
+
+
+    ####################################################
+    ###############  sweeps and timing  ################
+    ####################################################
+
+    def frequency_axis(self):
+        """
+            the stimulus of channel 1, a linear sweep or the concatenated segments,
+                or the CW frequency at every point of a power/CW sweep
+        """
+        if self.settings["SENS1:SWE1:TYPE1"].startswith(("POW", "CW")):
+            return np.full(int(self.settings["SENS1:SWE1:POIN1"]), float(self.settings.get("SENS1:FREQ1:CW1", 1e9)))
+        if self.settings["SENS1:SWE1:TYPE1"].startswith("SEGM") and self.segments:
+            return np.concatenate([np.linspace(seg["start"], seg["stop"], int(seg["points"]))
+                                   for seg in self.segments if seg["state"]])
+        return np.linspace(self.settings["SENS1:FREQ1:STAR1"], self.settings["SENS1:FREQ1:STOP1"],
+                           int(self.settings["SENS1:SWE1:POIN1"]))
+
+    def frequency_settings(self):
+        start, stop = self.settings["SENS1:FREQ1:STAR1"], self.settings["SENS1:FREQ1:STOP1"]
+        if self.settings["SENS1:SWE1:TYPE1"].startswith("SEGM") and self.segments:
+            freqs = self.frequency_axis()
+            start, stop = float(freqs.min()), float(freqs.max())
+        return {"SENS1:FREQ1:STAR1" : start, "SENS1:FREQ1:STOP1" : stop,
+                "SENS1:FREQ1:CENT1" : (start + stop)/2, "SENS1:FREQ1:SPAN1" : stop - start,
+                "SENS1:SWE1:POIN1" : self.frequency_axis().size}
+
+    def set_frequency(self, header, value):
+        settings = self.frequency_settings()
+        settings[header] = value
+        if header.endswith(("CENT1", "SPAN1")):
+            center, span = settings["SENS1:FREQ1:CENT1"], settings["SENS1:FREQ1:SPAN1"]
+            settings["SENS1:FREQ1:STAR1"], settings["SENS1:FREQ1:STOP1"] = center - span/2, center + span/2
+        self.settings["SENS1:FREQ1:STAR1"] = settings["SENS1:FREQ1:STAR1"]
+        self.settings["SENS1:FREQ1:STOP1"] = settings["SENS1:FREQ1:STOP1"]
+
+    def sweep_time(self):
+        """
+            roughly what the PNA-X reports for auto sweep time, 1.2/IFBW per point
+                (per-segment IFBW when the segment table has one) plus 5 ms overhead,
+                times sweep_time_scale so that SWE:TIME? matches the simulated sweeps
+        """
+        ifbw = float(self.settings["SENS1:BAND1"])
+        if self.settings["SENS1:SWE1:TYPE1"].startswith("SEGM") and self.segments:
+            t_points = sum(seg["points"] * 1.2 / seg.get("ifbw", ifbw) for seg in self.segments if seg["state"])
+        else:
+            t_points = int(self.settings["SENS1:SWE1:POIN1"]) * 1.2 / ifbw
+        return (5e-3 + t_points) * self.sweep_time_scale
+
+    def num_averages(self):
+        if str(self.settings["SENS1:AVER1:STAT1"]).upper() in ("ON", "1", "1.0"):
+            return max(1, int(self.settings["SENS1:AVER1:COUN1"]))
+        return 1
+
+    def restart_sweep(self, continuous, num_sweeps=None):
+        self.sweep_start = time.perf_counter()
+        self.sweep_count = None if continuous else num_sweeps
+
+    def sweep_progress(self):
+        """
+            fraction of the current averaging/group sweep that is done,
+                >= 1 once the averaging-complete bit (and *OPC) would be set
+        """
+        if self.sweep_start is None:
+            return 0
+        num_sweeps = self.num_averages() if self.sweep_count is None else self.sweep_count
+        duration = self.sweep_time() * num_sweeps
+        if duration <= 0:
+            return 1
+        return (time.perf_counter() - self.sweep_start) / duration
+
+    def completed_sweeps(self):
+        if self.sweep_start is None:
+            return 0
+        t_sweep = self.sweep_time()
+        if t_sweep <= 0:
+            return self.num_averages() if self.sweep_count is None else self.sweep_count
+        n = int((time.perf_counter() - self.sweep_start) / t_sweep)
+        return n if self.sweep_count is None else min(n, self.sweep_count)
+
+
+    ####################################################
+    ###############  trace generation  #################
+    ####################################################
+
+    def s21_model(self, freqs, power=None):
+        """
+            noiseless S21 of every resonator times the cable background
+        """
+        power = float(self.settings["SOUR1:POW1"]) if power is None else power
+        amplitude, phase, delay = self.background
+        s21 = amplitude * np.exp(1j*(phase - 2*np.pi*freqs*delay))
+        for res in self.resonators:
+            fc = res["fc"] - res.get("kerr", 0) * 10**(power/10)
+            s21 = s21 * dcm_resonator(freqs, fc, res["Qi"], res["Qc"], res.get("phi", 0.0))
+        return s21
+
+    def power_axis(self):
+        """
+            source power of every point, SOUR:POW:STAR to STOP in a power sweep
+        """
+        if self.settings["SENS1:SWE1:TYPE1"].startswith("POW"):
+            return np.linspace(float(self.settings.get("SOUR1:POW1:STAR1", -30)), 
+                               float(self.settings.get("SOUR1:POW1:STOP1", 0)), int(self.settings["SENS1:SWE1:POIN1"]))
+        return float(self.settings["SOUR1:POW1"])
+
+    def measurement_trace(self, mnum):
+        """
+            complex trace of measurement `mnum`, S21/S12 see the resonators,
+                S11/S22 see (mostly) nothing
+        """
+        freqs = self.frequency_axis()
+        sparam = self.measurements.get(mnum, ["S21"])[0]
+        if sparam in ("S21", "S12"):
+            trace = self.s21_model(freqs, power=self.power_axis())
+        else:
+            trace = np.full(freqs.size, 0.01, dtype=complex)
+
+        # averaging n sweeps cuts the noise by sqrt(n), use at least one sweep
+        n = max(1, min(self.completed_sweeps(), self.num_averages()))
+        noise = self.noise / np.sqrt(n)
+        if noise > 0:
+            trace = trace + noise/np.sqrt(2) * (self.rng.standard_normal(freqs.size)
+                                                 + 1j*self.rng.standard_normal(freqs.size))
+        return trace
+
+    def trace_data(self, mnum, data_type):
+        """
+            FDATA/FMEM = formatted (one value per point), SDATA/SMEM = complex (re, im pairs)
+        """
+        if data_type.startswith(("FMEM", "SMEM")):
+            freqs, trace = self.memory.get(mnum, (None, None))
+            if trace is None or not np.array_equal(freqs, self.frequency_axis()):
+                # a memory trace does not survive a change of the stimulus (points, span, segments, ...)
+                self.error_queue.append('-221,"Settings conflict; no memory trace for the current stimulus"')
+                trace = np.full(self.frequency_axis().size, np.nan, dtype=np.complex128)
+        else:
+            trace = self.measurement_trace(mnum)
+
+        if data_type.startswith("S"):
+            return trace.view(np.float64)
+
+        edelay = self.parse_number(self.settings.get("CALC1:CORR1:EDEL1:TIME1", 0))
+        trace = trace * np.exp(2j*np.pi*self.frequency_axis()*edelay)
+        fmt = self.measurements.get(mnum, ["", "MLOG"])[1]
+        formats = {
+            "MLOG" : lambda z : 20*np.log10(np.abs(z)),
+            "MLIN" : np.abs,
+            "PHAS" : lambda z : np.rad2deg(np.angle(z)),
+            "UPH" : lambda z : np.rad2deg(np.unwrap(np.angle(z))),
+            "REAL" : np.real,
+            "IMAG" : np.imag,
+        }
+        return formats[fmt if fmt in _FDATA_FORMATS else "MLOG"](trace)
+
+    def trace_reply(self, values):
+        """
+            ASCII: comma separated, binary: IEEE-488.2 definite length block
+        """
+        data_format = self.settings["FORM1:DATA1"]
+        if data_format.startswith("ASC"):
+            return ",".join(f"{v:+.12E}" for v in values)
+
+        byte_order = ">" if self.settings["FORM1:BORD1"].upper().startswith("NORM") else "<"
+        payload = np.asarray(values, dtype=f"{byte_order}f{self.real_bits()//8}").tobytes()
+        length = str(len(payload))
+        return f"#{len(length)}{length}".encode() + payload + b"\n"
+
+    def real_bits(self):
+        return int(float(self.settings["FORM1:DATA1"].split(",")[-1]))
+
+    def parse_number(self, token):
+        """
+            '6.1GHZ', '100NS', '-30' -> float, anything else is returned as is
+        """
+        if not isinstance(token, str):
+            return token
+        units = {"GHZ" : 1e9, "MHZ" : 1e6, "KHZ" : 1e3, "HZ" : 1, "NS" : 1e-9, "US" : 1e-6, "MS" : 1e-3, "S" : 1}
+        token = token.strip().upper()
+        for unit, scale in units.items():
+            if token.endswith(unit):
+                try:
+                    return float(token[:-len(unit)]) * scale
+                except ValueError:
+                    break
+        try:
+            return float(token)
+        except ValueError:
+            return token
@@ -0,0 +1,91 @@
+import numpy as np
+
+
+class StreamingAverage():
+    """
+        Running mean and variance of a stream of (complex) traces, per point
+
+        Uses Welford's update, so every sweep is folded in as it arrives without
+            keeping the individual traces around, and without the loss of
+            precision of summing x and x**2:
+
+            averager = StreamingAverage()
+            for trace in traces:
+                averager.update(trace)
+            averager.mean, averager.std_error, averager.snr()
+
+        The variance of a complex trace is E[|x - mean|^2], i.e. the noise of the
+            real and imaginary parts combined.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = None
+        self.m2 = None      # sum of |x - mean|^2, variance = m2 / (count - 1)
+
+    def update(self, trace):
+        trace = np.asarray(trace, dtype=np.complex128)
+        if self.mean is None:
+            self.mean = np.zeros_like(trace)
+            self.m2 = np.zeros(trace.shape)
+        elif trace.shape != self.mean.shape:
+            raise ValueError(f"Trace of shape {trace.shape} does not match the running average {self.mean.shape}")
+
+        self.count += 1
+        delta = trace - self.mean
+        self.mean += delta / self.count
+        self.m2 += (delta * np.conj(trace - self.mean)).real
+
+    @property
+    def variance(self):
+        if self.count < 2:
+            return np.full(self.m2.shape, np.inf)
+        return self.m2 / (self.count - 1)
+
+    @property
+    def std_error(self):
+        """
+            standard error of the mean of every point
+        """
+        return np.sqrt(self.variance / self.count)
+
+    def snr(self):
+        """
+            |mean| / standard error of every point
+        """
+        with np.errstate(divide="ignore"):
+            return np.abs(self.mean) / self.std_error
+
+
+####################################################
+###############  stop conditions  ##################
+####################################################
+
+# a stop condition is any callable stop_condition(averager) -> bool, checked after every trace
+
+def target_snr(snr, quantile=0.1, min_count=3):
+    """
+        stop once all but a fraction `quantile` of the points have reached a
+            signal to noise ratio of `snr`, quantile=0 waits for the worst point
+    """
+    def is_finished(averager):
+        if averager.count < max(2, min_count):
+            return False
+        return bool(np.quantile(averager.snr(), quantile) >= snr)
+    return is_finished
+
+
+def target_uncertainty(estimator, rel_tol, min_count=3):
+    """
+        stop once a derived quantity is known well enough, e.g. a fit parameter
+
+        estimator(averager) -> (value, uncertainty), e.g. Qi and its standard
+            error from fitting averager.mean with weights 1/averager.std_error,
+            stops once uncertainty <= rel_tol * |value|
+    """
+    def is_finished(averager):
+        if averager.count < max(2, min_count):
+            return False
+        value, uncertainty = estimator(averager)
+        return bool(uncertainty <= rel_tol * abs(value))
+    return is_finished
@@ -0,0 +1,132 @@
+from pathlib import Path
+import numpy as np
+import json
+
+
+# duration = averages * (c0 * sum(points/IFBW) + c1 * points + c2 * segments + c3) + c4
+COEFFICIENT_NAMES = ("per_point_per_ifbw", "per_point", "per_segment", "per_sweep", "per_measurement")
+
+# roughly a PNA-X: 1/IFBW per point, 1 ms per segment, 5 ms per sweep, 0.5 s to start/finish
+DEFAULT_COEFFICIENTS = (1.0, 0.0, 1e-3, 5e-3, 0.5)
+
+# typical size of every coefficient, how far the prior is allowed to be off is relative to these
+_COEFFICIENT_SCALES = np.array([1.0, 1e-4, 1e-3, 1e-2, 1.0])
+
+# short forms of the VNA sweep types (SENSe:SWEep:TYPE), every one is timed separately
+SWEEP_TYPES = ("LIN", "LOG", "POW", "CW", "SEGM", "PHAS")
+
+
+class SweepTimePredictor():
+    """
+        Predicts how long a VNA measurement takes from its settings, and learns
+            from how long measurements actually took
+
+            predictor = SweepTimePredictor("PNA_X_timing.json")
+            predictor.predict("SEGM", n_points=5001, if_bandwidth=1e3, averages=1000)
+            ...
+            predictor.record(t_elapsed, "SEGM", n_points=5001, if_bandwidth=1e3, averages=1000)
+
+        The model is linear in the coefficients (see COEFFICIENT_NAMES), with
+            one set of coefficients per VNA sweep type (SWEEP_TYPES, a segment
+            sweep spends its time differently than a linear or CW sweep), and
+            optionally per wait mode within a sweep type (e.g. "polled" and
+            "event_driven" for VNA_Keysight.run_measurement). record() refits
+            them with least squares on the relative error of the recorded
+            durations, pulled towards DEFAULT_COEFFICIENTS (prior_weight), so a
+            handful of measurements is enough and no measurement is a surprise.
+
+        filepath = json file the measured durations are kept in, one per
+            instrument, None keeps them in memory only
+        max_samples = most recent measurements kept per sweep type and wait mode
+    """
+
+    def __init__(self, filepath=None, prior=DEFAULT_COEFFICIENTS, prior_weight=1e-2, max_samples=200):
+        self.filepath = None if filepath is None else Path(filepath)
+        self.prior = np.asarray(prior, dtype=np.float64)
+        self.prior_weight = prior_weight
+        self.max_samples = max_samples
+
+        self.samples = {}           # key() -> list of (features, duration)
+        self.coefficients = {}      # key() -> fitted coefficients
+        if self.filepath is not None and self.filepath.exists():
+            self.load()
+
+    def key(self, sweep_type="LIN", wait_mode=None):
+        """
+            "LIN", "SEGM/polled", ... the samples and coefficients are stored under,
+                sweep_type in any SCPI form ("LINear", "SEGM", "cw")
+        """
+        sweep_type = sweep_type.strip().upper()
+        sweep_type = next((short for short in SWEEP_TYPES if sweep_type.startswith(short)), sweep_type)
+        return sweep_type if wait_mode is None else f"{sweep_type}/{wait_mode}"
+
+    def features(self, n_points, if_bandwidth, averages=1, segments=None):
+        """
+            the terms the coefficients multiply, uses the points and per-segment
+                IFBW of `segments` (a SegmentTable) if given
+        """
+        averages = max(1, int(averages))
+        if segments is not None and len(segments) > 0:
+            ifbw_time, n_points, n_segments = segments.sweep_time(if_bandwidth), segments.num_points, len(segments)
+        else:
+            ifbw_time, n_segments = n_points / if_bandwidth, 0
+        return np.array([averages*ifbw_time, averages*n_points, averages*n_segments, averages, 1.0])
+
+    def predict(self, sweep_type="LIN", wait_mode=None, **settings):
+        """
+            predicted duration in seconds, settings = see features()
+        """
+        coefficients = self.coefficients.get(self.key(sweep_type, wait_mode), self.prior)
+        return float(self.features(**settings) @ coefficients)
+
+    def record(self, duration, sweep_type="LIN", wait_mode=None, **settings):
+        """
+            add a measured duration, refit and save
+        """
+        key = self.key(sweep_type, wait_mode)
+        samples = self.samples.setdefault(key, [])
+        samples.append((self.features(**settings), float(duration)))
+        del samples[:-self.max_samples]
+
+        self.coefficients[key] = self.fit(samples)
+        if self.filepath is not None:
+            self.save()
+
+    def fit(self, samples):
+        """
+            least squares on the relative error, plus prior_weight * the distance
+                to the prior in units of _COEFFICIENT_SCALES, coefficients >= 0
+        """
+        X = np.array([features for features, duration in samples])
+        y = np.array([duration for features, duration in samples])
+
+        # relative error, so a 1 hour measurement doesn't drown out all the short ones
+        A = X / y[:, None]
+        b = np.ones(y.size)
+
+        penalty = np.sqrt(self.prior_weight) * np.diag(1/_COEFFICIENT_SCALES)
+        A = np.vstack([A, penalty])
+        b = np.concatenate([b, penalty @ self.prior])
+
+        coefficients = np.linalg.lstsq(A, b, rcond=None)[0]
+        return np.maximum(coefficients, 0)
+
+
+    ####################################################
+    ##################  persistence  ###################
+    ####################################################
+
+    def save(self):
+        data = {key : [(list(features), duration) for features, duration in samples]
+                for key, samples in self.samples.items()}
+        self.filepath.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.filepath, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=4)
+
+    def load(self):
+        with open(self.filepath, "r", encoding="utf-8") as f:
+            data = json.load(f)
+
+        self.samples = {key : [(np.array(features), duration) for features, duration in samples]
+                        for key, samples in data.items()}
+        self.coefficients = {key : self.fit(samples) for key, samples in self.samples.items() if samples}
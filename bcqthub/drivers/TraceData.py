@@ -0,0 +1,90 @@
+import numpy as np
+
+
+class TraceData():
+    """
+        Compact container for the traces of one VNA measurement, the native
+            result of VNA_Keysight.return_data_s2p(as_dataframe=False)
+
+            freqs    : one frequency array shared by every trace
+            traces   : {sparam : complex np.array}, e.g. "S21", "S21_mem"
+            metadata : dict, e.g. {"instrument_snapshot" : {...}}
+            formatted : {sparam : (magn_dB, phase_rad)} as the VNA formatted
+                        them (MLOG/UPHase), optional
+
+        Indexing gives the complex trace, traces["S21"] == data["S21"].
+            magn_dB()/phase_rad() return the formatted traces if there are any,
+            and convert on demand otherwise. The unwrapped phase of the VNA can
+            differ from np.unwrap by multiples of 2 pi, so what the VNA sent
+            wins. to_dataframe() builds the DataFrame return_data_s2p used to
+            return, for legacy callers.
+
+        Uses __slots__ and keeps the arrays as they came off the wire, so
+            tracking runs with thousands of traces don't pay for per-instance
+            dicts or for copies into DataFrames nobody looks at.
+    """
+
+    __slots__ = ("freqs", "traces", "metadata", "formatted")
+
+    def __init__(self, freqs, traces=None, metadata=None, formatted=None):
+        self.freqs = np.asarray(freqs, dtype=np.float64)
+        self.traces = {} if traces is None else traces
+        self.metadata = {} if metadata is None else metadata
+        self.formatted = {} if formatted is None else formatted
+
+    def __getitem__(self, sparam):
+        return self.traces[sparam]
+
+    def __contains__(self, sparam):
+        return sparam in self.traces
+
+    def __len__(self):
+        return self.freqs.size
+
+    def __repr__(self):
+        return f"TraceData({len(self)} points, traces={list(self.traces)})"
+
+    @property
+    def sparams(self):
+        return list(self.traces)
+
+    def magn_dB(self, sparam):
+        if sparam in self.formatted:
+            return self.formatted[sparam][0]
+        return 20*np.log10(np.abs(self.traces[sparam]))
+
+    def phase_rad(self, sparam):
+        if sparam in self.formatted:
+            return self.formatted[sparam][1]
+        return np.unwrap(np.angle(self.traces[sparam]))
+
+    def select(self, index):
+        """
+            the points at `index` (a slice gives views, no copies) with the same metadata
+        """
+        return TraceData(self.freqs[index], {sparam : trace[index] for sparam, trace in self.traces.items()},
+                         self.metadata, {sparam : (magn_dB[index], phase_rad[index]) 
+                                         for sparam, (magn_dB, phase_rad) in self.formatted.items()})
+
+    def to_dataframe(self, archive_complex=False):
+        """
+            | Frequency | S21 magn_dB | S21 phase_rad | ... the old return_data_s2p
+                layout, or | Frequency | S21 complex | ... with archive_complex=True
+
+            the frequency and complex columns are handed to pandas with copy=False,
+                pandas >= 2 keeps them as views of the arrays here, older versions
+                consolidate (copy) columns of the same dtype. metadata ends up in df.attrs
+        """
+        import pandas as pd     # only needed here, keeps `import TraceData` fast
+
+        columns = {"Frequency" : self.freqs}
+        for sparam, trace in self.traces.items():
+            if archive_complex is False:
+                columns[f"{sparam} magn_dB"] = self.magn_dB(sparam)
+                columns[f"{sparam} phase_rad"] = self.phase_rad(sparam)
+            else:
+                columns[f"{sparam} complex"] = trace
+
+        df = pd.DataFrame(columns, copy=False)
+        df.attrs.update(self.metadata)
+        return df
@@ -0,0 +1,172 @@
+from concurrent.futures import ThreadPoolExecutor
+import pyvisa, threading, weakref
+
+
+class VisaSessionPool():
+    """
+        Process-wide pool of pyvisa ResourceManagers and open sessions
+
+        Every BaseDriver used to open its own ResourceManager in __init__ and
+            close it in __del__, so a script with four instruments made four
+            managers, and re-running a notebook cell reopened every session.
+            Now drivers borrow from this pool instead:
+
+            - one ResourceManager per backend ("@py", None, "@sim", ...)
+            - one session per (backend, address), handed to every driver
+                object that asks for the same address
+            - both are reference counted, and only closed once the last
+                driver using them has released them
+            - one I/O thread per session for the async_* methods of
+                BaseDriver, see io_executor()
+
+        There is one module-level instance, `visa_pool`, used by BaseDriver.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.resource_managers = {}    # backend -> [rm, refcount]
+        self.sessions = {}             # (backend, address) -> [resource, refcount]
+        self.io_executors = weakref.WeakKeyDictionary()    # resource -> single worker ThreadPoolExecutor
+
+
+    ####################################################
+    ###############  resource managers  ################
+    ####################################################
+
+    def acquire_resource_manager(self, backend=None):
+        """
+            return the shared ResourceManager for `backend`, creating it on first use
+        """
+        with self.lock:
+            if backend not in self.resource_managers:
+                rm = pyvisa.ResourceManager(backend) if backend is not None else pyvisa.ResourceManager()
+                self.resource_managers[backend] = [rm, 0]
+
+            entry = self.resource_managers[backend]
+            entry[1] += 1
+            return entry[0]
+
+    def release_resource_manager(self, backend=None):
+        """
+            drop one reference to the ResourceManager, closes it once unused
+        """
+        with self.lock:
+            if backend not in self.resource_managers:
+                return
+
+            entry = self.resource_managers[backend]
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del self.resource_managers[backend]
+                try:
+                    entry[0].close()
+                except Exception:
+                    pass
+
+
+    ####################################################
+    ##################  sessions  ######################
+    ####################################################
+
+    def acquire_resource(self, address, backend=None, **open_kwargs):
+        """
+            return an open session to `address`, reusing one that another
+                driver already opened if it is still alive
+        """
+        with self.lock:
+            key = (backend, address)
+            if key in self.sessions and not self.is_alive(self.sessions[key][0]):
+                self.discard_resource(address, backend)
+
+            if key not in self.sessions:
+                rm = self.acquire_resource_manager(backend)
+                try:
+                    resource = rm.open_resource(address, **open_kwargs)
+                except Exception:
+                    self.release_resource_manager(backend)
+                    raise
+                self.sessions[key] = [resource, 0]
+
+            entry = self.sessions[key]
+            entry[1] += 1
+            return entry[0]
+
+    def release_resource(self, address, backend=None, resource=None):
+        """
+            drop one reference to a session, closes it once no driver uses it
+            
+            pass the `resource` you were given, so that releasing a session that
+                was already discarded and reopened does not touch the new one
+        """
+        with self.lock:
+            key = (backend, address)
+            if key not in self.sessions:
+                return
+            if resource is not None and self.sessions[key][0] is not resource:
+                return
+
+            entry = self.sessions[key]
+            entry[1] -= 1
+            if entry[1] <= 0:
+                self.discard_resource(address, backend)
+
+    def discard_resource(self, address, backend=None, resource=None):
+        """
+            forget a session regardless of its refcount (e.g. it died), the
+                next acquire_resource() opens a fresh one
+            
+            pass `resource` to only discard it if it is still the pooled one,
+                so two drivers noticing the same dead session don't close the
+                fresh session the first one just opened
+        """
+        with self.lock:
+            key = (backend, address)
+            if key not in self.sessions:
+                return
+            if resource is not None and self.sessions[key][0] is not resource:
+                return
+            entry = self.sessions.pop(key)
+
+            executor = self.io_executors.pop(entry[0], None)
+            if executor is not None:
+                executor.shutdown(wait=False)
+            try:
+                entry[0].close()
+            except Exception:
+                pass
+            self.release_resource_manager(backend)
+
+    def io_executor(self, resource, thread_name_prefix=""):
+        """
+            the single I/O thread of a session, shared by every driver that
+                talks to it, so that the async writes and queries of two drivers 
+                on the same session can not interleave on the bus
+            
+            works for resources that did not come from the pool too, e.g. a
+                SimulatedPNAX handed to several drivers
+        """
+        with self.lock:
+            executor = self.io_executors.get(resource)
+            if executor is None:
+                executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=thread_name_prefix)
+                self.io_executors[resource] = executor
+            return executor
+
+    def is_alive(self, resource):
+        """
+            pyvisa raises InvalidSession when touching the session of a closed resource
+        """
+        try:
+            resource.session
+            return True
+        except pyvisa.InvalidSession:
+            return False
+
+    def refcount(self, address, backend=None):
+        with self.lock:
+            entry = self.sessions.get((backend, address))
+            return 0 if entry is None else entry[1]
+
+
+# the one pool shared by every driver in this process
+visa_pool = VisaSessionPool()
@@ -1,4 +1,20 @@
 # ./bcqt_hub/drivers
 
-from .instruments import *
-from .misc import *
+# instruments are imported on first use, so that e.g. a script that only
+#   needs the cryoswitch does not pay for pyvisa/numpy, see bcqthub/_lazy.py
+from .._lazy import lazy_submodules
+
+__getattr__, __dir__ = lazy_submodules(__name__, {
+    "instruments" : ".instruments",
+    "misc" : ".misc",
+    "sensors" : ".sensors",
+    # from .instruments import *
+    "SA_RnS_FSEB20" : ".instruments.SA_RnS_FSEB20",
+    "SG_Anritsu" : ".instruments.SG_Anritsu",
+    "VNA_Keysight" : ".instruments.VNA_Keysight",
+    # from .misc import *
+    "MC_FindDevices" : ".misc.MiniCircuits.MC_FindDevices",
+    "MC_RFSwitch" : ".misc.MiniCircuits.MC_RFSwitch",
+    "MC_VarAttenuator" : ".misc.MiniCircuits.MC_VarAttenuator",
+    "CryoSwitchController" : ".misc.CryoSwitchController.CryoSwitchController",
+})
@@ -85,6 +85,14 @@ class PSU_Keysight_E36311A(BaseDriver):
                 
     """
 
+    # programmed voltage/current and output state of every channel, read in one 
+    #   round trip by snapshot() / return_instrument_parameters()
+    snapshot_parameters = {
+        **{f"ch{ch}_voltage" : (f"SOUR:VOLT? (@{ch})", float) for ch in (1, 2, 3)},
+        **{f"ch{ch}_current" : (f"SOUR:CURR? (@{ch})", float) for ch in (1, 2, 3)},
+        **{f"ch{ch}_output" : (f"OUTP? (@{ch})", bool) for ch in (1, 2, 3)},
+    }
+
     # Internal implementation values.
     _CH1_voltage = float()
     _CH1_current = float()
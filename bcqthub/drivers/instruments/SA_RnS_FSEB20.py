@@ -5,6 +5,16 @@ from ..BaseDriver import BaseDriver
 
 class SA_RnS_FSEB20(BaseDriver):
 
+    # read in one round trip by snapshot() / return_instrument_parameters()
+    snapshot_parameters = {
+        "IF_bandwidth" : ("SENS:BAND?", float),
+        "freq_center_Hz" : ("FREQ:CENT?", float),
+        "freq_span_Hz" : ("FREQ:SPAN?", float),
+        "num_averages" : ("AVER:COUN?", int),
+        "sweep_time" : ("SENS:SWE:TIME?", float),
+        "continuous_sweep" : ("INIT:CONT?", bool),
+    }
+
     def __init__(self, InstrConfig_Dict, instr_resource=None, instr_address=None, debug=False, **kwargs):
         super().__init__(InstrConfig_Dict, instr_resource, instr_address, debug, **kwargs)
         self.write_check("TRIG:SOUR IMM")   # TODO: ???
@@ -112,28 +122,22 @@ class SA_RnS_FSEB20(BaseDriver):
         
         self.write_check("*TRG")
         self.write_check('INIT:DISP ON')
-        time.sleep(sweep_time)
         
-        check = False
-        tstart = time.time()   
-        while check is False:
-            time.sleep(0.5)
-            t_elapsed = time.time() - tstart
-            print(f"\n      Time elapsed: [{t_elapsed:1.2f}s]", end="\r")
-            
-            # check_str is a string, "0" = busy or "1" = complete
+        # check_str is a string, "0" = busy or "1" = complete
+        def sweep_finished():
             check_str = self.query_check('STAT:OPER:COND?')[1]
             self.print_debug(f"{check_str = }")
-
-            # once it is "1", print that we're finished
-            if check_str != "0":
-                print(f"\n[{dstr}] Trace finished. Uploading now.")
-                print(f"\n   Total time elapsed: {t_elapsed:1.2f} seconds", end="\r")
-                if t_elapsed >= 600:
-                    print(f"                     = {t_elapsed/60:1.1f} minutes \n")
-                
-                # update the variable and let the while finish
-                check = bool(check_str)
+            return check_str != "0"
+        
+        # first check right when the sweep should be done, then poll adaptively,
+        #   the FSEB holds back replies mid-sweep, so the VISA timeout is raised to match
+        t_elapsed = self.poll_until(sweep_finished, expected_duration=sweep_time, 
+                                    timeout=self.operation_timeout(sweep_time), verbose=self.debug)
+        
+        print(f"\n[{dstr}] Trace finished. Uploading now.")
+        print(f"\n   Total time elapsed: {t_elapsed:1.2f} seconds", end="\r")
+        if t_elapsed >= 600:
+            print(f"                     = {t_elapsed/60:1.1f} minutes \n")
         
         # finish off by turning off scanning
         self.write_check('INIT:CONT OFF')
@@ -8,6 +8,12 @@ from ..BaseDriver import BaseDriver
 
 class SG_Anritsu(BaseDriver):
 
+    # read in one round trip by snapshot() / return_instrument_parameters()
+    snapshot_parameters = {
+        "output" : ("OUTP:STAT?", bool),
+        "power" : ("SOUR:POW:LEV:IMM:AMPL?", float),
+        "freq" : ("SOUR:FREQ:CW?", float),
+    }
 
     def __init__(self, InstrConfig_Dict, instr_resource=None, instr_address=None, debug=False, **kwargs):
         super().__init__(InstrConfig_Dict, instr_resource, instr_address, debug, **kwargs)
@@ -142,8 +148,41 @@ class SG_Anritsu(BaseDriver):
         frequency_result = ''.join(f_status.splitlines())  # remove line endings
         if self.debug: 
             self.print_console(f"Frequency set to {float(frequency_result)/1e6} MHz")
-            
     
+    # ~~~~~~~~~~~~~~~~~~
+    # ~~~  List sweeps
+    # ~~~~~~~~~~~~~~~~~~
+    
+    def setup_list_sweep(self, frequencies, trigger_source="EXTernal"):
+        """
+            load `frequencies` (Hz) into the frequency list and step through it,
+                one entry per trigger on the rear panel trigger input, 
+                wrapping around to the first entry after the last one
+            
+            batched, without the readback of set_freq(),
+                see VNA_Keysight.run_triggered_spectroscopy
+        """
+        frequencies = [float(f) for f in frequencies]
+        if min(frequencies) <= 10e6:
+            raise ValueError(f"List frequencies have to be given in Hz, got a minimum of {min(frequencies)}")
+        
+        with self.batch_writes():
+            self.write_check('SOUR:FREQ:MODE LIST')
+            self.write_check(f'SOUR:LIST:FREQ {",".join(f"{f:.1f}" for f in frequencies)}')
+            self.write_check('SOUR:LIST:STAR 0')
+            self.write_check(f'SOUR:LIST:STOP {len(frequencies) - 1}')
+            self.write_check('SOUR:LIST:IND 0')
+            self.write_check(f'TRIG:SOUR {trigger_source}')
+            self.write_check('INIT:CONT ON')
+    
+    def stop_list_sweep(self):
+        """
+            back to a fixed CW frequency
+        """
+        with self.batch_writes():
+            self.write_check('INIT:CONT OFF')
+            self.write_check('SOUR:FREQ:MODE CW')
+            
             
 if __name__ == '__main__':
     
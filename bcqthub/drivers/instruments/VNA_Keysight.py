@@ -1,25 +1,83 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 from datetime import datetime
+from pathlib import Path
 import numpy as np
-import pandas as pd
+import pyvisa
+import hashlib
 import time
 import sys
 
 if __name__ == "__main__":
     sys.path.append("..")
     from BaseDriver import BaseDriver
+    from ResonanceTracker import ResonanceTracker
+    from SegmentTable import SegmentTable
+    from StreamingAverage import StreamingAverage
+    from SweepTimePredictor import SweepTimePredictor
+    from TraceData import TraceData
 else:
     from ..BaseDriver import BaseDriver
+    from ..ResonanceTracker import ResonanceTracker
+    from ..SegmentTable import SegmentTable
+    from ..StreamingAverage import StreamingAverage
+    from ..SweepTimePredictor import SweepTimePredictor
+    from ..TraceData import TraceData
 
 
+# state cache headers that determine the frequency axis of a linear sweep
+_LINEAR_SWEEP_HEADERS = ("SENS1:SWE1:TYPE1", "SENS1:SWE1:POIN1", "SENS1:FREQ1:CENT1", "SENS1:FREQ1:SPAN1",
+                         "SENS1:FREQ1:STAR1", "SENS1:FREQ1:STOP1")
+
+
+# start/stop and center/span of channel 1, writing either pair changes the other one
+_FREQUENCY_HEADERS = ("SENS1:FREQ1:CENT1", "SENS1:FREQ1:SPAN1", "SENS1:FREQ1:STAR1", "SENS1:FREQ1:STOP1")
+
+
+# most points the PNA-X takes in a single sweep, see plan_wideband_chunks
+_MAX_SWEEP_POINTS = 100_001
+
+
+# configs that change the stimulus or redefine the measurements in setup_s2p_measurement,
+#   the memory traces of double_buffered_sweeps do not survive them
+_MEMORY_CLEARING_CONFIG_KEYS = ("sparam", "sparams", "edelay", "f_center", "f_span", "f_start", "f_stop",
+                                "n_points", "segments", "segment_columns")
+
+
+# configs that setup_s2p_measurement sends to the VNA, and so make up a saved configuration
+_SETUP_CONFIG_KEYS = ("sparam", "edelay", "segments", "n_points", "f_center", "f_span", "power", 
+                      "averages", "if_bandwidth")
+
 
 class VNA_Keysight(BaseDriver):
     
+    # channel 1 settings read in one round trip by snapshot() / return_instrument_parameters(),
+    #   set configs["snapshot_with_data"] = True to attach them to every return_data_s2p()
+    snapshot_parameters = {
+        "f_start" : ("SENS1:FREQ:STAR?", float),
+        "f_stop" : ("SENS1:FREQ:STOP?", float),
+        "n_points" : ("SENS1:SWE:POIN?", int),
+        "sweep_type" : ("SENS1:SWE:TYPE?", str),
+        "sweep_time" : ("SENS1:SWE:TIME?", float),
+        "if_bandwidth" : ("SENS1:BAND?", float),
+        "averaging" : ("SENS1:AVER:STAT?", bool),
+        "averages" : ("SENS1:AVER:COUN?", int),
+        "power" : ("SOUR1:POW1?", float),
+        "output" : ("OUTP:STAT?", bool),
+    }
+    
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     # ~~~  Base Class Features
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
     def __init__(self, InstrConfig_Dict, instr_resource=None, instr_address=None, debug=False, **kwargs):
         super().__init__(InstrConfig_Dict, instr_resource, instr_address, debug, **kwargs)
+        self.freqs_cache = None     # (sweep settings, freqs) of the last linear sweep
+        self.saved_configurations = {}      # name -> see register_configuration()
+        self.measurement_layout = None      # (sparams, edelay) of the measurements on the VNA
+        
+        # learns from every run_measurement(), set configs["timing_file"] to keep it between sessions
+        self.sweep_time_predictor = SweepTimePredictor(self.configs.get("timing_file"))
         
     def read_check(self, fmt = str):
         return super().read_check(fmt)
@@ -36,6 +94,14 @@ class VNA_Keysight(BaseDriver):
     def return_instrument_parameters(self, print_output=False):
         return super().return_instrument_parameters(print_output)
     
+    def invalidate_state_cache(self, prefixes=None):
+        super().invalidate_state_cache(prefixes)
+        # after a reset (or when asked to forget CALC) the measurements may be gone too
+        if isinstance(prefixes, str):
+            prefixes = [prefixes]
+        if prefixes is None or any(prefix.upper().startswith("CALC") for prefix in prefixes):
+            self.measurement_layout = None
+    
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     # ~~~  config dict methods
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -243,6 +309,35 @@ class VNA_Keysight(BaseDriver):
         
         return np.linspace(freq_start, freq_stop, num_points)
         
+    def set_data_transfer_format(self, use_binary=False, datatype=None, is_big_endian=None):
+        """
+            switch the trace transfer format between ASCII and binary
+                REAL,32 (datatype="f") or REAL,64 (datatype="d")
+            
+            byte order defaults to SWAPped (little endian) since that is
+                what our lab PCs use natively, so numpy never has to byteswap
+        """
+        if use_binary is False:
+            self.write_check('FORMat ASCII')
+            return
+        
+        datatype = self.configs.get("binary_datatype", "d") if datatype is None else datatype
+        is_big_endian = self.configs.get("binary_big_endian", False) if is_big_endian is None else is_big_endian
+        
+        self.write_check(f'FORMat:DATA REAL,{32 if datatype == "f" else 64}')
+        self.write_check(f'FORMat:BORDer {"NORMal" if is_big_endian else "SWAPped"}')
+        
+    def query_trace_data(self, cmd, use_binary=False):
+        """
+            query a trace with either query_check_ascii or query_check_binary,
+                the transfer format should already be set by set_data_transfer_format
+        """
+        if use_binary is False:
+            return self.query_check_ascii(cmd, container=np.array)
+        
+        return self.query_check_binary(cmd, datatype=self.configs.get("binary_datatype", "d"), 
+                                       is_big_endian=self.configs.get("binary_big_endian", False))
+        
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     # ~~~  Instr Methods
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -252,12 +347,15 @@ class VNA_Keysight(BaseDriver):
     def compute_homophasal_segments(self, Noffres=None, segment_type=None, **kwargs):
         """
             Computes segments needed to perform homophasal measurements
-                "segments" are just strings that contain the parameters
+                "segments" are the rows of a SegmentTable, with the parameters
                 for each frequency "slice" we are splitting our x-axis into
                 
-                A guide for the meaning of each part of the string
+                Iterating over the table still gives one string per segment
                     example = ', 1, {Noffres}, {fstop*fscale}, {fb}',
                               ', 1, <# of pts>, <start freq>, <stop freq>
+                
+                with configs["segment_ifbw"]/["offres_ifbw"] or ["segment_power"]/["offres_power"]
+                    every segment also carries its own IFBW and/or power, see segment_settings
         """
         
         if segment_type is None and "segment_type" in self.configs:
@@ -274,9 +372,92 @@ class VNA_Keysight(BaseDriver):
         # load kwargs into vna configs
         self.filter_configs()
         
-        f_center = self.configs["f_center"]
-        f_span = self.configs["f_span"]
-        n_points = self.configs["n_points"]
+        core_settings, offres_settings = self.segment_settings()
+        segments = self.homophasal_segments(self.configs["f_center"], self.configs["f_span"], 
+                                            self.configs["n_points"], segment_type, Noffres,
+                                            core_settings, offres_settings)
+        
+        # a single resonator, so there is nothing for return_data_s2p to split
+        self.configs.pop("resonator_slices", None)
+        self.configs["segments"] = segments
+        return segments
+    
+    def compute_multi_resonator_segments(self, resonators, Noffres=None, segment_type=None, fill_points=0):
+        """
+            One segment table that covers several resonators, so a power sweep
+                measures all of them in a single sweep instead of one sweep
+                (and one new segment table) per resonator
+            
+            resonators = list of dicts with "f_center" and "f_span", plus an 
+                optional "n_points" (default configs["n_points"]) and "name" 
+                (default "res0", "res1", ...), or list of (f_center, f_span)
+            every resonator gets its own homophasal/hybrid cluster, see 
+                compute_homophasal_segments. The gaps between resonators are 
+                skipped, or swept linearly with `fill_points` points strictly 
+                between the edges of the two clusters
+            
+            configs["resonator_slices"] = {name : (start, stop)} point indices
+                of every resonator, used by return_data_s2p(split_resonators=True)
+            
+            per-segment IFBW/power work as in compute_homophasal_segments, the 
+                fill segments use the off-resonance settings
+        """
+        
+        if segment_type is None:
+            segment_type = self.configs.get("segment_type", "homophasal")
+        if Noffres is None:
+            Noffres = self.configs.get("Noffres", 5)
+        
+        all_res = []
+        for idx, res in enumerate(resonators):
+            if not isinstance(res, dict):
+                res = {"f_center" : res[0], "f_span" : res[1]}
+            all_res.append({"name" : f"res{idx}", "n_points" : self.configs.get("n_points"), **res})
+        
+        # the homophasal clusters sweep from high to low frequency, so do the resonators too
+        all_res.sort(key=lambda res: res["f_center"], reverse=True)
+        core_settings, offres_settings = self.segment_settings()
+        
+        tables, resonator_slices = [], {}
+        num_points, prev_fstart = 0, None
+        for res in all_res:
+            f_center, f_span = res["f_center"], res["f_span"]
+            fstop = f_center + f_span/2
+            if prev_fstart is not None and fstop > prev_fstart:
+                raise ValueError(f"{res['name']} at {f_center:1.6e} Hz overlaps the resonator above it, reduce f_span")
+            
+            if prev_fstart is not None and fill_points > 0 and prev_fstart > fstop:
+                # the clusters already sweep both edges, keep them out of the fill 
+                # segment so no frequency is measured twice
+                fstep = (prev_fstart - fstop) / (fill_points + 1)
+                tables.append(SegmentTable.from_rows([(fill_points, prev_fstart - fstep, fstop + fstep, offres_settings)], 
+                                                     tuple(core_settings)))
+                num_points += fill_points
+            
+            res_table = self.homophasal_segments(f_center, f_span, res["n_points"], segment_type, Noffres,
+                                                 core_settings, offres_settings)
+            resonator_slices[res["name"]] = (num_points, num_points + res_table.num_points)
+            tables.append(res_table)
+            
+            num_points += res_table.num_points
+            prev_fstart = f_center - f_span/2
+        
+        segments = SegmentTable.concatenate(tables)
+        self.configs["segments"] = segments
+        self.configs["resonator_slices"] = resonator_slices
+        return segments
+    
+    def homophasal_segments(self, f_center, f_span, n_points, segment_type='homophasal', Noffres=5,
+                            core_settings=None, offres_settings=None):
+        """
+            SegmentTable for a single resonator at f_center, 
+                see compute_homophasal_segments
+                
+            core_settings/offres_settings = {"ifbw" : .., "power" : ..} extra columns
+                of the homophasal segments and the Noffres segments, see segment_settings
+        """
+        core_settings = {} if core_settings is None else core_settings
+        offres_settings = {} if offres_settings is None else offres_settings
         
         # conversion factor for MHz -> Hz
         fscale = 1 if f_center >= 1e6 else 1e6
@@ -299,34 +480,65 @@ class VNA_Keysight(BaseDriver):
         
         if segment_type == 'homophasal':
             # homophasal for entire freq range
-            segments = [f',1,2,{ff1*fscale},{ff2*fscale}'
+            rows = [(2, ff1*fscale, ff2*fscale, core_settings)
                     for ff1, ff2 in zip(freq[0::2], freq[1::2])][1:-1]
         
         elif segment_type == 'hybrid':
-            if "Noffres" not in self.configs or self.configs["Noffres"] is None:
-                self.print_warning("'Noffres' missing from configs! Setting to 5 by default.. ")
-                self.configs["Noffres"] = 5
-            
             # split between homophasal and linear
             #   homophasal near resonance   freqs = [fa->fb]
             #   linear off resonance        freqs = [fstart->fa] and [fb->fstop]
-            h_segments = [f',1,2,{ff1*fscale},{ff2*fscale}'
+            h_rows = [(2, ff1*fscale, ff2*fscale, core_settings)
                     for ff1, ff2 in zip(freq[0::2], freq[1::2])][1:-1]
             fa = np.min(freq[1:-1]) * fscale
             fb = np.max(freq[1:-1]) * fscale
 
-            segments = [f',1,{Noffres},{fstop*fscale}, {fb}',
-                        *h_segments,
-                        f',1,{Noffres},{fa},{fstart*fscale}']
+            rows = [(Noffres, fstop*fscale, fb, offres_settings),
+                    *h_rows,
+                    (Noffres, fa, fstart*fscale, offres_settings)]
             
         elif segment_type == 'linear':
             # simple linear sweep
-            segments = [f',1,{n_points},{fstop*fscale}, {fstart*fscale}']
+            rows = [(n_points, fstop*fscale, fstart*fscale, core_settings)]
             
         else:
             raise ValueError("Missing segment_type in compute_homophasal_segments for VNA_Keysight driver.")
+        
+        return SegmentTable.from_rows(rows, tuple(core_settings))
+    
+    def segment_settings(self):
+        """
+            per-segment IF bandwidth and power from configs, returned as 
+                ({"ifbw" : .., "power" : ..} for the homophasal core, {...} off resonance)
             
-        self.configs["segments"] = segments
+            configs["segment_ifbw"] / configs["offres_ifbw"] and 
+                configs["segment_power"] / configs["offres_power"], e.g. a narrow 
+                IFBW near resonance and a wide one for the Noffres segments. If only
+                one of a pair is set, the other one is if_bandwidth/power. Columns
+                that are not set at all are left out, and the VNA uses the channel value
+        """
+        core_settings, offres_settings = {}, {}
+        for column, core_key, offres_key, channel_key in [("ifbw", "segment_ifbw", "offres_ifbw", "if_bandwidth"),
+                                                          ("power", "segment_power", "offres_power", "power")]:
+            core_value, offres_value = self.configs.get(core_key), self.configs.get(offres_key)
+            if core_value is None and offres_value is None:
+                continue
+            core_settings[column] = self.configs[channel_key] if core_value is None else core_value
+            offres_settings[column] = self.configs[channel_key] if offres_value is None else offres_value
+        
+        return core_settings, offres_settings
+    
+    def get_segment_table(self):
+        """
+            configs["segments"] as a SegmentTable, hand-written lists of segment 
+                strings are converted once (with the optional columns listed in 
+                configs["segment_columns"]) and stored back in configs
+        """
+        segments = self.configs.get("segments")
+        if segments is None:
+            return None
+        if not isinstance(segments, SegmentTable):
+            segments = SegmentTable.from_strings(segments, self.configs.get("segment_columns") or ())
+            self.configs["segments"] = segments
         return segments
     
     def setup_s2p_measurement(self, Expt_Config=None):
@@ -346,49 +558,61 @@ class VNA_Keysight(BaseDriver):
         # self.write_check('SYSTem:FPRESet')
         # self.write_check('SYSTem:UPRESet')
         time.sleep(0.05)
-        self.write_check('OUTPut:STATe OFF')
-
-        # Initial setup for measurement
-        ## Query the existing measurements
-        measurements = self.query_check('CALC1:PAR:CAT:EXTended?')
+        # send everything as a few compound messages instead of ~30 transactions
+        #   write_setting() only sends settings that differ from the state cache,
+        #   so re-running setup at every point of a power sweep is cheap
+        with self.batch_writes(check_errors=self.configs.get("check_errors", False)):
+            self.write_setting('OUTPut:STATe OFF')
+            
+            # just in case they have not been set yet, but should be by init_configs()
+            measure_sparam = self.configs['sparam']
+            
+            # only tear down and rebuild the measurements/windows if they changed
+            measurement_layout = (tuple(measure_sparam), self.configs["edelay"])
+            if self.measurement_layout != measurement_layout:
+                
+                # Initial setup for measurement
+                ## Query the existing measurements
+                measurements = self.query_check('CALC1:PAR:CAT:EXTended?')
 
-        ## If any measurements exist, delete them all
-        if measurements != 'NO CATALOG':
-            self.write_check('CALC1:PARameter:DELete:ALL')
-        
-        # just in case they have not been set yet, but should be by init_configs()
-        measure_sparam = self.configs['sparam']
-        
-        # create measurements, create vna display windows, and set all of them to log format
-        for idx, sparam in enumerate(measure_sparam):
-            self.write_check(f'CALC1:MEASure{idx+1}:DEFine \"{sparam}\"')
-            self.write_check(f'CALC1:PAR:MNUM {idx+1}')  # select ch
-            self.write_check(f'DISPlay:WINDow{idx+1} ON')  # create window
-            self.write_check(f'DISPlay:MEAS{idx+1}:FEED {idx+1}')  # display meas 1 on window 1
-            self.write_check(f'CALC1:CORRection:EDELay:TIME {self.configs["edelay"]}NS')
-            self.write_check(f'CALC1:MEASure{idx+1}:FORMat MLOGarithmic')
-            
-        # set frequency sweep
-        if "segments" in self.configs and self.configs["segments"] is not None:
-            num_segments = len(self.configs["segments"])
-            seg_data = ''.join([s for s in self.configs["segments"]])
-            self.write_check(f"SENSe1:SWEep:TYPE SEGment")
-            self.write_check(f'SENSe1:SEGMent:LIST SSTOP, {num_segments}{seg_data}')
-        else:
-            self.write_check("SENSe1:SWEep:TYPE LINear")
-            self.write_check(f'SENSe1:SWEep:POINts {self.configs["n_points"]}')
-            self.write_check(f'SENSe1:FREQuency:CENTer {self.configs["f_center"]}HZ')
-            self.write_check(f'SENSe1:FREQuency:SPAN {self.configs["f_span"]}HZ')
-            self.write_check(f'SENSe1:SWEep:TIME:AUTO ON')
+                ## If any measurements exist, delete them all
+                if measurements != 'NO CATALOG':
+                    self.write_check('CALC1:PARameter:DELete:ALL')
+                    self.invalidate_state_cache(["CALC1", "DISP"])
+            
+                # create measurements, create vna display windows, and set all of them to log format
+                for idx, sparam in enumerate(measure_sparam):
+                    self.write_check(f'CALC1:MEASure{idx+1}:DEFine \"{sparam}\"')
+                    self.write_check(f'CALC1:PAR:MNUM {idx+1}')  # select ch
+                    self.write_check(f'DISPlay:WINDow{idx+1} ON')  # create window
+                    self.write_check(f'DISPlay:MEAS{idx+1}:FEED {idx+1}')  # display meas 1 on window 1
+                    self.write_check(f'CALC1:CORRection:EDELay:TIME {self.configs["edelay"]}NS')
+                    self.write_check(f'CALC1:MEASure{idx+1}:FORMat MLOGarithmic')
+                
+                self.measurement_layout = measurement_layout
+            
+            # set frequency sweep
+            segment_table = self.get_segment_table()
+            if segment_table is not None:
+                self.write_setting(f"SENSe1:SWEep:TYPE SEGment")
+                self.write_setting(f'SENSe1:SEGMent:BWIDth:CONTrol {"ON" if "ifbw" in segment_table.columns else "OFF"}')
+                self.write_setting(f'SENSe1:SEGMent:POWer:CONTrol {"ON" if "power" in segment_table.columns else "OFF"}')
+                self.write_setting(f'SENSe1:SEGMent:LIST {segment_table.to_scpi()}')
+            else:
+                self.write_setting("SENSe1:SWEep:TYPE LINear")
+                self.write_setting(f'SENSe1:SWEep:POINts {self.configs["n_points"]}')
+                self.write_setting(f'SENSe1:FREQuency:CENTer {self.configs["f_center"]}HZ')
+                self.write_setting(f'SENSe1:FREQuency:SPAN {self.configs["f_span"]}HZ')
+                self.write_setting(f'SENSe1:SWEep:TIME:AUTO ON')
         
-        # TODO: figure out how to set port1 and port2 both as inputs and outputs for s2p measurements 
+            # TODO: figure out how to set port1 and port2 both as inputs and outputs for s2p measurements 
         
-        # raise NotImplemented
+            # raise NotImplemented
     
-        self.write_check(f'SOUR1:POW1 {self.configs["power"]}')
-        self.write_check(f'SENSe1:AVERage:STATe ON')
-        self.write_check(f'SENSe1:AVERage:Count {self.configs["averages"] // 1}')
-        self.write_check(f'SENSe1:BANDwidth {self.configs["if_bandwidth"]}HZ')
+            self.write_setting(f'SOUR1:POW1 {self.configs["power"]}')
+            self.write_setting(f'SENSe1:AVERage:STATe ON')
+            self.write_setting(f'SENSe1:AVERage:Count {self.configs["averages"] // 1}')
+            self.write_setting(f'SENSe1:BANDwidth {self.configs["if_bandwidth"]}HZ')
 
         # autoscale for visibility on the display
         # self.write_check(f'DISPlay:WINDow1:TRACe1:Y:SCAle:AUTO')
@@ -429,66 +653,153 @@ class VNA_Keysight(BaseDriver):
         # self.write_check('SYSTem:FPRESet')
         self.write_check('SYSTem:UPRESet')
         time.sleep(0.01)
-        self.write_check('OUTPut:STATe OFF')
+        # send everything as a few compound messages instead of ~30 transactions
+        with self.batch_writes(check_errors=self.configs.get("check_errors", False)):
+            self.write_check('OUTPut:STATe OFF')
 
-        # Initial setup for measurement
-        ## Query the existing measurements
-        measurements = self.query_check('CALC1:PAR:CAT:EXTended?')
+            # Initial setup for measurement
+            ## Query the existing measurements
+            measurements = self.query_check('CALC1:PAR:CAT:EXTended?')
 
-        ## If any measurements exist, delete them all
-        if measurements != 'NO CATALOG':
-            self.write_check('CALC1:PARameter:DELete:ALL')
+            ## If any measurements exist, delete them all
+            if measurements != 'NO CATALOG':
+                self.write_check('CALC1:PARameter:DELete:ALL')
         
-        # create measurements
-        self.write_check(f'CALC1:MEASure1:DEFine \"{self.configs["sparam"]}\"')
-        self.write_check(f'CALC1:MEASure2:DEFine \"{self.configs["sparam"]}\"')
+            # create measurements
+            self.write_check(f'CALC1:MEASure1:DEFine \"{self.configs["sparam"]}\"')
+            self.write_check(f'CALC1:MEASure2:DEFine \"{self.configs["sparam"]}\"')
 
         
-        if self.configs["segments"] is not None:
-            num_segments = len(self.configs["segments"])
-            seg_data = ''.join([s for s in self.configs["segments"]])
-            self.write_check(f"SENSe1:SWEep:TYPE SEGment")
-            self.write_check(f'SENSe1:SEGMent:LIST SSTOP, {num_segments}{seg_data}')
-        else:
-            self.write_check("SENSe1:SWEep:TYPE LINear")
-            self.write_check(f'SENSe1:SWEep:POINts {self.configs["n_points"]}')
-            self.write_check(f'SENSe1:FREQuency:CENTer {self.configs["f_center"]}HZ')
-            self.write_check(f'SENSe1:FREQuency:SPAN {self.configs["f_span"]}HZ')
-            self.write_check(f'SENSe1:SWEep:TIME:AUTO ON')
-        
-        self.write_check(f'SOUR1:POW1 {self.configs["power"]}')
-        self.write_check(f'SENSe1:AVERage:STATe ON')
-        self.write_check(f'SENSe1:BANDwidth {self.configs["if_bandwidth"]}HZ')
-
-        # configure ch 1 measurement 1
-        self.write_check(f'CALC1:PAR:MNUM 1')  # select ch 1, meas 1
-        self.write_check(f'DISPlay:WINDow1 ON')  # create window
-        self.write_check(f'DISPlay:MEAS1:FEED 1')  # display meas 1 on window 1
-        self.write_check(f'CALC1:CORRection:EDELay:TIME {self.configs["edelay"]}NS')
-        self.write_check(f'CALC1:MEASure1:FORMat MLOGarithmic')
-
-        # configure ch 1 measurement 2
-        self.write_check(f'CALC1:PAR:MNUM 2')  # select ch 1, meas 2
-        self.write_check(f'DISPlay:WINDow2 ON')  # create window 2
-        self.write_check(f'DISPlay:MEAS2:FEED 2')  # display meas 2 on window 2
-        self.write_check(f'CALC1:CORRection:EDELay:TIME {self.configs["edelay"]}NS')
-        self.write_check(f'CALC1:MEASure2:FORMat PHASe')
+            if self.configs["segments"] is not None:
+                num_segments = len(self.configs["segments"])
+                seg_data = ''.join([s for s in self.configs["segments"]])
+                self.write_check(f"SENSe1:SWEep:TYPE SEGment")
+                self.write_check(f'SENSe1:SEGMent:LIST SSTOP, {num_segments}{seg_data}')
+            else:
+                self.write_check("SENSe1:SWEep:TYPE LINear")
+                self.write_check(f'SENSe1:SWEep:POINts {self.configs["n_points"]}')
+                self.write_check(f'SENSe1:FREQuency:CENTer {self.configs["f_center"]}HZ')
+                self.write_check(f'SENSe1:FREQuency:SPAN {self.configs["f_span"]}HZ')
+                self.write_check(f'SENSe1:SWEep:TIME:AUTO ON')
+        
+            self.write_check(f'SOUR1:POW1 {self.configs["power"]}')
+            self.write_check(f'SENSe1:AVERage:STATe ON')
+            self.write_check(f'SENSe1:BANDwidth {self.configs["if_bandwidth"]}HZ')
 
-        # autoscale for visibility on the display
-        self.write_check(f'DISPlay:WINDow1:TRACe1:Y:SCAle:AUTO')
-        self.write_check(f'DISPlay:WINDow2:TRACe1:Y:SCAle:AUTO')
+            # configure ch 1 measurement 1
+            self.write_check(f'CALC1:PAR:MNUM 1')  # select ch 1, meas 1
+            self.write_check(f'DISPlay:WINDow1 ON')  # create window
+            self.write_check(f'DISPlay:MEAS1:FEED 1')  # display meas 1 on window 1
+            self.write_check(f'CALC1:CORRection:EDELay:TIME {self.configs["edelay"]}NS')
+            self.write_check(f'CALC1:MEASure1:FORMat MLOGarithmic')
+
+            # configure ch 1 measurement 2
+            self.write_check(f'CALC1:PAR:MNUM 2')  # select ch 1, meas 2
+            self.write_check(f'DISPlay:WINDow2 ON')  # create window 2
+            self.write_check(f'DISPlay:MEAS2:FEED 2')  # display meas 2 on window 2
+            self.write_check(f'CALC1:CORRection:EDELay:TIME {self.configs["edelay"]}NS')
+            self.write_check(f'CALC1:MEASure2:FORMat PHASe')
+
+            # autoscale for visibility on the display
+            self.write_check(f'DISPlay:WINDow1:TRACe1:Y:SCAle:AUTO')
+            self.write_check(f'DISPlay:WINDow2:TRACe1:Y:SCAle:AUTO')
 
-        # make sure to have averages as an integer
-        self.write_check(f'SENSe1:AVERage:Count {self.configs["averages"] // 1}')
+            # make sure to have averages as an integer
+            self.write_check(f'SENSe1:AVERage:Count {self.configs["averages"] // 1}')
 
     
-    def run_measurement(self, verbose=True):
+    def get_sweep_time(self):
         """
-            Run the measurement and continuously query until it reports finished
+            time for a single sweep of channel 1 in seconds, as reported by the VNA
+        """
+        return float(self.strip_specials(self.query_check('SENSe1:SWEep:TIME?')))
+    
+    def estimate_measurement_duration(self, num_averages=None):
+        """
+            how long run_measurement() should take, in seconds
+            
+            SWE:TIME? already covers the segment table, but every segment adds 
+                some retrace/settling time the VNA does not report, so add 
+                configs["segment_overhead"] (default 1 ms) per segment.
+                If SWE:TIME? can't be read, estimate the sweep time from the 
+                number of points and the IF bandwidth instead.
+        """
+        if num_averages is None:
+            num_averages = max(1, int(self.configs.get("averages", 1)))
+        
+        segment_table = self.get_segment_table()
+        num_segments = 0 if segment_table is None else len(segment_table)
+        try:
+            sweep_time = self.get_sweep_time()
+        except (ValueError, pyvisa.VisaIOError) as e:
+            self.print_warning(f"Could not read the sweep time ({e}), estimating it from n_points/if_bandwidth")
+            if_bandwidth = float(self.configs.get("if_bandwidth", 1e3))
+            if segment_table is not None:
+                # with SEGM:BWID:CONT ON every segment carries its own IFBW
+                sweep_time = segment_table.sweep_time(if_bandwidth)
+            else:
+                sweep_time = self.configs.get("n_points", 0) / if_bandwidth
+        
+        sweep_time += num_segments * self.configs.get("segment_overhead", 1e-3)
+        return sweep_time * num_averages
+    
+    def timing_settings(self, num_averages=None, configs=None):
+        """
+            the settings the duration of a measurement depends on, 
+              see SweepTimePredictor.predict and SweepTimePredictor.features
+            
+            the sweep type is the one last sent to the VNA if `configs` is None,
+              otherwise the one setup_s2p_measurement() would send for them
+        """
+        sweep_type = self.state_cache.get("SENS1:SWE1:TYPE1", (None,))[0] if configs is None else None
+        configs = self.configs if configs is None else configs
+        if num_averages is None:
+            num_averages = max(1, int(configs.get("averages", 1)))
+        
+        segments = configs.get("segments")
+        if segments is not None and not isinstance(segments, SegmentTable):
+            segments = SegmentTable.from_strings(segments, configs.get("segment_columns", ()))
+        if sweep_type is None:
+            sweep_type = "SEGM" if segments is not None else "LIN"
+        
+        return {"sweep_type" : sweep_type, "n_points" : configs.get("n_points", 0), 
+                "if_bandwidth" : float(configs.get("if_bandwidth", 1e3)), "averages" : num_averages, "segments" : segments}
+    
+    def predict_measurement_duration(self, event_driven=None, **config_updates):
+        """
+            how long run_measurement() will take with `config_updates` applied to 
+              configs, in seconds, without asking the VNA
+            
+            calibrated from the measured duration of every run_measurement() 
+              with the same sweep type and wait mode, see SweepTimePredictor, 
+              so e.g. planning a power sweep is
+              
+                durations = [VNA.predict_measurement_duration(power=p, averages=n) 
+                             for p, n in zip(powers, averages)]
+        """
+        if event_driven is None:
+            event_driven = self.configs.get("event_driven", False)
+        
+        settings = self.timing_settings(configs={**self.configs, **config_updates})
+        return self.sweep_time_predictor.predict(wait_mode="event_driven" if event_driven else "polled", **settings)
+    
+    def run_measurement(self, verbose=True, event_driven=None):
+        """
+            Run the measurement and wait until it reports finished
+            
+            event_driven=False (default) runs in continuous mode and polls the 
+                averaging-complete bit with poll_until(), first checking 
+                when the sweep time * averages has passed
+            event_driven=True runs exactly `averages` sweeps in group trigger mode 
+                and waits on *OPC via send_cmd_and_wait(), using a service request 
+                if the VISA backend supports it. The channel is in HOLD afterwards.
         """
         
         dstr = datetime.today().strftime("%m/%d/%Y @ %I:%M%p")
         
+        if event_driven is None:
+            event_driven = self.configs.get("event_driven", False)
+        
         self.write_check('*CLS')
         
         # initiate display and turn on output
@@ -497,55 +808,521 @@ class VNA_Keysight(BaseDriver):
         self.write_check('FORMat ASCII')
         self.write_check('DISPlay:WINDow1:Y:AUTO')
         self.write_check('DISPlay:WINDow2:Y:AUTO')
-    
-        # self.write_check('SENS1:SWE:MODE SINGle')  
-        # self.write_check('INIT:IMM')  # just use INIT:IMM to trigger one sweep
-        self.write_check('INITiate:CONTinuous ON')
         
-        # initiate display and turn on output
-        self.write_check('FORMat ASCII')
-        self.write_check('DISPlay:WINDow1:Y:AUTO')
-        self.write_check('DISPlay:WINDow2:Y:AUTO')
-                
-        # check if the VNA has finished every second, in my experience the *OPC? or *WAI command isnt very reliable
-        check = False
-        tstart = time.time()   
-        
-        # quiet measurement
-        if verbose is False:
-            while check is False:
-                time.sleep(0.1)
-                check_str = self.strip_specials(self.query_check('STAT:OPER:AVER1:COND?'))[0]
-                if check_str != "0":
-                    check = bool(check_str)
-            
-        else:   # verbose updates time
+        # schedule the first completion check and the timeout from what the VNA says a sweep takes
+        num_averages = max(1, int(self.configs.get("averages", 1)))
+        expected_duration = self.estimate_measurement_duration(num_averages)
+        timeout = self.operation_timeout(expected_duration)
+        
+        if verbose is True:
             self.print_console()
-            self.print_console(f"Beginning measurement at {dstr}")
-            while check is False:
-                time.sleep(0.5)
-                t_elapsed = time.time() - tstart
-                
-                # check_str is a string, "0" = busy or "1" = complete
+            self.print_console(f"Beginning measurement at {dstr}, expecting {expected_duration:1.2f}s")
+        
+        if event_driven is True:
+            # one group of `averages` sweeps, *OPC fires once the last one is done
+            self.write_check('INITiate:CONTinuous ON')
+            self.write_check('SENSe1:AVERage:CLEar')
+            self.write_check(f'SENSe1:SWEep:GROups:COUNt {num_averages}')
+            t_elapsed = self.send_cmd_and_wait('SENSe1:SWEep:MODE GROups', expected_duration=expected_duration, timeout=timeout)
+            
+        else:
+            # self.write_check('SENS1:SWE:MODE SINGle')  
+            # self.write_check('INIT:IMM')  # just use INIT:IMM to trigger one sweep
+            self.write_check('INITiate:CONTinuous ON')
+            
+            # check if the VNA has finished, in my experience the *OPC? or *WAI command isnt very reliable
+            #   check_str is a string, "0" = busy or "1" = complete
+            def averaging_finished():
                 check_str = self.strip_specials(self.query_check('STAT:OPER:AVER1:COND?'))[0]
-                self.print_console(" "*20 + f"Time elapsed: [{t_elapsed:1.2f}s]", end="\r")
-                
-                # once it is "1", print that we're finished
-                if check_str != "0":
-                    t_elapsed = time.time() - tstart
-                    dstr_end = datetime.today().strftime("%m/%d/%Y @ %I:%M%p")
-                    self.print_console(f"\n[{dstr_end}] Trace finished. Uploading now.")
-                    self.print_console(f" "*20 + f"Total time elapsed: {t_elapsed:1.3f} seconds")
-                    if t_elapsed >= 600:
-                        print(f"                     = {t_elapsed/60:1.1f} minutes \n")
-                    
-                    # update the variable and let the while finish
-                    check = bool(check_str)
+                return check_str != "0"
+            
+            t_elapsed = self.poll_until(averaging_finished, expected_duration=expected_duration, timeout=timeout, verbose=verbose)
+        
+        self.sweep_time_predictor.record(t_elapsed, wait_mode="event_driven" if event_driven else "polled", 
+                                         **self.timing_settings(num_averages))
+        
+        # once it is finished, print that we're finished
+        if verbose is True:
+            dstr_end = datetime.today().strftime("%m/%d/%Y @ %I:%M%p")
+            self.print_console(f"\n[{dstr_end}] Trace finished. Uploading now.")
+            self.print_console(f" "*20 + f"Total time elapsed: {t_elapsed:1.3f} seconds")
+            if t_elapsed >= 600:
+                print(f"                     = {t_elapsed/60:1.1f} minutes \n")
+        
+        return t_elapsed
                     
         # self.write_check('OUTPut:STATe OFF')
         # self.write_check('INITiate:CONTinuous OFF')
 
+    def start_group_sweep(self, num_averages=None):
+        """
+            start `averages` sweeps in group trigger mode and return right away,
+              *OPC sets the OPC bit of the ESR once the last sweep is done, 
+              see check_opc_bit(). returns the start time (time.perf_counter)
+        """
+        if num_averages is None:
+            num_averages = max(1, int(self.configs.get("averages", 1)))
+        
+        with self.batch_writes():
+            self.write_check('*CLS')
+            self.write_check('*ESE 1')
+            self.write_check('SENSe1:AVERage:CLEar')
+            self.write_check(f'SENSe1:SWEep:GROups:COUNt {num_averages}')
+            self.write_check('SENSe1:SWEep:MODE GROups;*OPC')
+        return time.perf_counter()
+    
+    def memorize_traces(self):
+        """
+            copy the data trace of every measurement into its memory trace
+        """
+        with self.batch_writes():
+            for idx in range(len(self.configs["sparam"])):
+                self.write_check(f'CALC1:MEASure{idx+1}:MATH:MEMorize')
+    
+    def double_buffered_sweeps(self, num_sweeps, prepare=None, num_averages=None, use_binary=True,
+                               redefines=None):
+        """
+            Generator that runs `num_sweeps` group sweeps back to back and yields
+              (idx, {sparam : complex trace}) of sweep idx while sweep idx+1 is 
+              already running on the VNA
+            
+            Channel 1 holds one set of measurements, so its data and memory 
+              traces are the two buffers: a finished sweep is memorized, the 
+              next sweep is started, and SMEM of the finished one is downloaded
+              with one MFD? request while the VNA is busy. 
+            
+            prepare(idx) is called before sweep idx while the VNA is idle, to 
+              change settings. It returns True if that changed the sweep time,
+              so that the expected duration is estimated again.
+            redefines(idx) returns True if prepare(idx) redefines the measurements
+              or changes the stimulus (points, frequencies, segments, sweep type),
+              which deletes or invalidates their memory traces. The pending sweep
+              is then downloaded before prepare(idx) instead of during sweep idx.
+            Stopping early (break) puts the channel in HOLD.
+        """
+        
+        self.update_sparam_configs()
+        self.write_check('INITiate:CONTinuous ON')
+        if use_binary is True:
+            self.set_data_transfer_format(use_binary=True)
+        
+        pending = None      # idx of the sweep waiting in memory
+        expected_duration = None
+        try:
+            for idx in range(num_sweeps):
+                if pending is not None and redefines is not None and redefines(idx):
+                    yield pending, self.query_complex_traces("SMEM", "", use_binary)
+                    pending = None
+                
+                if (prepare is not None and prepare(idx) is True) or expected_duration is None:
+                    self.write_setting('OUTPut:STATe ON')
+                    expected_duration = self.estimate_measurement_duration(num_averages)
+                
+                tstart = self.start_group_sweep(num_averages)
+                
+                # transfer the previous sweep while this one is running
+                if pending is not None:
+                    yield pending, self.query_complex_traces("SMEM", "", use_binary)
+                
+                remaining = max(0, expected_duration - (time.perf_counter() - tstart))
+                self.poll_until(self.check_opc_bit, expected_duration=remaining, 
+                                timeout=self.operation_timeout(expected_duration))
+                self.memorize_traces()
+                pending = idx
+            
+            if pending is not None:
+                yield pending, self.query_complex_traces("SMEM", "", use_binary)
+        
+        finally:
+            self.write_check('SENSe1:SWEep:MODE HOLD')
+            if use_binary is True:
+                self.set_data_transfer_format(use_binary=False)
+    
+    def run_pipelined_measurement(self, sweep_settings, consumer, use_binary=True, verbose=True):
+        """
+            Double-buffered acquisition: the VNA runs sweep N+1 while the trace 
+              of sweep N is downloaded and handed to `consumer`, so short sweeps 
+              are no longer dominated by the transfer and the host-side work
+            
+            sweep_settings = one dict of config updates per sweep, e.g. 
+              [{"power" : p} for p in powers], an empty dict repeats the last sweep
+            consumer(idx, settings, freqs, cmplx_dict) is called in a worker thread,
+              in sweep order, with cmplx_dict like return_complex_data()
+            
+            settings are applied with setup_s2p_measurement() in between sweeps, 
+              while the VNA is idle, see double_buffered_sweeps(). Settings that 
+              change the measurements or the stimulus ("sparam", "edelay", 
+              "n_points", "f_span", "segments", ...) download the previous sweep 
+              first, only sweeps with the same stimulus overlap with a transfer.
+              
+            returns the return value of consumer for every sweep
+        """
+        
+        sweep_settings = list(sweep_settings)
+        all_freqs = []
+        
+        def prepare(idx):
+            settings = sweep_settings[idx]
+            if settings:
+                self.update_configs(**settings)
+                self.setup_s2p_measurement()
+            all_freqs.append(self.get_frequency_axis())
+            return bool(settings)
+        
+        def redefines(idx):
+            # new measurements or a new stimulus, the memory trace of the last sweep is lost
+            return any(key in sweep_settings[idx] for key in _MEMORY_CLEARING_CONFIG_KEYS)
+        
+        futures = []
+        tstart_all = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"{self.instrument_name}_consumer") as executor:
+            for idx, cmplx_dict in self.double_buffered_sweeps(len(sweep_settings), prepare, use_binary=use_binary,
+                                                               redefines=redefines):
+                futures.append(executor.submit(consumer, idx, sweep_settings[idx], all_freqs[idx], cmplx_dict))
+                if verbose is True:
+                    self.print_console(f"[{idx+1}] sweep finished after {time.perf_counter() - tstart_all:1.2f}s")
+            
+            results = [future.result() for future in futures]
+        
+        return results
+    
+    def run_streaming_average(self, stop_condition, max_sweeps=1000, use_binary=True, verbose=True):
+        """
+            Host-side averaging with an early stop: instrument averaging is turned 
+              off, single sweeps are triggered back to back and every complex trace
+              is folded into a StreamingAverage (running mean and variance per point)
+            
+            stop_condition(averager) -> bool is checked after every sweep, e.g. 
+              target_snr(100) or target_uncertainty(...) from StreamingAverage, 
+              so we stop as soon as the data is good enough instead of guessing
+              the number of averages up front. Stops after max_sweeps at the latest.
+            
+            sweeps are double buffered, see double_buffered_sweeps(). The channel 
+              is in HOLD afterwards, and averager.mean[idx] belongs to 
+              configs["sparam"][idx]
+            
+            returns (freqs, averager)
+        """
+        
+        if max_sweeps < 1:
+            raise ValueError(f"max_sweeps has to be at least 1, not {max_sweeps}")
+        
+        self.write_setting('SENSe1:AVERage:STATe OFF')
+        freqs = self.get_frequency_axis()
+        
+        averager = StreamingAverage()
+        tstart_all = time.perf_counter()
+        sweeps = self.double_buffered_sweeps(max_sweeps, num_averages=1, use_binary=use_binary)
+        with closing(sweeps):
+            for idx, traces in sweeps:
+                averager.update(np.stack(list(traces.values())))
+                if stop_condition(averager):
+                    break
+        
+        if verbose is True:
+            self.print_console(f"Averaged {averager.count} sweeps in {time.perf_counter() - tstart_all:1.2f}s")
+        
+        return freqs, averager
+    
+    def run_punchout(self, freqs, p_start, p_stop, n_powers, refine_points=0, use_binary=True, verbose=True):
+        """
+            Punchout map from the PNA's power sweep: one power sweep 
+              (SENSe1:SWEep:TYPE POWer) from p_start to p_stop dBm at every CW 
+              frequency in `freqs`, instead of a full frequency sweep per power
+            
+            refine_points > 0 adds a second, fine pass: `refine_points` 
+              frequencies around where the resonance (min |S21| at every power) 
+              moved during the coarse pass, i.e. around the dispersive shift
+            
+            returns (freqs, powers, s21) with the complex s21[freq_idx, power_idx]
+              of the first s-parameter in configs, freqs sorted and including
+              the refined points. Run setup_s2p_measurement() to go back to 
+              frequency sweeps.
+        """
+        
+        powers = np.linspace(p_start, p_stop, n_powers)
+        freqs = np.sort(np.asarray(freqs, dtype=np.float64))
+        
+        self.print_console(f"Punchout: {freqs.size} frequencies x {n_powers} powers ({p_start} to {p_stop} dBm)")
+        with self.batch_writes():
+            self.write_setting('SENSe1:SWEep:TYPE POWer')
+            self.write_setting(f'SOURce1:POWer:STARt {p_start}')
+            self.write_setting(f'SOURce1:POWer:STOP {p_stop}')
+            self.write_setting(f'SENSe1:SWEep:POINts {n_powers}')
+        
+        s21 = self.power_sweeps(freqs, use_binary)
+        
+        if refine_points > 0 and freqs.size > 1:
+            # resonance at every power, then zoom in on the range it moves over
+            f_res = freqs[np.argmin(np.abs(s21), axis=0)]
+            step = np.max(np.diff(freqs))
+            fine_freqs = np.linspace(f_res.min() - step, f_res.max() + step, refine_points)
+            fine_freqs = fine_freqs[~np.isin(fine_freqs, freqs)]
+        
+        if refine_points > 0 and freqs.size > 1 and fine_freqs.size > 0:
+            if verbose is True:
+                self.print_console(f"Refining {fine_freqs.min():1.6e} to {fine_freqs.max():1.6e} Hz with {fine_freqs.size} points")
+            
+            fine_s21 = self.power_sweeps(fine_freqs, use_binary)
+            freqs = np.concatenate([freqs, fine_freqs])
+            order = np.argsort(freqs)
+            freqs, s21 = freqs[order], np.concatenate([s21, fine_s21])[order]
+        
+        return freqs, powers, s21
+    
+    def power_sweeps(self, cw_freqs, use_binary=True):
+        """
+            one power sweep per CW frequency, returns the complex matrix 
+              [freq_idx, power_idx] of the first s-parameter
+        """
+        cw_freqs = np.asarray(cw_freqs)
+        s21 = None
+        
+        def prepare(idx):
+            self.write_check(f'SENSe1:FREQuency:CW {cw_freqs[idx]}HZ')
+            return False    # the sweep time does not depend on the CW frequency
+        
+        # the CW frequency is the stimulus of a power sweep, download the previous one before changing it
+        sweeps = self.double_buffered_sweeps(cw_freqs.size, prepare, use_binary=use_binary, redefines=lambda idx : True)
+        for idx, traces in sweeps:
+            trace = next(iter(traces.values()))
+            if s21 is None:
+                s21 = np.empty((cw_freqs.size, trace.size), dtype=np.complex128)
+            s21[idx] = trace
+        
+        return s21
 
+    def run_triggered_spectroscopy(self, signal_generator, drive_freqs, f_cw, points_per_step=1,
+                                   settle_time=1e-3, use_binary=True, verbose=True):
+        """
+            Zero-span spectroscopy in one acquisition: the signal generator steps
+              through `drive_freqs` as a list sweep, and the VNA measures
+              `points_per_step` CW points at f_cw per drive frequency
+            
+            The VNA paces the sweep: after every point it sends a pulse on AUX
+              trigger output 1, which advances the generator's list to the next
+              entry, then waits `settle_time` (the sweep dwell) for it to settle.
+              Connect the VNA's AUX trig 1 out to the generator's trigger input.
+              The generator's list wraps around, so every averaging sweep starts
+              at the first drive frequency again.
+            
+            replaces set_freq() -> run_measurement() -> return_data_s2p() per drive
+              frequency, the whole buffer is downloaded once at the end
+            
+            returns a TraceData with drive_freqs as the frequency axis and the
+              complex trace of every s-parameter, averaged over points_per_step
+        """
+        
+        drive_freqs = np.asarray(drive_freqs, dtype=np.float64)
+        n_points = drive_freqs.size * points_per_step
+        
+        signal_generator.setup_list_sweep(np.repeat(drive_freqs, points_per_step))
+        
+        with self.batch_writes():
+            self.write_setting('SENSe1:SWEep:TYPE CW')
+            self.write_setting(f'SENSe1:FREQuency:CW {f_cw}HZ')
+            self.write_setting(f'SENSe1:SWEep:POINts {n_points}')
+            self.write_setting('SENSe1:SWEep:GENeration STEP')
+            self.write_setting(f'SENSe1:SWEep:DWELl {settle_time}')
+            self.write_setting('TRIGger:CHANnel1:AUXiliary1 ON')
+            self.write_setting('TRIGger:CHANnel1:AUXiliary1:INTerval POINt')
+            self.write_setting('TRIGger:CHANnel1:AUXiliary1:POSition AFTer')
+            self.write_setting('OUTPut:STATe ON')
+        
+        expected_duration = self.estimate_measurement_duration()
+        if verbose is True:
+            self.print_console(f"Triggered spectroscopy: {drive_freqs.size} drive frequencies x {points_per_step} points at {f_cw/1e9:1.6f} GHz, expecting {expected_duration:1.2f}s")
+        
+        try:
+            self.write_check('INITiate:CONTinuous ON')
+            tstart = self.start_group_sweep()
+            remaining = max(0, expected_duration - (time.perf_counter() - tstart))
+            self.poll_until(self.check_opc_bit, expected_duration=remaining,
+                            timeout=self.operation_timeout(expected_duration))
+        finally:
+            # back to an analog sweep without dwell or AUX trigger pulses, so the
+            #   following frequency sweeps are not stepped and do not trigger the generator
+            with self.batch_writes():
+                self.write_check('SENSe1:SWEep:MODE HOLD')
+                self.write_check('SENSe1:SWEep:GENeration ANALog')
+                self.write_check('SENSe1:SWEep:DWELl 0')
+                self.write_check('TRIGger:CHANnel1:AUXiliary1 OFF')
+            self.invalidate_state_cache(["SENSe1:SWEep:GENeration", "SENSe1:SWEep:DWELl", "TRIGger:CHANnel1:AUXiliary1"])
+            signal_generator.stop_list_sweep()
+        
+        traces = self.return_complex_data(use_binary=use_binary)
+        traces = {sparam : trace.reshape(drive_freqs.size, points_per_step).mean(axis=1)
+                  for sparam, trace in traces.items()}
+        
+        return TraceData(drive_freqs, traces, {"f_cw" : f_cw, "points_per_step" : points_per_step})
+    
+    def run_tracked_measurements(self, sweep_settings, tracker=None, use_binary=True, verbose=True):
+        """
+            Measure a single resonance with f_center/f_span/n_points following it:
+              after every trace `tracker` (a ResonanceTracker) estimates f_res and
+              the linewidth, and re-centers and re-sizes the next sweep so that a
+              fixed number of linewidths stays in view
+            
+            sweep_settings = one dict of config updates per trace, e.g.
+              [{"power" : p, "averages" : n} for p, n in zip(powers, averages)],
+              the first trace uses the f_center/f_span/n_points in configs
+            with configs["segments"] set, the homophasal segments are recomputed
+              for every trace, see compute_homophasal_segments
+            
+            returns a TraceData per trace, with the estimate in
+              metadata["resonance"] = (f_res, linewidth) or None if it was lost
+        """
+        
+        if tracker is None:
+            tracker = ResonanceTracker()
+        
+        all_data = []
+        next_configs = {}
+        for idx, settings in enumerate(sweep_settings):
+            self.update_configs(**{**settings, **next_configs})
+            if self.configs.get("segments") is not None:
+                self.compute_homophasal_segments()
+            self.setup_s2p_measurement()
+            
+            self.run_measurement(verbose=False)
+            data = self.return_data_s2p(use_binary=use_binary, single_transfer=True, as_dataframe=False)
+            
+            next_configs = tracker.update(data.freqs, data[self.configs["sparam"][0]])
+            data.metadata["resonance"] = tracker.history[-1]
+            all_data.append(data)
+            
+            if verbose is True:
+                estimate = tracker.history[-1]
+                found = "lost" if estimate is None else f"f_res = {estimate[0]/1e9:1.6f} GHz"
+                self.print_console(f"[{idx+1}/{len(sweep_settings)}] {found}, next span {next_configs['f_span']/1e3:1.1f} kHz with {next_configs['n_points']} points")
+        
+        return all_data
+    
+    def plan_wideband_chunks(self, n_points, max_points=None, overlap=10):
+        """
+            split a grid of n_points into instrument-sized sweeps, returns the
+              (first, stop) grid indices of every chunk, consecutive chunks share
+              `overlap` points
+        """
+        if max_points is None:
+            max_points = self.configs.get("max_points", _MAX_SWEEP_POINTS)
+        if max_points <= overlap + 1:
+            raise ValueError(f"max_points ({max_points}) has to be larger than overlap + 1 ({overlap + 1})")
+        
+        chunks = [(0, min(max_points, n_points))]
+        while chunks[-1][1] < n_points:
+            first = chunks[-1][1] - overlap
+            chunks.append((first, min(first + max_points, n_points)))
+        return chunks
+    
+    def wideband_sweep_chunks(self, f_start, f_stop, n_points, max_points=None, overlap=10, out=None,
+                              stitch=True, use_binary=True):
+        """
+            Generator for a sweep of n_points from f_start to f_stop that does not
+              fit in one VNA sweep: the range is measured in chunks of at most
+              max_points (configs["max_points"], default 100001) on one common
+              frequency grid, see plan_wideband_chunks
+            
+            every chunk goes straight into `out`, a complex array of shape
+              (num sparams, n_points), which is
+                - None : preallocated
+                - a str or Path : a .npy file that is memory-mapped, for surveys
+                                  that do not fit in RAM (np.load(..., mmap_mode="r"))
+                - an np.ndarray : filled in place
+            
+            stitch=True scales every chunk by the complex factor that matches it to
+              the previous chunk on the `overlap` shared points (least squares),
+              so magnitude and phase are continuous across the chunk boundaries.
+              The shared points keep the values of the earlier chunk.
+            
+            yields (chunk_idx, TraceData) with the stitched chunk (views into out)
+              as soon as it is downloaded. Every chunk has its own stimulus, and
+              a memory trace does not survive a change of the stimulus, so each
+              chunk is downloaded before the next one is set up instead of while
+              it sweeps, see `redefines` of double_buffered_sweeps(). Run it after
+              setup_s2p_measurement(), the channel is in HOLD afterwards
+        """
+        
+        sparams = self.configs["sparam"]
+        freqs = np.linspace(f_start, f_stop, n_points)
+        chunks = self.plan_wideband_chunks(n_points, max_points, overlap)
+        out = self.wideband_output(n_points, out)
+        
+        def prepare(idx):
+            first, stop = chunks[idx]
+            with self.batch_writes():
+                self.write_setting('SENSe1:SWEep:TYPE LINear')
+                self.write_setting(f'SENSe1:SWEep:POINts {stop - first}')
+                self.write_setting(f'SENSe1:FREQuency:STARt {freqs[first]}HZ')
+                self.write_setting(f'SENSe1:FREQuency:STOP {freqs[stop-1]}HZ')
+            # the VNA couples center/span to start/stop, so none of the four cached values hold anymore
+            self.invalidate_state_cache(_FREQUENCY_HEADERS)
+            return True
+        
+        # every chunk changes start/stop/points, download the previous one first
+        sweeps = self.double_buffered_sweeps(len(chunks), prepare, use_binary=use_binary, redefines=lambda idx : True)
+        for idx, traces in sweeps:
+            first, stop = chunks[idx]
+            chunk = np.stack([traces[sparam] for sparam in sparams])
+            
+            shared = 0 if idx == 0 else overlap
+            if stitch is True and shared > 0:
+                previous = out[:, first:first+shared]
+                scale = (np.sum(previous * np.conj(chunk[:, :shared]), axis=1)
+                         / np.sum(np.abs(chunk[:, :shared])**2, axis=1))
+                chunk *= scale[:, None]
+            out[:, first+shared:stop] = chunk[:, shared:]
+            
+            yield idx, TraceData(freqs[first:stop], {sparam : out[sdx, first:stop] for sdx, sparam in enumerate(sparams)},
+                                 {"chunk" : (first, stop), "num_chunks" : len(chunks)})
+        
+        if isinstance(out, np.memmap):
+            out.flush()
+    
+    def wideband_output(self, n_points, out=None):
+        """
+            the (num sparams, n_points) complex array a wideband sweep is stitched
+              into, see wideband_sweep_chunks() for `out`
+        """
+        self.update_sparam_configs()
+        shape = (len(self.configs["sparam"]), n_points)
+        
+        if out is None:
+            return np.empty(shape, dtype=np.complex128)
+        if isinstance(out, (str, Path)):
+            return np.lib.format.open_memmap(out, mode="w+", dtype=np.complex128, shape=shape)
+        if out.shape != shape:
+            raise ValueError(f"out has shape {out.shape}, expected {shape}")
+        return out
+    
+    def run_wideband_sweep(self, f_start, f_stop, n_points, consumer=None, max_points=None, overlap=10,
+                           out=None, stitch=True, use_binary=True, verbose=True):
+        """
+            Wideband survey, e.g. 4-8 GHz at 1 kHz resolution, stitched into one
+              array without keeping a DataFrame per sub-span around, see
+              wideband_sweep_chunks() for max_points, overlap, out and stitch
+            
+            consumer(chunk_idx, chunk_data) is called with every stitched chunk
+              as it arrives, e.g. to plot or look for resonators on the fly
+            
+            returns a TraceData of the whole range, its traces are rows of `out`
+        """
+        
+        out = self.wideband_output(n_points, out)
+        
+        tstart_all = time.perf_counter()
+        sweeps = self.wideband_sweep_chunks(f_start, f_stop, n_points, max_points, overlap, out, stitch, use_binary)
+        with closing(sweeps):
+            for idx, chunk_data in sweeps:
+                if consumer is not None:
+                    consumer(idx, chunk_data)
+                if verbose is True:
+                    self.print_console(f"[{idx+1}/{chunk_data.metadata['num_chunks']}] {chunk_data.freqs[0]/1e9:1.6f} to {chunk_data.freqs[-1]/1e9:1.6f} GHz after {time.perf_counter() - tstart_all:1.2f}s")
+        
+        return TraceData(np.linspace(f_start, f_stop, n_points),
+                         {sparam : out[idx] for idx, sparam in enumerate(self.configs["sparam"])})
+    
+    
     # TODO: only written like this to not break previous scripts
     #         need to fix across the board!!
     def return_data(self):
@@ -569,96 +1346,183 @@ class VNA_Keysight(BaseDriver):
         
         return freqs, magn, phase
     
-    def return_data_s2p(self, get_memory=False, archive_complex=False):
+    def get_frequency_axis(self):
+        """
+            frequencies of every point of channel 1, from the segment table in
+              configs if there is one, otherwise from the VNA's start/stop/points
+
+            both are cached, until the segment table or the sweep settings change
+        """
+        segment_table = self.get_segment_table()
+        if segment_table is not None:
+            return segment_table.frequency_axis()
+        
+        # linear sweep: only ask the VNA again if a sweep setting was written since
+        #   last time, or is not known (state cache invalidated by *RST, reconnect, ...)
+        sweep_key = tuple(self.state_cache.get(header) for header in _LINEAR_SWEEP_HEADERS)
+        is_known = None not in sweep_key[:2] and (None not in sweep_key[2:4] or None not in sweep_key[4:])
+        if is_known and self.freqs_cache is not None and self.freqs_cache[0] == sweep_key:
+            return self.freqs_cache[1]
+        
+        n_points = self.query_check(f'SENSe1:SWEep:POINts?', fmt=int)
+        f_start = self.query_check('SENSe1:FREQuency:START?', fmt=float)
+        f_stop = self.query_check('SENSe1:FREQuency:STOP?', fmt=float)
+        freqs = np.linspace(f_start, f_stop, n_points)
+        
+        self.freqs_cache = (sweep_key, freqs) if is_known else None
+        return freqs
+    
+    def return_data_s2p(self, get_memory=False, archive_complex=False, use_binary=False, single_transfer=False,
+                        split_resonators=False, as_dataframe=True):
         
         """
-            Transfer data from VNA to PC, organized into a dict
-              with each key as the s-parameter and the value
-               equal to [freqs, magn_dB, phase_rad]
+            Transfer data from VNA to PC, as a DataFrame with the columns
+              | Frequency | S21 magn_dB | S21 phase_rad | ... 
+              or | Frequency | S21 complex | ... with archive_complex=True
+            
+            as_dataframe=False returns the TraceData the DataFrame is built 
+              from instead: one frequency array and a complex array per
+              s-parameter ("{sparam}_mem" for memory), no copies
+               
+            use_binary=True transfers the traces as REAL,32/REAL,64 
+              binary blocks instead of ASCII, see set_data_transfer_format
+              
+            single_transfer=True downloads the complex SDATA of every 
+              measurement in one CALC1:DATA:MFD? request (plus one for
+              memory), see return_complex_data. magn/phase are computed
+              on the PC and the display format of the VNA is left alone
+              
+            split_resonators=True returns {name : DataFrame or TraceData} with 
+              one entry per resonator of compute_multi_resonator_segments
         """
         
-        if "segments" in self.configs and self.configs["segments"] is not None:
-            # Read the list of all segments
-            freqs = np.array([])
-            for s in self.configs["segments"]:
-                ssplit = s.replace(" ", "").split(',')
-                
-                # int() doesnt want a string of a float like '12.0', so if it has  
-                # a decimal point, turn it into a float first
-                nf = int(ssplit[2]) if '.' not in ssplit[2] else int(float(ssplit[2]))  
-                f1 = float(ssplit[3])
-                f2 = float(ssplit[4])
-                f = np.linspace(f1, f2, nf)
-                freqs = np.hstack((freqs, f))
-        else:
-            n_points = self.query_check(f'SENSe1:SWEep:POINts?', fmt=int)
-            f_start = self.query_check('SENSe1:FREQuency:START?', fmt=float)
-            f_stop = self.query_check('SENSe1:FREQuency:STOP?', fmt=float)
-            freqs = np.linspace(f_start, f_stop, n_points)
+        freqs = self.get_frequency_axis()
         
         self.update_sparam_configs()
         
-        data_dict = {}
-        for idx, sparam in enumerate(self.configs["sparam"]):
-            self.print_console(f"[{idx+1}/{len(self.configs["sparam"])}] Downloading {sparam} from VNA ")
-            # read in magn
-            self.write_check(f'CALC1:PAR:MNUM {idx+1}')  # select ch 1, meas (idx+1)
-            self.write_check('CALC1:FORMat UPHASe') # read in the unwrapped phase
-            phase = self.query_check_ascii('CALC1:DATA? FDATA', container=np.array)
-            self.write_check('CALC1:FORMat MLOG') # read in the magn_dB
-            magn_dB = self.query_check_ascii('CALC1:DATA? FDATA', container=np.array)
-            phase_rad = np.deg2rad(phase)
-                    
-            # possible to use CALC:DATA:MFD? "1,2,3,4" which returns traces 1->4
-
-            data_dict[sparam] = [freqs, magn_dB, phase_rad]
+        formatted = {}
+        if single_transfer is True:
+            traces = self.return_complex_data(get_memory=get_memory, use_binary=use_binary)
+            
+        else:
+            if use_binary is True:
+                self.set_data_transfer_format(use_binary=True)
             
-            if get_memory is True:
+            def query_formatted(data_type):
+                # (magn_dB, phase_rad) of the selected measurement, as the VNA unwrapped it
                 self.write_check('CALC1:FORMat UPHASe') # read in the unwrapped phase
-                phase_memory = self.query_check_ascii('CALC1:DATA? FMEM', container=np.array)
+                phase_rad = np.deg2rad(self.query_trace_data(f'CALC1:DATA? {data_type}', use_binary))
                 self.write_check('CALC1:FORMat MLOG') # read in the magn_dB
-                magn_dB_memory = self.query_check_ascii('CALC1:DATA? FMEM', container=np.array)
-                phase_rad = np.deg2rad(phase)
-                data_dict[f"{sparam}_mem"] = [freqs, magn_dB_memory, phase_memory]
-        
-        ############################################################
-        ### used to be its own function, 'make_dfs', but decided to 
-        ### merge with return_data_s2p 
-        ############################################################
-        
-        """
-            takes a dict whose values are lists of 3 np.arrays 
-                and the keys correspond to the associated sparam
-                i.e.
-                    "sparam" : [freq, magn, phase_rad]
-            aka the output of return_data_s2p
-            
-            returns 
-                df : single dataframe with 'freqs' as the first col 
-                        followed by magn/phase data of each entry
-                e.g.
-                  | freqs | 'sparam' Magn_dB | 'sparam' Phase_rad | ...
-        """
-        
-        all_dfs = []
-        for sparam, (freqs, magn_dB, phase_rad) in data_dict.items():
-            if archive_complex is False:
-                all_arrays = np.array([freqs, magn_dB, phase_rad])
-                all_columns = ["Frequency", f"{sparam} magn_dB", f"{sparam} phase_rad"]
-            else:
-                magn_lin = 10**(magn_dB/20)
-                cmplx = magn_lin * np.exp(1j*phase_rad)
-                all_arrays = np.array([freqs, cmplx])
-                all_columns = ["Frequency", f"{sparam} complex"]
-            df = pd.DataFrame.from_records(all_arrays.T, columns=all_columns)
-            df.apply(lambda x: np.real(x))
-            all_dfs.append(df)
+                magn_dB = self.query_trace_data(f'CALC1:DATA? {data_type}', use_binary)
+                return magn_dB, phase_rad
+            
+            for idx, sparam in enumerate(self.configs["sparam"]):
+                self.print_console(f"[{idx+1}/{len(self.configs["sparam"])}] Downloading {sparam} from VNA ")
+                self.write_check(f'CALC1:PAR:MNUM {idx+1}')  # select ch 1, meas (idx+1)
+                formatted[sparam] = query_formatted("FDATA")
+                if get_memory is True:
+                    formatted[f"{sparam}_mem"] = query_formatted("FMEM")
+            
+            # the complex traces for TraceData, the DataFrame keeps the formatted ones
+            traces = {name : 10**(magn_dB/20) * np.exp(1j*phase_rad) for name, (magn_dB, phase_rad) in formatted.items()}
             
-        combined_df = pd.concat(all_dfs, axis=1)
-        combined_df = combined_df.loc[:,~combined_df.columns.duplicated()].copy()
+            # put the VNA back in ASCII so that run_measurement & friends are unaffected
+            if use_binary is True:
+                self.set_data_transfer_format(use_binary=False)
+        
+        trace_data = TraceData(freqs, traces, formatted=formatted)
+        if self.configs.get("snapshot_with_data", False) is True:
+            trace_data.metadata["instrument_snapshot"] = self.snapshot()
+        
+        if split_resonators is True:
+            all_traces = self.split_by_resonator(trace_data)
+            if as_dataframe is True:
+                return {name : td.to_dataframe(archive_complex) for name, td in all_traces.items()}
+            return all_traces
+        
+        if as_dataframe is True:
+            return trace_data.to_dataframe(archive_complex)
+        return trace_data
+    
+    def split_by_resonator(self, data):
+        """
+            cut the result of a multi-resonator sweep (TraceData or DataFrame) 
+                into {name : TraceData/DataFrame}, one per resonator of 
+                configs["resonator_slices"]
+        """
+        resonator_slices = self.configs.get("resonator_slices")
+        if not resonator_slices:
+            raise ValueError("No resonator_slices in configs, use compute_multi_resonator_segments() first")
+        
+        if isinstance(data, TraceData):
+            return {name : data.select(slice(first, last)) for name, (first, last) in resonator_slices.items()}
+        return {name : data.iloc[first:last].reset_index(drop=True) 
+                for name, (first, last) in resonator_slices.items()}
+    
+    
+    def return_complex_data(self, get_memory=False, use_binary=False):
+        """
+            Transfer the complex SDATA of every measurement in channel 1
+              with a single CALC1:DATA:MFD? request, and SMEM with a second
+              request if get_memory is True
+              
+            returns a dict with each key as the s-parameter (and 
+              "{sparam}_mem" for memory) and the value a complex np.array
+        """
         
-        return combined_df
+        self.update_sparam_configs()
+        
+        requests = [("SDATA", "")]
+        if get_memory is True:
+            requests.append(("SMEM", "_mem"))
+        
+        if use_binary is True:
+            self.set_data_transfer_format(use_binary=True)
+        
+        cmplx_dict = {}
+        for data_type, suffix in requests:
+            self.print_console(f"Downloading {data_type} for {self.configs['sparam']} from VNA ")
+            cmplx_dict.update(self.query_complex_traces(data_type, suffix, use_binary))
+        
+        if use_binary is True:
+            self.set_data_transfer_format(use_binary=False)
+            
+        return cmplx_dict
+    
+    def query_complex_traces(self, data_type="SDATA", suffix="", use_binary=False):
+        """
+            one CALC1:DATA:MFD? request for `data_type` (SDATA or SMEM) of every
+              measurement, returns {f"{sparam}{suffix}" : complex np.array}
+              
+            the transfer format should already be set by set_data_transfer_format
+        """
+        sparams = self.configs["sparam"]
+        mnums = ",".join([str(idx+1) for idx in range(len(sparams))])
+        
+        flat_data = self.query_trace_data(f'CALC1:DATA:MFD? "{mnums}",{data_type}', use_binary)
+        all_traces = self.split_complex_traces(flat_data, len(sparams))
+        return {f"{sparam}{suffix}" : trace for sparam, trace in zip(sparams, all_traces)}
+    
+    def split_complex_traces(self, flat_data, num_traces):
+        """
+            MFD? returns every trace back to back as interleaved 
+              [re0, im0, re1, im1, ...] pairs, so reshape to 
+              (num_traces, n_points) complex values without a python loop
+        """
+        flat_data = np.ascontiguousarray(flat_data, dtype=np.float64)
+        if flat_data.size % (2*num_traces) != 0:
+            raise ValueError(f"Received {flat_data.size} values, which can not be split into {num_traces} complex traces")
+        
+        return flat_data.view(np.complex128).reshape(num_traces, -1)
     
+    def complex_to_magn_phase(self, cmplx):
+        """
+            vectorized host-side equivalent of the MLOG and UPHase formats,
+              returns (magn_dB, phase_rad)
+        """
+        magn_dB = 20*np.log10(np.abs(cmplx))
+        phase_rad = np.unwrap(np.angle(cmplx))
+        return magn_dB, phase_rad
     
     def return_memory_and_data(self):
         
@@ -666,6 +1530,96 @@ class VNA_Keysight(BaseDriver):
         
         return data
     
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # ~~~  Saved configurations
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    
+    def configuration_hash(self, configs=None):
+        """
+            short content hash of everything setup_s2p_measurement sends,
+                the same configs always give the same hash
+        """
+        configs = self.configs if configs is None else configs
+        content = []
+        for key in _SETUP_CONFIG_KEYS:
+            value = configs.get(key)
+            if isinstance(value, SegmentTable):
+                value = value.to_scpi()
+            elif isinstance(value, (list, tuple)):
+                value = tuple(value)
+            content.append((key, value))
+        return hashlib.sha1(repr(content).encode()).hexdigest()[:12]
+    
+    def register_configuration(self, name, **config_updates):
+        """
+            set up the VNA (with configs updated by `config_updates`) and save the
+                instrument state as "bcqt_{name}_{hash}.sta" with MMEM:STORe, so 
+                that recall_configuration(name) can switch back with one command
+                
+            e.g. a wide sweep to find resonators and a narrow homophasal sweep,
+                register both once and alternate with recall_configuration().
+                returns the content hash of the configuration
+        """
+        if config_updates:
+            self.update_configs(**config_updates)
+        self.setup_s2p_measurement()
+        
+        config_hash = self.configuration_hash()
+        filename = f"bcqt_{name}_{config_hash}.sta"
+        self.write_check(f'MMEMory:STORe "{filename}"')
+        
+        self.saved_configurations[name] = {
+            "hash" : config_hash,
+            "filename" : filename,
+            "configs" : dict(self.configs),
+            "state_cache" : dict(self.state_cache),
+            "state_commands" : dict(self.state_commands),
+            "measurement_layout" : self.measurement_layout,
+        }
+        return config_hash
+    
+    def recall_configuration(self, name):
+        """
+            switch to a configuration saved by register_configuration() with
+                one MMEM:LOAD, and restore the configs and state cache it had
+            
+            falls back to a full setup_s2p_measurement() (and saves the state 
+                again) when the state file is not on the VNA (anymore), or the
+                VNA reports an error loading it. returns True if the state file 
+                was loaded
+        """
+        if name not in self.saved_configurations:
+            raise KeyError(f"No configuration '{name}', known are {list(self.saved_configurations)}")
+        
+        saved = self.saved_configurations[name]
+        self.configs.update(saved["configs"])
+        
+        is_loaded = False
+        catalog = self.query_check('MMEMory:CATalog?')
+        if saved["filename"] in catalog:
+            # errors left in the queue from before would look like a failed load
+            self.write_check('*CLS')
+            self.write_check(f'MMEMory:LOAD "{saved["filename"]}"')
+            # a malformed SYST:ERR? reply comes back as one string instead of (status, description)
+            error = self.check_instr_error_queue()
+            status = error[0] if isinstance(error, tuple) else error.split(",")[0]
+            try:
+                is_loaded = int(self.strip_specials(status)) == 0
+            except ValueError:
+                self.print_warning(f"Could not read the error queue after loading '{saved['filename']}': {error}")
+        
+        if is_loaded is True:
+            # MMEM:LOAD wiped the state cache, but we know what it loaded
+            self.state_cache.update(saved["state_cache"])
+            self.state_commands.update(saved["state_commands"])
+            self.measurement_layout = saved["measurement_layout"]
+        else:
+            self.print_warning(f"Could not load '{saved['filename']}', sending the full setup for '{name}' instead")
+            self.invalidate_state_cache()
+            self.register_configuration(name)
+        
+        return is_loaded
+    
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     # ~~~  Instr Scripts
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -1,5 +1,10 @@
 # ./bcqt_hub/modules/instruments
 
-from . import SA_RnS_FSEB20
-from . import SG_Anritsu
-from . import VNA_Keysight
\ No newline at end of file
+# imported on first use, see bcqthub/_lazy.py
+from ..._lazy import lazy_submodules
+
+__getattr__, __dir__ = lazy_submodules(__name__, {
+    "SA_RnS_FSEB20" : ".SA_RnS_FSEB20",
+    "SG_Anritsu" : ".SG_Anritsu",
+    "VNA_Keysight" : ".VNA_Keysight",
+})
@@ -1,5 +1,4 @@
 import time
-import matplotlib.pyplot as plt
 if __name__ != "__main__":
     from .libphox import Labphox
 import numpy as np
@@ -477,6 +476,8 @@ class Cryoswitch:
             return None
 
     def plotting_function(self, current_profile, port, contact, polarity):
+        import matplotlib.pyplot as plt
+
         if polarity:
             polarity_str = 'Connect'
         else:
@@ -684,6 +685,7 @@ class Cryoswitch:
         for contact in range(1, 7):
             self.disconnect(port, contact)
         if self.plot:
+            import matplotlib.pyplot as plt
             plt.legend([1, 2, 3, 4, 5, 6])
 
     """ do not use smart_connect, thanks :)  -jorge """
@@ -725,6 +727,7 @@ class Cryoswitch:
             expected_current = ((voltage - 2.2) / 10000 + (voltage - 3) / 4700 + voltage / 480) * 1000
             test_current = self.discharge()
             if self.plot:
+                import matplotlib.pyplot as plt
                 plt.plot(test_current)
                 plt.hlines(expected_current, 0, len(test_current), colors='red', linestyles='dashed')
                 plt.xlabel('Sample')
@@ -1,6 +1,11 @@
 # ./bcqt_hub/drivers/misc
 
-from .MiniCircuits import MC_FindDevices
-from .MiniCircuits import MC_RFSwitch
-from .MiniCircuits import MC_VarAttenuator
-from .CryoSwitchController import CryoSwitchController
+# imported on first use, see bcqthub/_lazy.py
+from ..._lazy import lazy_submodules
+
+__getattr__, __dir__ = lazy_submodules(__name__, {
+    "MC_FindDevices" : ".MiniCircuits.MC_FindDevices",
+    "MC_RFSwitch" : ".MiniCircuits.MC_RFSwitch",
+    "MC_VarAttenuator" : ".MiniCircuits.MC_VarAttenuator",
+    "CryoSwitchController" : ".CryoSwitchController.CryoSwitchController",
+})
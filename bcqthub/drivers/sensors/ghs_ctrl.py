@@ -33,10 +33,8 @@ sys.path.append(r"C:\Users\Lehnert Lab\GitHub")
 # import bcqthub.experiments.quick_helpers as qh
 # from bcqthub.bcqthub.drivers.instruments.VNA_Keysight import VNA_Keysight
 
-import bcqthub
-from bcqthub.src.DataHandler import DataHandler, DataSet
-
-from bcqthub.drivers.instruments.VNA_Keysight import VNA_Keysight
+# nothing in here talks to the VNA or saves data, so reading temperatures 
+#   does not need to import VNA_Keysight (pyvisa) or DataHandler (pandas)
 
 class GHS_Controller():
     """
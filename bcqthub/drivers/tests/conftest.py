@@ -0,0 +1,85 @@
+import pytest
+import numpy as np
+import pyvisa
+
+from bcqthub.drivers.BaseDriver import BaseDriver
+
+
+class FakeResource():
+    """
+        minimal stand-in for a pyvisa MessageBasedResource, replies are
+            looked up in `responses` and queued as raw bytes
+    """
+    def __init__(self, responses=None):
+        self.responses = {"*IDN?" : "Keysight,N5222B,SN0000,A.00.00"}
+        self.responses.update(responses or {})
+        self.read_termination = "\n"
+        self.chunk_size = 16
+        self.written = []
+        self._buffer = b""
+        self.closed = False
+
+    @property
+    def session(self):
+        if self.closed:
+            raise pyvisa.InvalidSession()
+        return 1
+
+    def close(self):
+        self.closed = True
+
+    def open(self):
+        self.closed = False
+
+    def write(self, cmd):
+        if self.closed:
+            raise pyvisa.InvalidSession()
+        self.written.append(cmd)
+        reply = self.responses.get(cmd)
+        if reply is not None:
+            self._buffer += reply if isinstance(reply, bytes) else (reply + "\n").encode()
+
+    def read_bytes(self, count):
+        chunk, self._buffer = self._buffer[:count], self._buffer[count:]
+        return chunk
+
+    def read_raw(self):
+        chunk, self._buffer = self._buffer, b""
+        return chunk
+
+    def read(self):
+        return self.read_raw().decode().rstrip("\n")
+
+    def query(self, cmd):
+        self.write(cmd)
+        return self.read()
+
+
+def ieee_block(values, dtype):
+    payload = np.asarray(values, dtype=dtype).tobytes()
+    length = str(len(payload))
+    return f"#{len(length)}{length}".encode() + payload + b"\n"
+
+
+class FakeRM():
+    def __init__(self, *args):
+        self.opened = []
+        self.closed = False
+
+    def open_resource(self, address, **kwargs):
+        self.opened.append(address)
+        return FakeResource()
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def make_driver(monkeypatch):
+    monkeypatch.setattr(pyvisa, "ResourceManager", FakeRM)
+    
+    def _make(responses=None, driver_class=BaseDriver, **configs):
+        resource = FakeResource(responses)
+        config = {"instrument_name" : "test", "instr_resource" : resource, **configs}
+        return driver_class(config), resource
+    return _make
@@ -0,0 +1,364 @@
+import pytest
+import pyvisa
+import time
+import asyncio
+import numpy as np
+
+from conftest import ieee_block
+
+
+@pytest.mark.parametrize("datatype, dtype", [("f", "<f4"), ("d", "<f8"), ("f", ">f4"), ("d", ">f8")])
+def test_query_check_binary_formats(make_driver, datatype, dtype):
+    values = np.linspace(-1, 1, 1001)
+    driver, resource = make_driver({"CALC1:DATA? FDATA" : ieee_block(values, dtype)})
+    
+    data = driver.query_check_binary("CALC1:DATA? FDATA", datatype=datatype, is_big_endian=dtype[0] == ">")
+    
+    np.testing.assert_allclose(data, values.astype(dtype))
+    assert data.dtype.isnative
+    assert resource._buffer == b""   # termination character was consumed
+
+
+def test_query_check_binary_preallocated(make_driver):
+    values = np.arange(100, dtype="<f8")
+    driver, resource = make_driver({"CALC1:DATA? FDATA" : ieee_block(values, "<f8")})
+    
+    out = np.zeros(200)
+    data = driver.query_check_binary("CALC1:DATA? FDATA", out=out)
+    
+    assert np.shares_memory(data, out)
+    np.testing.assert_array_equal(out[:100], values)
+    
+    resource.responses["CALC1:DATA? FDATA"] = ieee_block(values, "<f8")
+    with pytest.raises(ValueError):
+        driver.query_check_binary("CALC1:DATA? FDATA", out=np.zeros(10))
+
+
+def test_query_check_binary_bad_header(make_driver):
+    driver, resource = make_driver({"CALC1:DATA? FDATA" : "1.0,2.0"})
+    with pytest.raises(ValueError):
+        driver.query_check_binary("CALC1:DATA? FDATA")
+
+
+def test_query_check_ascii_raises_on_malformed_reply(make_driver):
+    driver, resource = make_driver({"CALC1:DATA? FDATA" : "1.0,2.0,3.0", "CALC1:DATA? FMEM" : "1.0,NO DATA"})
+    
+    np.testing.assert_array_equal(driver.query_check_ascii("CALC1:DATA? FDATA"), [1.0, 2.0, 3.0])
+    with pytest.raises(ValueError, match="NO DATA"):
+        driver.query_check_ascii("CALC1:DATA? FMEM")
+
+
+def test_batch_writes_coalesces_and_flushes_before_queries(make_driver):
+    driver, resource = make_driver({"CALC1:PAR:CAT:EXT?" : "NO CATALOG"})
+    resource.written.clear()
+    
+    with driver.batch_writes():
+        driver.write_check("OUTPut:STATe OFF")
+        driver.write_check("*CLS")
+        assert resource.written == []
+        driver.query_check("CALC1:PAR:CAT:EXT?")
+        driver.write_check("SOUR1:POW1 -30")
+        driver.write_check("SENSe1:BANDwidth 1000HZ")
+    
+    assert resource.written == [":OUTPut:STATe OFF;*CLS", 
+                                "CALC1:PAR:CAT:EXT?", 
+                                ":SOUR1:POW1 -30;:SENSe1:BANDwidth 1000HZ"]
+
+
+def test_batch_writes_max_length(make_driver):
+    driver, resource = make_driver()
+    commands = [f"SENSe1:AVERage:Count {idx}" for idx in range(10)]
+    
+    messages = driver.join_scpi_commands(commands, max_length=60)
+    
+    assert all(len(msg) <= 60 for msg in messages)
+    assert ";".join(messages).split(";") == [f":{cmd}" for cmd in commands]
+
+
+def test_batch_writes_error_check(make_driver):
+    driver, resource = make_driver({"*OPC?" : "1", ":SYST:ERR?" : '-113,"Undefined header"'})
+    
+    with pytest.raises(RuntimeError):
+        with driver.batch_writes(check_errors=True):
+            driver.write_check("SENS1:BOGUS 1")
+    
+    assert resource.written[-3:] == [":SENS1:BOGUS 1", "*OPC?", ":SYST:ERR?"]
+
+
+def test_split_scpi_setting_normalizes_short_and_long_forms(make_driver):
+    driver, resource = make_driver()
+    
+    assert driver.split_scpi_setting("SENSe1:AVERage:Count 10") == driver.split_scpi_setting(":sens:aver:coun 10.0")
+    assert driver.split_scpi_setting("SOURce:POWer1 -30") == ("SOUR1:POW1", (-30.0,))
+    assert driver.split_scpi_setting("*CLS") == ("*CLS", None)
+
+
+def test_write_setting_skips_cached_values(make_driver):
+    driver, resource = make_driver()
+    resource.written.clear()
+    
+    assert driver.write_setting("SOUR1:POW1 -30") is True
+    assert driver.write_setting("SOURce1:POWer1 -30.0") is False
+    assert driver.write_setting("SOUR1:POW1 -33") is True
+    
+    # a reset puts the instrument in an unknown state
+    driver.write_check("SYSTem:UPRESet")
+    assert driver.write_setting("SOUR1:POW1 -33") is True
+    
+    assert resource.written == ["SOUR1:POW1 -30", "SOUR1:POW1 -33", "SYSTem:UPRESet", "SOUR1:POW1 -33"]
+
+
+def test_actions_are_never_cached(make_driver):
+    driver, resource = make_driver()
+    resource.written.clear()
+    
+    for _ in range(2):
+        driver.write_setting('MMEMory:STORe "state.sta"')
+        driver.write_setting('CALC1:MEASure2:DEFine "S21"')
+        driver.write_setting("SENSe1:SWEep:MODE GROups")
+        driver.write_setting("*ESE 1")
+    
+    assert len(resource.written) == 8 and driver.state_cache == {}
+
+
+def test_state_cache_invalidated_on_reconnect(make_driver):
+    driver, resource = make_driver()
+    driver.write_setting("SENS1:BAND 1000HZ")
+    
+    driver.open_pyvisa_resource()
+    
+    assert driver.state_cache == {}
+
+
+def test_poll_until_first_check_after_expected_duration(make_driver):
+    driver, resource = make_driver()
+    calls = []
+    def is_finished():
+        calls.append(time.perf_counter())
+        return len(calls) >= 3
+    
+    tstart = time.perf_counter()
+    t_elapsed = driver.poll_until(is_finished, expected_duration=0.05, min_interval=0.001)
+    
+    assert calls[0] - tstart >= 0.05
+    assert len(calls) == 3 and t_elapsed < 0.5
+    
+    with pytest.raises(TimeoutError):
+        driver.poll_until(lambda: False, timeout=0.05, min_interval=0.001)
+
+
+def test_send_cmd_and_wait_falls_back_to_esr_polling(make_driver):
+    driver, resource = make_driver()
+    replies = iter(["+0", "+0", "+1"])
+    resource.query = lambda cmd: next(replies) if cmd == "*ESR?" else None
+    resource.written.clear()
+    
+    driver.send_cmd_and_wait("INIT:IMM")
+    
+    assert driver.srq_supported is False
+    assert resource.written == ["*CLS", "*ESE 1", "INIT:IMM;*OPC"]
+
+
+def test_send_cmd_and_wait_uses_service_request(make_driver):
+    driver, resource = make_driver({"*ESR?" : "+1"})
+    events = []
+    resource.enable_event = lambda *args: events.append("enable")
+    resource.discard_events = lambda *args: None
+    resource.wait_on_event = lambda event_type, timeout: events.append("wait")
+    resource.disable_event = lambda *args: events.append("disable")
+    resource.written.clear()
+    
+    driver.send_cmd_and_wait("INIT:IMM")
+    
+    assert events == ["enable", "wait", "disable"]
+    assert resource.written == ["*CLS", "*ESE 1", "*SRE 32", "INIT:IMM;*OPC", "*ESR?"]
+
+
+def test_async_io_keeps_order_per_resource_and_overlaps_instruments(make_driver):
+    driver_1, resource_1 = make_driver({"SLOW?" : "1"})
+    driver_2, resource_2 = make_driver({"SLOW?" : "2"})
+    for resource in [resource_1, resource_2]:
+        resource.written.clear()
+        query = resource.query
+        resource.query = lambda cmd, query=query: (time.sleep(0.1), query(cmd))[1]
+    
+    async def experiment():
+        return await asyncio.gather(
+            driver_1.async_write_check("SOUR1:POW1 -30"),
+            driver_1.async_query_check("SLOW?"),
+            driver_1.async_write_check("SOUR1:POW1 -33"),
+            driver_2.async_query_check("SLOW?"),
+        )
+    
+    tstart = time.perf_counter()
+    results = asyncio.run(experiment())
+    
+    assert time.perf_counter() - tstart < 0.19
+    assert results[1] == "1" and results[3] == "2"
+    assert resource_1.written == ["SOUR1:POW1 -30", "SLOW?", "SOUR1:POW1 -33"]
+
+
+def test_async_send_cmd_and_wait_polling(make_driver):
+    driver, resource = make_driver({"*ESR?" : "+1"})
+    driver.srq_supported = False
+    
+    t_elapsed = asyncio.run(driver.async_send_cmd_and_wait("INIT:IMM", expected_duration=0.02))
+    
+    assert t_elapsed >= 0.02
+    assert "INIT:IMM;*OPC" in resource.written
+
+
+def test_reconnect_backoff_and_replay(make_driver, monkeypatch):
+    driver, resource = make_driver({"SENS1:FREQ:STAR?" : "+6.0E+09"}, reconnect_delay=0.5, reconnect_max_delay=1.0)
+    sleeps = []
+    monkeypatch.setattr(time, "sleep", sleeps.append)
+    
+    failures = iter([pyvisa.VisaIOError(pyvisa.constants.StatusCode.error_connection_lost)] * 2)
+    def flaky_open():
+        error = next(failures, None)
+        if error is not None:
+            raise error
+        resource.closed = False
+    resource.open = flaky_open
+    resource.close()
+    
+    assert driver.query_check("SENS1:FREQ:STAR?", float) == 6e9
+    assert sleeps == [0.5, 1.0, 1.0]
+
+
+def test_reconnect_refuses_to_replay_triggers(make_driver):
+    driver, resource = make_driver(reconnect_delay=0)
+    resource.close()
+    
+    with pytest.raises(ConnectionError, match="INIT:IMM"):
+        driver.write_check("INIT:IMM")
+    assert resource.closed is False     # session is back for the next operation
+
+
+def test_reconnect_replays_only_settings(make_driver):
+    driver, resource = make_driver(reconnect_delay=0)
+    driver.write_setting("SOUR1:POW1 -30")
+    driver.write_setting("FORMat:DATA REAL,64")
+    # e.g. left over from before actions were kept out of the cache
+    driver.state_cache["MMEM1:STOR1"] = ('"STATE.STA"',)
+    driver.state_cache["CALC1:MEAS2:DEF1"] = ('"S21"',)
+    resource.close()
+    resource.written.clear()
+    
+    driver.query_check("*IDN?")
+    
+    assert ":SOUR1:POW1 -30" in resource.written
+    assert not any("MMEM" in cmd or "DEF" in cmd or "FORM" in cmd for cmd in resource.written)
+    assert driver.state_cache == {"SOUR1:POW1" : (-30.0,)}
+
+
+def test_reconnect_replays_the_commands_as_written(make_driver):
+    driver, resource = make_driver(reconnect_delay=0)
+    commands = ["SENSe1:SWEep:TYPE LINear", "OUTPut:STATe ON", "CALCulate1:PARameter:SELect 'CH1_S21'",
+                "SENSe1:FREQuency:CENTer 6000000123.456789HZ"]
+    for cmd in commands:
+        driver.write_setting(cmd)
+    resource.close()
+    resource.written.clear()
+    
+    driver.query_check("*IDN?")
+    
+    # no added node suffixes, upper case names or rounded numbers
+    replayed = [cmd for message in resource.written if message != "*IDN?" for cmd in message.split(";")]
+    assert replayed == [f":{cmd}" for cmd in commands]
+    assert driver.write_setting("OUTPut:STATe ON") is False
+
+
+def test_reconnect_without_reapply_forgets_the_state(make_driver):
+    driver, resource = make_driver(reconnect_delay=0, reapply_state=False)
+    driver.write_setting("SOUR1:POW1 -30")
+    resource.close()
+    driver.query_check("*IDN?")
+    
+    assert driver.state_cache == {}
+    assert driver.write_setting("SOUR1:POW1 -30") is True
+
+
+def test_reconnect_budget(make_driver):
+    driver, resource = make_driver(reconnect_delay=0, reconnect_budget=1)
+    resource.close()
+    driver.query_check("*IDN?")
+    resource.close()
+    
+    with pytest.raises(ConnectionError, match="budget"):
+        driver.query_check("*IDN?")
+
+
+def test_other_errors_are_not_retried(make_driver):
+    driver, resource = make_driver()
+    def timeout(cmd):
+        raise pyvisa.VisaIOError(pyvisa.constants.StatusCode.error_timeout)
+    resource.query = timeout
+    
+    with pytest.raises(pyvisa.VisaIOError):
+        driver.query_check("SENS1:SWE:TIME?")
+
+
+def test_snapshot_registry_and_fallback(make_driver):
+    from bcqthub.drivers.BaseDriver import BaseDriver
+    
+    class Parent(BaseDriver):
+        snapshot_parameters = {"power" : ("SOUR:POW?", float), "output" : ("OUTP?", bool)}
+    
+    class Child(Parent):
+        snapshot_parameters = {"points" : ("SWE:POIN?", int)}
+    
+    assert list(Child.snapshot_registry) == ["power", "output", "points"]
+    
+    driver, resource = make_driver({":SOUR:POW?;:OUTP?;:SWE:POIN?" : "-3.0E+01;1;+201"}, driver_class=Child)
+    assert driver.snapshot() == {"power" : -30.0, "output" : True, "points" : 201}
+    
+    # the names of the get_ methods return_instrument_parameters() used to call
+    assert driver.return_instrument_parameters() == [("get_power", -30.0), ("get_output", True), ("get_points", 201)]
+    
+    # the instrument did not understand the compound query -> one by one
+    driver, resource = make_driver({"SOUR:POW?" : "-30", "OUTP?" : "OFF"}, driver_class=Child)
+    assert driver.snapshot() == {"power" : -30.0, "output" : False, "points" : None}
+
+
+def test_instrument_parameters_without_snapshot_parameters(make_driver):
+    from bcqthub.drivers.BaseDriver import BaseDriver
+    
+    class Legacy(BaseDriver):
+        def get_power(self):
+            return self.query_check("SOUR:POW?", float)
+    
+    driver, resource = make_driver({"SOUR:POW?" : "-30"}, driver_class=Legacy)
+    assert driver.return_instrument_parameters() == [("get_power", -30.0)]
+
+
+def test_operation_timeout_and_temporary_visa_timeout(make_driver):
+    driver, resource = make_driver(timeout_factor=2, timeout_margin=1)
+    resource.timeout = 2000
+    
+    assert driver.operation_timeout(0) is None
+    assert driver.operation_timeout(100) == 201
+    
+    with driver.temporary_timeout(201):
+        assert resource.timeout == 201_000
+    assert resource.timeout == 2000
+    
+    with driver.temporary_timeout(1):   # never lowers the timeout
+        assert resource.timeout == 2000
+
+
+def test_async_polling_raises_the_visa_timeout(make_driver):
+    driver, resource = make_driver({"*ESR?" : "+1"}, timeout_factor=2, timeout_margin=5)
+    driver.srq_supported = False
+    resource.timeout = 2000
+    timeouts = {}
+    write = resource.write
+    def write_and_record(cmd):
+        timeouts[cmd] = resource.timeout
+        return write(cmd)
+    resource.write = write_and_record
+    
+    asyncio.run(driver.async_send_cmd_and_wait("INIT:IMM", expected_duration=0.01))
+    
+    assert timeouts["INIT:IMM;*OPC"] == timeouts["*ESR?"] == 5020
+    assert resource.timeout == 2000
@@ -0,0 +1,65 @@
+import json
+import numpy as np
+
+from conftest import ieee_block
+from bcqthub.drivers.IOTracer import IOTracer
+
+
+def test_tracing_disabled_by_default(make_driver):
+    driver, resource = make_driver({"SENS1:FREQ:STAR?" : "+1.0E+09"})
+    
+    assert driver.io_tracer is None
+    assert driver.query_check("SENS1:FREQ:STAR?", float) == 1e9
+
+
+def test_traced_calls_record_method_bytes_and_phase(make_driver):
+    values = np.linspace(0, 1, 101)
+    driver, resource = make_driver({"CALC1:DATA? FDATA" : ieee_block(values, "<f8"),
+                                    "CALC1:X?" : "+1.0E+00,-2.5E-01"})
+    tracer = driver.enable_io_tracing()
+    
+    with tracer.phase("setup"):
+        with driver.batch_writes():
+            driver.write_check("SENS1:AVER:COUN 10")
+            driver.write_check("SENS1:BAND 1000")
+    with tracer.phase("transfer"):
+        driver.query_check_binary("CALC1:DATA? FDATA")
+        np.testing.assert_allclose(driver.query_check_ascii("CALC1:X?"), [1.0, -0.25])
+    
+    records = tracer.to_dataframe()
+    assert list(records["method"]) == ["write_check", "query_check_binary", "query_check_ascii"]
+    assert list(records["phase"]) == ["setup", "transfer", "transfer"]
+    assert records["bytes_in"][1] == values.nbytes
+    assert (records["duration"] >= 0).all()
+    
+    totals = tracer.phase_totals()
+    assert totals.loc["transfer", "count"] == 2
+    
+    assert driver.disable_io_tracing() is tracer
+    driver.write_check("SENS1:BAND 100")
+    assert len(tracer.records) == 3
+
+
+def test_summary_percentiles_and_errors(make_driver):
+    tracer = IOTracer(maxlen=4)
+    for duration in [1.0, 2.0, 3.0, 4.0, 5.0]:
+        tracer.record("VNA", "query_check", f"SENS1:FREQ:STAR? {duration}", 0, duration)
+    tracer.record("VNA", "query_check", "SYST:ERR?", 0, 0.5, error="VisaIOError")
+    
+    summary = tracer.summary()
+    assert len(tracer.records) == 4     # ring buffer dropped the oldest records
+    star = summary[summary["command"] == "SENS1:FREQ:STAR?"].iloc[0]
+    assert star["count"] == 3 and star["p50_s"] == 4.0 and star["total_s"] == 12.0
+    assert summary["errors"].sum() == 1
+
+
+def test_export_csv_and_json(make_driver, tmp_path):
+    driver, resource = make_driver()
+    tracer = driver.enable_io_tracing()
+    driver.write_check("SENS1:BAND 1000")
+    
+    tracer.to_csv(tmp_path / "trace.csv")
+    tracer.to_json(tmp_path / "trace.json")
+    
+    assert "SENS1:BAND 1000" in (tmp_path / "trace.csv").read_text()
+    assert json.loads((tmp_path / "trace.json").read_text())[0]["method"] == "write_check"
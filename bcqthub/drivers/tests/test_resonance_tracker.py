@@ -0,0 +1,37 @@
+import numpy as np
+
+from bcqthub.drivers.ResonanceTracker import ResonanceTracker, estimate_resonance
+from bcqthub.drivers.SimulatedPNAX import dcm_resonator
+
+
+def test_estimate_with_mismatch_and_cable_background():
+    freqs = np.linspace(6e9 - 1e6, 6e9 + 1.5e6, 501)
+    background = 0.5 * np.exp(1j*(1 + 2*np.pi*freqs*5e-9))
+    s21 = background * dcm_resonator(freqs, 6.0002e9, 2e5, 5e4, phi=0.3)
+    
+    f_res, linewidth = estimate_resonance(freqs, s21)
+    expected_linewidth = 6.0002e9 * (1/2e5 + np.cos(0.3)/5e4)
+    assert abs(f_res - 6.0002e9) < 1e3
+    assert abs(linewidth - expected_linewidth) < 0.01 * expected_linewidth
+    
+    # just noise, and a resonance much narrower than the point spacing
+    rng = np.random.default_rng(0)
+    noise = 1e-3 * (rng.standard_normal(501) + 1j*rng.standard_normal(501))
+    assert estimate_resonance(freqs, 1 + noise) is None
+    assert estimate_resonance(freqs, dcm_resonator(freqs, 6e9 + 2e3, 1e8, 1e7))[1] is None
+
+
+def test_tracker_recenters_and_recovers():
+    tracker = ResonanceTracker(linewidths=10, points_per_linewidth=10)
+    freqs = np.linspace(5.99e9, 6.01e9, 2001)
+    
+    next_configs = tracker.update(freqs, dcm_resonator(freqs, 6.001e9, 2e5, 5e4))
+    assert abs(next_configs["f_center"] - 6.001e9) < 1e3
+    assert abs(next_configs["f_span"] - 1.5e6) < 5e4 and next_configs["n_points"] == 101
+    
+    # lost it: same center, 4x the span at the same resolution
+    freqs = np.linspace(6.0e9, 6.0015e9, 101)
+    lost_configs = tracker.update(freqs, np.ones(101))
+    assert tracker.history[-1] is None and tracker.f_res == next_configs["f_center"]
+    assert lost_configs["f_center"] == next_configs["f_center"]
+    assert lost_configs["f_span"] == 4*1.5e6 and lost_configs["n_points"] == 401
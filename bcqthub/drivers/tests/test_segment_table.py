@@ -0,0 +1,32 @@
+import pytest
+import numpy as np
+
+from bcqthub.drivers.SegmentTable import SegmentTable
+
+
+def test_strings_round_trip_and_frequency_axis():
+    segments = [",1,5,6.01e9,6.005e9", ",1,2,6.004e9,6.003e9", ",0,7,1e9,2e9", ",1,1,6.0e9,6.0e9"]
+    table = SegmentTable.from_strings(segments)
+    
+    assert len(table) == 4 and table.num_points == 8
+    assert SegmentTable.from_strings(list(table)).to_strings() == table.to_strings()
+    assert table.to_scpi().startswith("SSTOP, 4,1,5,6010000000.0,6005000000.0,")
+    
+    # same axis as one linspace per enabled segment
+    expected = np.hstack([np.linspace(6.01e9, 6.005e9, 5), np.linspace(6.004e9, 6.003e9, 2), [6.0e9]])
+    np.testing.assert_allclose(table.frequency_axis(), expected, rtol=0, atol=1e-3)
+    assert table.frequency_axis() is table.frequency_axis()
+
+
+def test_optional_columns():
+    table = SegmentTable.from_rows([(10, 5e9, 6e9, {"ifbw" : 1e3, "power" : -20}),
+                                    (30, 6e9, 7e9, {"ifbw" : 1e5, "power" : -10})], columns=("power", "ifbw"))
+    
+    assert table.columns == ("ifbw", "power")
+    assert table[1] == ",1,30,6000000000.0,7000000000.0,100000.0,-10.0"
+    assert table.sweep_time(if_bandwidth=1.0) == pytest.approx(10/1e3 + 30/1e5)
+    
+    with pytest.raises(ValueError):
+        SegmentTable.from_strings([",1,10,5e9,6e9"], columns=("ifbw",))
+    with pytest.raises(ValueError):
+        SegmentTable.concatenate([table, SegmentTable.from_rows([(1, 1e9, 1e9, {})])])
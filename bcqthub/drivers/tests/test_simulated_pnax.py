@@ -0,0 +1,423 @@
+import pytest
+import time
+from collections import deque
+import numpy as np
+
+from bcqthub.drivers.SimulatedPNAX import SimulatedPNAX, dcm_resonator
+from bcqthub.drivers.instruments.VNA_Keysight import VNA_Keysight
+from bcqthub.drivers.instruments.SG_Anritsu import SG_Anritsu
+from bcqthub.drivers.StreamingAverage import target_snr
+
+
+@pytest.fixture
+def sim_vna():
+    def _make(sweep_time_scale=0, **sim_kwargs):
+        sim = SimulatedPNAX(resonators=[{"fc" : 6e9, "Qi" : 2e5, "Qc" : 5e4}], 
+                            sweep_time_scale=sweep_time_scale, seed=0, **sim_kwargs)
+        configs = {"instrument_name" : "VNA", "instr_resource" : sim, "sparam" : ["S21"], 
+                   "f_center" : 6e9, "f_span" : 1e6, "n_points" : 401, "power" : -30, 
+                   "averages" : 4, "if_bandwidth" : 10000, "edelay" : 0, "segments" : None}
+        vna = VNA_Keysight(configs)
+        vna.init_configs()
+        vna.setup_s2p_measurement()
+        return vna, sim
+    return _make
+
+
+def test_vna_driver_runs_against_simulator(sim_vna):
+    vna, sim = sim_vna(noise=0)
+    vna.run_measurement(verbose=False)
+    
+    df_ascii = vna.return_data_s2p()
+    df_binary = vna.return_data_s2p(use_binary=True, single_transfer=True)
+    
+    assert vna.check_instr_error_queue() == ("+0", '"No error"')
+    freqs = np.linspace(6e9 - 0.5e6, 6e9 + 0.5e6, 401)
+    expected = 20*np.log10(np.abs(dcm_resonator(freqs, 6e9, 2e5, 5e4)))
+    np.testing.assert_allclose(df_ascii["S21 magn_dB"], expected, atol=1e-6)
+    np.testing.assert_allclose(df_binary["S21 magn_dB"], expected, atol=1e-6)
+    np.testing.assert_allclose(df_ascii["S21 phase_rad"], df_binary["S21 phase_rad"], atol=1e-6)
+
+
+def test_simulator_parses_headers_like_the_instrument(sim_vna):
+    vna, sim = sim_vna()
+    sim.write("sense1:frequency:start 5.9GHZ")
+    assert sim.query("SENS:FREQ:STAR?") == sim.query(":SENSe1:FREQuency:STARt?") == "+5.9000000000E+09"
+    assert sim.error_queue == deque()
+    
+    sim.write("OUTP1:STAT1 OFF")        # OUTPut and STATe take no suffix
+    sim.write("SENS:FREQ:STA 6GHZ")      # neither the short nor the long form
+    assert list(sim.error_queue) == ['-114,"Header suffix out of range; OUTP1"', '-113,"Undefined header; STA"']
+    assert sim.query("SENS:FREQ:STAR?") == "+5.9000000000E+09"
+
+
+def test_reconnect_replays_commands_the_instrument_accepts(sim_vna):
+    vna, sim = sim_vna()
+    vna.configs["reconnect_delay"] = 0
+    vna.write_setting("OUTPut:STATe ON")
+    sim.written.clear()
+    sim.close()
+    
+    vna.query_check("*IDN?")
+    
+    assert any(":SENSe1:SWEep:TYPE LINear;" in message for message in sim.written)
+    assert vna.check_instr_error_queue() == ("+0", '"No error"')
+
+
+def test_averaging_bit_and_opc_follow_sweep_time(sim_vna):
+    vna, sim = sim_vna(sweep_time_scale=1.0)
+    expected_duration = vna.get_sweep_time() * 4
+    
+    t_elapsed = vna.run_measurement(verbose=False)
+    assert expected_duration <= t_elapsed < expected_duration + 0.1
+    
+    t_elapsed = vna.run_measurement(verbose=False, event_driven=True)
+    assert expected_duration <= t_elapsed < expected_duration + 0.1
+
+
+def test_segment_table_sets_frequency_axis(sim_vna):
+    vna, sim = sim_vna()
+    vna.configs["segment_type"] = "hybrid"
+    vna.configs["Noffres"] = 5
+    vna.compute_homophasal_segments()
+    vna.setup_s2p_measurement()
+    
+    freqs = sim.frequency_axis()
+    df = vna.return_data_s2p(use_binary=True)
+    
+    assert len(sim.segments) == len(vna.configs["segments"])
+    assert freqs.size == len(df) == sum(int(seg["points"]) for seg in sim.segments)
+    np.testing.assert_allclose(df["Frequency"], freqs)
+
+
+def test_noise_averages_down_and_latency(sim_vna):
+    vna, sim = sim_vna(noise=1e-2, latency=0.01)
+    sim.resonators = []
+    
+    vna.configs["averages"] = 1
+    vna.run_measurement(verbose=False)
+    single = vna.return_complex_data()["S21"]
+    vna.write_check("SENSe1:AVERage:Count 100")
+    vna.configs["averages"] = 100
+    vna.run_measurement(verbose=False)
+    averaged = vna.return_complex_data()["S21"]
+    
+    assert np.std(averaged) < np.std(single) / 5
+    
+    tstart = time.perf_counter()
+    vna.query_check("*IDN?")
+    assert time.perf_counter() - tstart >= 0.01
+
+
+def test_snapshot_is_one_round_trip(sim_vna):
+    vna, sim = sim_vna()
+    vna.configs["snapshot_with_data"] = True
+    tracer = vna.enable_io_tracing()
+    
+    snapshot = vna.snapshot()
+    
+    assert len(tracer.records) == 1
+    assert snapshot["n_points"] == 401 and snapshot["averages"] == 4
+    assert snapshot["f_start"] == pytest.approx(6e9 - 0.5e6)
+    assert snapshot["averaging"] is True and snapshot["power"] == -30
+    assert vna.return_instrument_parameters() == [(f"get_{name}", value) for name, value in snapshot.items()]
+    assert vna.return_data_s2p().attrs["instrument_snapshot"]["if_bandwidth"] == 10000
+
+
+def test_pipelined_measurement_overlaps_transfer_with_sweeps(sim_vna):
+    vna, sim = sim_vna(sweep_time_scale=1.0, noise=0)
+    sim.resonators = [{"fc" : 6e9, "Qi" : 2e5, "Qc" : 5e4, "kerr" : 1e12}]
+    vna.configs["averages"] = 2
+    powers = [-40, -30, -20, -10, -5]
+    
+    def consumer(idx, settings, freqs, cmplx_dict):
+        return idx, freqs, cmplx_dict["S21"]
+    
+    sim.transfers.clear()
+    results = vna.run_pipelined_measurement([{"power" : p} for p in powers], consumer, verbose=False)
+    
+    # every trace is the one measured at its own power
+    for (idx, freqs, s21), power in zip(results, powers):
+        np.testing.assert_allclose(s21, sim.s21_model(freqs, power=power), atol=1e-9)
+    assert [r[0] for r in results] == list(range(len(powers)))
+    
+    # the simulator saw every transfer but the last one while the next sweep was running
+    assert [data_type for data_type, busy in sim.transfers] == ["SMEM"] * len(powers)
+    assert [busy for data_type, busy in sim.transfers] == [True] * (len(powers) - 1) + [False]
+    assert vna.query_check("FORMat?").startswith("ASC")
+
+
+def test_pipelined_measurement_drains_before_new_measurements(sim_vna):
+    vna, sim = sim_vna(noise=0)
+    sweep_settings = [{"power" : -30}, {"power" : -20, "sparam" : ["S21", "S11"]}, {"power" : -10}]
+    
+    results = vna.run_pipelined_measurement(sweep_settings, lambda idx, settings, freqs, traces : (freqs, traces),
+                                            verbose=False)
+    
+    # the first sweep was downloaded before its S21 memory trace was deleted
+    assert [list(traces) for freqs, traces in results] == [["S21"], ["S21", "S11"], ["S21", "S11"]]
+    for (freqs, traces), settings in zip(results, sweep_settings):
+        np.testing.assert_allclose(traces["S21"], sim.s21_model(freqs, power=settings["power"]), atol=1e-9)
+
+
+def test_pipelined_measurement_drains_before_the_stimulus_changes(sim_vna):
+    vna, sim = sim_vna(noise=0)
+    sweep_settings = [{"power" : -30}, {"power" : -20}, {"n_points" : 201}, {"f_span" : 2e6}, {"power" : -10}]
+    sim.transfers.clear()
+    
+    results = vna.run_pipelined_measurement(sweep_settings, lambda idx, settings, freqs, traces : (freqs, traces["S21"]),
+                                            verbose=False)
+    
+    assert [freqs.size for freqs, s21 in results] == [401, 401, 201, 201, 201]
+    for (freqs, s21), power in zip(results, [-30, -20, -20, -20, -10]):
+        np.testing.assert_allclose(s21, sim.s21_model(freqs, power=power), atol=1e-9)
+    assert vna.check_instr_error_queue() == ("+0", '"No error"')
+
+
+def test_memory_trace_does_not_survive_a_stimulus_change(sim_vna):
+    vna, sim = sim_vna(noise=0)
+    vna.run_measurement(verbose=False)
+    vna.memorize_traces()
+    assert np.all(np.isfinite(vna.query_complex_traces("SMEM")["S21"]))
+    
+    vna.update_configs(n_points=201)
+    vna.setup_s2p_measurement()
+    
+    assert np.all(np.isnan(vna.query_complex_traces("SMEM")["S21"]))
+    assert vna.check_instr_error_queue()[0] == "-221"
+
+
+def test_multi_resonator_segment_table_splits_per_resonator(sim_vna):
+    vna, sim = sim_vna(noise=0)
+    f_centers = [5.2e9, 6e9, 7.1e9]
+    sim.resonators = [{"fc" : fc, "Qi" : 2e5, "Qc" : 5e4} for fc in f_centers]
+    vna.configs["n_points"] = 60
+    
+    vna.compute_multi_resonator_segments([(fc, 1e6) for fc in f_centers], segment_type="hybrid", fill_points=3)
+    vna.setup_s2p_measurement()
+    vna.run_measurement(verbose=False)
+    all_dfs = vna.return_data_s2p(single_transfer=True, split_resonators=True)
+    
+    # swept from the highest resonator down, named in the order they were given
+    assert list(all_dfs) == ["res2", "res1", "res0"]
+    assert sum(len(df) for df in all_dfs.values()) == sim.frequency_axis().size - 2*3
+    # swept downwards without measuring the edge of a fill segment twice
+    assert np.all(np.diff(sim.frequency_axis()) < 0)
+    
+    for fc, df in zip(f_centers, [all_dfs["res0"], all_dfs["res1"], all_dfs["res2"]]):
+        assert np.all(np.abs(df["Frequency"] - fc) <= 0.55e6)
+        f_min = df["Frequency"][df["S21 magn_dB"].idxmin()]
+        assert abs(f_min - fc) < 2e3
+    
+    # the same split without DataFrames, every resonator is a view into one transfer
+    all_traces = vna.return_data_s2p(single_transfer=True, split_resonators=True, as_dataframe=False)
+    for name, df in all_dfs.items():
+        np.testing.assert_allclose(all_traces[name].magn_dB("S21"), df["S21 magn_dB"])
+
+
+def test_segments_carry_their_own_ifbw_and_power(sim_vna):
+    vna, sim = sim_vna(sweep_time_scale=1.0)
+    vna.configs.update({"segment_type" : "hybrid", "Noffres" : 20, "n_points" : 60})
+    vna.compute_homophasal_segments()
+    vna.setup_s2p_measurement()
+    t_uniform = vna.get_sweep_time()
+    
+    vna.configs.update({"segment_ifbw" : 1e3, "offres_ifbw" : 1e5, "offres_power" : -10})
+    vna.compute_homophasal_segments()
+    vna.setup_s2p_measurement()
+    
+    assert vna.check_instr_error_queue() == ("+0", '"No error"')
+    core, offres = sim.segments[1], sim.segments[0]
+    assert (core["ifbw"], core["power"]) == (1e3, -30)
+    assert (offres["ifbw"], offres["power"]) == (1e5, -10)
+    
+    # the narrow IFBW is only paid for near resonance
+    assert vna.get_sweep_time() < t_uniform * 10
+    vna.query_check = lambda cmd, fmt=str: "bogus"
+    t_points = sum(seg["points"] / seg["ifbw"] for seg in sim.segments)
+    assert vna.estimate_measurement_duration(1) == pytest.approx(t_points + len(sim.segments) * 1e-3)
+
+
+def test_streaming_average_stops_at_target_snr(sim_vna):
+    vna, sim = sim_vna(noise=5e-2)
+    
+    freqs, averager = vna.run_streaming_average(target_snr(80, quantile=0.5), max_sweeps=500, verbose=False)
+    
+    assert 10 < averager.count < 100
+    assert np.median(averager.snr()) >= 80
+    assert averager.mean.shape == (1, freqs.size)
+    assert sim.settings["SENS1:AVER1:STAT1"] == "OFF"
+    np.testing.assert_allclose(averager.mean[0], sim.s21_model(freqs), atol=6*averager.std_error.max())
+    
+    # without a reachable target it stops at max_sweeps
+    freqs, averager = vna.run_streaming_average(target_snr(1e9), max_sweeps=7, verbose=False)
+    assert averager.count == 7
+
+
+def test_named_configurations_switch_with_one_load(sim_vna, monkeypatch):
+    vna, sim = sim_vna()
+    wide_hash = vna.register_configuration("wide", f_center=6e9, f_span=200e6, n_points=2001)
+    vna.configs.update({"segment_type" : "hybrid", "f_span" : 1e6, "n_points" : 60})
+    vna.compute_homophasal_segments()
+    narrow_hash = vna.register_configuration("narrow")
+    assert wide_hash != narrow_hash
+    
+    num_written = len(sim.written)
+    assert vna.recall_configuration("wide") is True
+    assert len(sim.written) - num_written <= 4       # MMEM:CAT?, *CLS, MMEM:LOAD and SYST:ERR?
+    assert sim.frequency_axis().size == 2001 and vna.configs["segments"] is None
+    
+    # the restored state cache knows the VNA already has these settings
+    vna.setup_s2p_measurement()
+    assert not any("SENS" in cmd for cmd in list(sim.written)[num_written + 4:])
+    
+    # an old error in the queue is not mistaken for a failed load
+    sim.error_queue.append('-113,"Undefined header"')
+    assert vna.recall_configuration("narrow") is True
+    np.testing.assert_allclose(vna.return_data_s2p(single_transfer=True)["Frequency"], sim.frequency_axis())
+    
+    # state file gone (e.g. another user cleaned up) -> full setup, and saved again
+    sim.files.clear()
+    assert vna.recall_configuration("wide") is False
+    assert sim.frequency_axis().size == 2001 and len(sim.files) == 1
+    assert vna.check_instr_error_queue() == ("+0", '"No error"')
+    
+    # a malformed error queue reply counts as a failed load instead of raising
+    monkeypatch.setattr(vna, "check_instr_error_queue", lambda print_output=False : '-256,"File not found; a,b"')
+    assert vna.recall_configuration("wide") is False
+
+
+def test_punchout_from_power_sweeps(sim_vna):
+    vna, sim = sim_vna(noise=1e-4)
+    sim.resonators = [{"fc" : 6e9, "Qi" : 1e6, "Qc" : 1e6, "kerr" : 1e5}]     # shifts 100 kHz at 0 dBm
+    vna.configs["averages"] = 1
+    coarse = np.linspace(6e9 - 500e3, 6e9 + 500e3, 51)
+    
+    freqs, powers, s21 = vna.run_punchout(coarse, -60, 0, 13, refine_points=101, verbose=False)
+    
+    assert s21.shape == (freqs.size, 13) and np.all(np.diff(freqs) > 0)
+    assert 51 < freqs.size <= 51 + 101
+    np.testing.assert_allclose(s21, sim.s21_model(freqs[:, None], power=powers[None, :]), atol=1e-3)
+    
+    # every power sweep is downloaded before the CW frequency of the next one is set
+    events = ["transfer" if "MFD?" in cmd else "stimulus" for message in sim.written for cmd in message.split(";")
+              if "MFD?" in cmd or "FREQuency:CW" in cmd]
+    assert events == ["stimulus", "transfer"] * freqs.size
+    
+    f_res = freqs[np.argmin(np.abs(s21), axis=0)]
+    assert abs(f_res[0] - 6e9) < 3e3 and abs(f_res[-1] - (6e9 - 100e3)) < 3e3
+    
+    # back to a frequency sweep
+    vna.setup_s2p_measurement()
+    assert sim.frequency_axis().size == vna.configs["n_points"]
+
+
+def test_triggered_spectroscopy_downloads_once(sim_vna, make_driver):
+    vna, sim = sim_vna(noise=1e-4)
+    sg, sg_resource = make_driver(driver_class=SG_Anritsu, instrument_name="SG")
+    drive_freqs = np.linspace(4.0e9, 4.1e9, 100)
+    
+    data = vna.run_triggered_spectroscopy(sg, drive_freqs, 6e9 + 20e3, points_per_step=3, verbose=False)
+    
+    assert vna.check_instr_error_queue() == ("+0", '"No error"')
+    assert sim.frequency_axis().size == 300
+    np.testing.assert_array_equal(data.freqs, drive_freqs)
+    np.testing.assert_allclose(data["S21"], sim.s21_model(np.full(100, 6e9 + 20e3)), atol=1e-3)
+    
+    # the list is loaded in one write, and the generator is back in CW mode afterwards
+    list_write = next(cmd for cmd in sg_resource.written if "SOUR:LIST:FREQ" in cmd)
+    assert list_write.count(",") == 299 and any("SOUR:LIST:STOP 299" in cmd for cmd in sg_resource.written)
+    assert "SOUR:FREQ:MODE CW" in sg_resource.written[-1]
+    
+    # the VNA is back to analog sweeps without dwell or AUX trigger, and the cache doesn't claim otherwise
+    assert sim.settings["SENS1:SWE1:GEN1"].startswith("ANAL") and sim.settings["SENS1:SWE1:DWEL1"] == 0
+    assert sim.settings["TRIG1:CHAN1:AUX1"] == "OFF"
+    assert not any(h.startswith(("SENS1:SWE1:GEN1", "SENS1:SWE1:DWEL1", "TRIG1:CHAN1:AUX1")) for h in vna.state_cache)
+    vna.run_triggered_spectroscopy(sg, drive_freqs, 6e9 + 20e3, verbose=False)
+    assert sim.settings["SENS1:SWE1:GEN1"].startswith("ANAL") and sim.settings["TRIG1:CHAN1:AUX1"] == "OFF"
+
+
+def test_tracked_measurements_follow_the_resonance(sim_vna):
+    vna, sim = sim_vna(noise=1e-3)
+    sim.resonators = [{"fc" : 6e9, "Qi" : 2e5, "Qc" : 5e4, "kerr" : 2e6}]     # shifts 2 MHz at 0 dBm
+    vna.update_configs(f_center=6.0005e9, f_span=4e6, n_points=401, averages=1)
+    powers = [-30, -20, -10, -7, -5, -3]
+    
+    all_data = vna.run_tracked_measurements([{"power" : p} for p in powers], verbose=False)
+    
+    linewidth = 6e9 / 4e4
+    for data, power in zip(all_data, powers):
+        f_res, width = data.metadata["resonance"]
+        assert abs(f_res - (6e9 - 2e6 * 10**(power/10))) < 0.02*linewidth
+        assert abs(width - linewidth) < 0.05*linewidth
+    
+    # the resonance stays in the middle of a span of 10 linewidths
+    assert all(data.freqs.size == 101 for data in all_data[1:])
+    assert abs(np.ptp(all_data[-1].freqs) - 10*linewidth) < linewidth
+
+
+def test_wideband_sweep_stitches_chunks(sim_vna, tmp_path):
+    vna, sim = sim_vna(noise=1e-4)
+    vna.configs["averages"] = 1
+    freqs = np.linspace(6e9 - 10e6, 6e9 + 10e6, 2001)
+    expected = sim.s21_model(freqs)
+    
+    # the cable background jumps after the first chunk, stitching takes it out again
+    arrived = []
+    def consumer(idx, chunk_data):
+        arrived.append(chunk_data.metadata["chunk"])
+        sim.background = (0.8, 0.5, 0.0)
+    
+    out_path = tmp_path / "survey.npy"
+    data = vna.run_wideband_sweep(freqs[0], freqs[-1], freqs.size, consumer, max_points=401, overlap=10,
+                                  out=out_path, verbose=False)
+    
+    assert arrived == [(0, 401), (391, 792), (782, 1183), (1173, 1574), (1564, 1965), (1955, 2001)]
+    # every chunk is downloaded before the stimulus is changed for the next one
+    events = ["transfer" if "MFD?" in cmd else "stimulus" for message in sim.written for cmd in message.split(";")
+              if "MFD?" in cmd or "FREQuency:STARt" in cmd]
+    assert events == ["stimulus", "transfer"] * 6
+    np.testing.assert_allclose(data.freqs, freqs)
+    np.testing.assert_allclose(data["S21"], expected, atol=1e-3)
+    np.testing.assert_array_equal(np.load(out_path)[0], data["S21"])
+    
+    # without stitching the jump stays in
+    sim.background = (1.0, 0.0, 0.0)
+    raw = vna.run_wideband_sweep(freqs[0], freqs[-1], freqs.size, consumer, max_points=401, stitch=False, verbose=False)
+    assert np.max(np.abs(raw["S21"][401:] - expected[401:])) > 0.1
+
+
+def test_measurement_durations_calibrate_the_predictor(sim_vna, tmp_path):
+    vna, sim = sim_vna(sweep_time_scale=1.0)
+    vna.configs.update(if_bandwidth=1e5, n_points=2001)
+    vna.setup_s2p_measurement()
+    
+    for averages in [1, 4, 8, 2]:
+        vna.configs["averages"] = averages
+        vna.setup_s2p_measurement()
+        vna.run_measurement(verbose=False)
+    assert len(vna.sweep_time_predictor.samples["LIN/polled"]) == 4
+    
+    vna.configs["averages"] = 12
+    predicted = vna.predict_measurement_duration()
+    vna.setup_s2p_measurement()
+    t_elapsed = vna.run_measurement(verbose=False)
+    assert abs(predicted - t_elapsed) < 0.25*t_elapsed
+    
+    # the untouched defaults would have been off by a lot more
+    assert abs(vna.predict_measurement_duration(event_driven=True) - t_elapsed) > 0.25*t_elapsed
+
+
+def test_frequency_sweep_after_wideband_sweep(sim_vna):
+    vna, sim = sim_vna(noise=0)
+    vna.configs["averages"] = 1
+    vna.run_wideband_sweep(5.9e9, 6.1e9, 1001, max_points=401, verbose=False)
+    
+    # same f_center/f_span as before the wideband sweep, has to be sent again
+    vna.setup_s2p_measurement()
+    vna.run_measurement(verbose=False)
+    
+    freqs = np.linspace(6e9 - 0.5e6, 6e9 + 0.5e6, 401)
+    np.testing.assert_allclose(sim.frequency_axis(), freqs)
+    np.testing.assert_allclose(vna.get_frequency_axis(), freqs)
+    np.testing.assert_allclose(vna.return_data_s2p(single_transfer=True, as_dataframe=False)["S21"], sim.s21_model(freqs))
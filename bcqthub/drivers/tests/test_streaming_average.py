@@ -0,0 +1,36 @@
+import pytest
+import numpy as np
+
+from bcqthub.drivers.StreamingAverage import StreamingAverage, target_snr, target_uncertainty
+
+
+def test_welford_matches_batch_statistics():
+    rng = np.random.default_rng(1)
+    traces = 1e6 + rng.standard_normal((50, 3, 20)) + 1j*rng.standard_normal((50, 3, 20))
+    
+    averager = StreamingAverage()
+    for trace in traces:
+        averager.update(trace)
+    
+    expected_var = np.var(traces.real, axis=0, ddof=1) + np.var(traces.imag, axis=0, ddof=1)
+    np.testing.assert_allclose(averager.mean, traces.mean(axis=0))
+    np.testing.assert_allclose(averager.variance, expected_var, rtol=1e-6)
+    np.testing.assert_allclose(averager.std_error, np.sqrt(expected_var / 50), rtol=1e-6)
+    
+    with pytest.raises(ValueError):
+        averager.update(np.zeros(5))
+
+
+def test_stop_conditions():
+    averager = StreamingAverage()
+    averager.update(np.ones(4))
+    assert target_snr(10)(averager) is False and np.all(np.isinf(averager.variance))
+    
+    averager.update(np.full(4, 1.1))
+    averager.update(np.full(4, 0.9))
+    assert target_snr(10)(averager) is True           # snr = 1 / (0.1 / sqrt(3)) ~ 17
+    assert target_snr(20)(averager) is False
+    
+    mean_and_error = lambda avg: (avg.mean.mean().real, avg.std_error.max())
+    assert target_uncertainty(mean_and_error, rel_tol=0.1)(averager) is True
+    assert target_uncertainty(mean_and_error, rel_tol=0.01)(averager) is False
@@ -0,0 +1,60 @@
+import numpy as np
+
+from bcqthub.drivers.SegmentTable import SegmentTable
+from bcqthub.drivers.SweepTimePredictor import SweepTimePredictor
+
+
+def test_calibrates_from_recorded_durations():
+    predictor = SweepTimePredictor()
+    true_coefficients = np.array([1.2, 2e-5, 3e-3, 0.02, 1.5])
+    
+    rng = np.random.default_rng(0)
+    for _ in range(30):
+        settings = {"n_points" : int(rng.integers(101, 20001)), "if_bandwidth" : float(rng.choice([1e2, 1e3, 1e4])),
+                    "averages" : int(rng.integers(1, 1000))}
+        predictor.record(predictor.features(**settings) @ true_coefficients, **settings)
+    
+    settings = {"n_points" : 5001, "if_bandwidth" : 1e3, "averages" : 2000}
+    expected = predictor.features(**settings) @ true_coefficients
+    assert abs(predictor.predict(**settings) - expected) < 0.01*expected
+    
+    # other sweep types and wait modes keep their own coefficients, starting from the defaults
+    assert predictor.predict("SEGM", **settings) == SweepTimePredictor().predict(**settings)
+    assert predictor.predict("LINear", "event_driven", **settings) == SweepTimePredictor().predict(**settings)
+    
+    # segments replace n_points/if_bandwidth
+    table = SegmentTable.from_rows([(100, 6e9, 6.1e9, {"ifbw" : 1e2}), (300, 6.1e9, 6.2e9, {"ifbw" : 1e4})], ("ifbw",))
+    features = predictor.features(n_points=1, if_bandwidth=1e3, averages=2, segments=table)
+    np.testing.assert_allclose(features, [2*(100/1e2 + 300/1e4), 2*400, 2*2, 2, 1])
+
+
+def test_sweep_types_are_calibrated_independently(tmp_path):
+    predictor = SweepTimePredictor(tmp_path / "PNA_X_timing.json")
+    true_coefficients = {"LIN" : np.array([1.0, 1e-5, 0, 0.01, 0.5]), "CW" : np.array([1.3, 0, 0, 0.02, 1.0])}
+    
+    rng = np.random.default_rng(1)
+    for _ in range(20):
+        for sweep_type, coefficients in true_coefficients.items():
+            settings = {"n_points" : int(rng.integers(101, 20001)), "if_bandwidth" : float(rng.choice([1e2, 1e3, 1e4])),
+                        "averages" : int(rng.integers(1, 100))}
+            predictor.record(predictor.features(**settings) @ coefficients, sweep_type, "polled", **settings)
+    
+    reloaded = SweepTimePredictor(tmp_path / "PNA_X_timing.json")
+    assert set(reloaded.samples) == {"LIN/polled", "CW/polled"}
+    
+    settings = {"n_points" : 2001, "if_bandwidth" : 1e3, "averages" : 50}
+    for sweep_type, coefficients in true_coefficients.items():
+        expected = predictor.features(**settings) @ coefficients
+        assert abs(reloaded.predict(sweep_type, "polled", **settings) - expected) < 0.01*expected
+    assert reloaded.predict("CW", "polled", **settings) > 1.2*reloaded.predict("LIN", "polled", **settings)
+
+
+def test_durations_are_stored_per_instrument(tmp_path):
+    filepath = tmp_path / "PNA_X_timing.json"
+    predictor = SweepTimePredictor(filepath)
+    for averages in [1, 10, 100]:
+        predictor.record(0.5 + averages*2.0, n_points=1001, if_bandwidth=1e3, averages=averages)
+    
+    reloaded = SweepTimePredictor(filepath)
+    assert reloaded.predict(n_points=1001, if_bandwidth=1e3, averages=50) == predictor.predict(n_points=1001, if_bandwidth=1e3, averages=50)
+    assert abs(reloaded.predict(n_points=1001, if_bandwidth=1e3, averages=50) - 100.5) < 2
@@ -0,0 +1,43 @@
+import pytest
+import numpy as np
+
+from bcqthub.drivers.TraceData import TraceData
+
+
+def test_trace_data_to_dataframe():
+    freqs = np.linspace(5e9, 5.1e9, 11)
+    s21 = np.exp(1j*np.linspace(0, 6, 11)) * 0.5
+    data = TraceData(freqs, {"S21" : s21}, {"power" : -30})
+    
+    with pytest.raises(AttributeError):
+        data.extra = 1
+    
+    df = data.to_dataframe()
+    assert list(df.columns) == ["Frequency", "S21 magn_dB", "S21 phase_rad"]
+    np.testing.assert_allclose(df["S21 magn_dB"], 20*np.log10(0.5))
+    np.testing.assert_allclose(df["S21 phase_rad"], np.linspace(0, 6, 11))
+    assert df.attrs == {"power" : -30}
+    assert np.shares_memory(df["Frequency"].to_numpy(), data.freqs)
+    
+    df = data.to_dataframe(archive_complex=True)
+    assert np.shares_memory(df["S21 complex"].to_numpy(), s21)
+    assert np.shares_memory(df["Frequency"].to_numpy(), data.freqs)
+    assert df["Frequency"].dtype == np.float64
+
+
+def test_trace_data_select_is_a_view():
+    data = TraceData(np.arange(10.0), {"S21" : np.arange(10) + 0j})
+    part = data.select(slice(2, 5))
+    
+    assert len(part) == 3 and part.sparams == ["S21"]
+    assert np.shares_memory(part["S21"], data["S21"])
+    np.testing.assert_array_equal(part.freqs, [2, 3, 4])
+
+
+def test_trace_data_prefers_the_formatted_traces():
+    phase_rad = np.linspace(10, 12, 10)
+    data = TraceData(np.arange(10.0), {"S21" : np.exp(1j*phase_rad)}, formatted={"S21" : (np.zeros(10), phase_rad)})
+    
+    np.testing.assert_array_equal(data.phase_rad("S21"), phase_rad)
+    np.testing.assert_array_equal(data.select(slice(2, 5)).phase_rad("S21"), phase_rad[2:5])
+    assert np.all(np.abs(TraceData(data.freqs, data.traces).phase_rad("S21") - phase_rad) > 6)
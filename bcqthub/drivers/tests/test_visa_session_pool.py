@@ -0,0 +1,120 @@
+import asyncio, threading, time
+import pytest
+import pyvisa
+
+import bcqthub.drivers.BaseDriver as BaseDriver_module
+from bcqthub.drivers.BaseDriver import BaseDriver
+from bcqthub.drivers.VisaSessionPool import VisaSessionPool
+from conftest import FakeRM
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    pool = VisaSessionPool()
+    monkeypatch.setattr(pyvisa, "ResourceManager", FakeRM)
+    monkeypatch.setattr(BaseDriver_module, "visa_pool", pool)
+    return pool
+
+
+def make_config(address):
+    return {"instrument_name" : "test", "instr_address" : address}
+
+
+def test_drivers_share_manager_and_session(pool):
+    vna_1 = BaseDriver(make_config("TCPIP0::192.168.0.105::inst0::INSTR"))
+    vna_2 = BaseDriver(make_config("TCPIP0::192.168.0.105::inst0::INSTR"))
+    sg = BaseDriver(make_config("GPIB::7::INSTR"))
+    
+    assert vna_1.rm is vna_2.rm is sg.rm
+    assert vna_1.resource is vna_2.resource
+    assert vna_1.rm.opened == ["TCPIP0::192.168.0.105::inst0::INSTR", "GPIB::7::INSTR"]
+    assert pool.refcount("TCPIP0::192.168.0.105::inst0::INSTR") == 2
+
+
+def test_sessions_closed_after_last_release(pool):
+    vna_1 = BaseDriver(make_config("TCPIP0::192.168.0.105::inst0::INSTR"))
+    vna_2 = BaseDriver(make_config("TCPIP0::192.168.0.105::inst0::INSTR"))
+    resource, rm = vna_1.resource, vna_1.rm
+    
+    vna_1.close()
+    assert resource.closed is False
+    
+    vna_2.close()
+    assert resource.closed is True and rm.closed is True
+    assert pool.sessions == {} and pool.resource_managers == {}
+
+
+def test_dead_session_is_reopened(pool):
+    vna_1 = BaseDriver(make_config("TCPIP0::192.168.0.105::inst0::INSTR"))
+    vna_1.resource.close()
+    
+    vna_2 = BaseDriver(make_config("TCPIP0::192.168.0.105::inst0::INSTR"))
+    
+    assert vna_2.resource is not vna_1.resource
+    assert vna_2.resource.closed is False
+    
+    # releasing the dead session must not take a reference from the new one
+    vna_1.close()
+    assert pool.refcount("TCPIP0::192.168.0.105::inst0::INSTR") == 1
+
+
+def test_lost_session_reconnects_and_reapplies_state(pool):
+    config = {**make_config("TCPIP0::192.168.0.105::inst0::INSTR"), "reconnect_delay" : 0}
+    vna_1 = BaseDriver(config)
+    vna_2 = BaseDriver(dict(config))
+    vna_1.write_check("SOUR1:POW1 -30")
+    dead_resource = vna_1.resource
+    dead_resource.close()
+    
+    assert vna_1.query_check("*IDN?").startswith("Keysight")
+    
+    new_resource = vna_1.resource
+    assert new_resource is not dead_resource
+    assert new_resource.written == ["*IDN?", ":SOUR1:POW1 -30", "*IDN?"]
+    assert vna_1.state_cache["SOUR1:POW1"] == (-30.0,)
+    
+    # the second driver on the same dead session joins the fresh one
+    vna_2.query_check("*IDN?")
+    assert vna_2.resource is new_resource
+    assert pool.refcount("TCPIP0::192.168.0.105::inst0::INSTR") == 2
+
+
+def test_drivers_on_one_session_share_the_io_thread(pool):
+    vna_1 = BaseDriver(make_config("TCPIP0::192.168.0.105::inst0::INSTR"))
+    vna_2 = BaseDriver(make_config("TCPIP0::192.168.0.105::inst0::INSTR"))
+    sg = BaseDriver(make_config("GPIB::7::INSTR"))
+    
+    # count how many calls are on each session at the same time
+    on_the_bus, most_on_the_bus, lock = {}, {}, threading.Lock()
+    for resource in [vna_1.resource, sg.resource]:
+        resource.responses["SLOW?"] = "1"
+        def slow_query(cmd, resource=resource, query=resource.query):
+            with lock:
+                on_the_bus[id(resource)] = on_the_bus.get(id(resource), 0) + 1
+                most_on_the_bus[id(resource)] = max(most_on_the_bus.get(id(resource), 0), on_the_bus[id(resource)])
+            time.sleep(0.1)
+            with lock:
+                on_the_bus[id(resource)] -= 1
+            return query(cmd)
+        resource.query = slow_query
+    
+    async def experiment():
+        return await asyncio.gather(
+            vna_1.async_query_check("SLOW?"),
+            vna_2.async_query_check("SLOW?"),
+            sg.async_query_check("SLOW?"),
+        )
+    
+    tstart = time.perf_counter()
+    asyncio.run(experiment())
+    t_elapsed = time.perf_counter() - tstart
+    
+    assert pool.io_executor(vna_1.resource) is pool.io_executor(vna_2.resource)
+    assert most_on_the_bus[id(vna_1.resource)] == 1
+    # the other instrument still runs alongside
+    assert 0.2 <= t_elapsed < 0.29
+    
+    resource = vna_1.resource
+    vna_1.close()
+    vna_2.close()
+    assert resource not in pool.io_executors
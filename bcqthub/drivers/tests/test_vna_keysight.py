@@ -0,0 +1,149 @@
+import pytest
+import numpy as np
+
+from conftest import ieee_block
+from bcqthub.drivers.instruments.VNA_Keysight import VNA_Keysight
+from bcqthub.drivers.SegmentTable import SegmentTable
+
+
+@pytest.fixture
+def vna_factory(make_driver):
+    def _make(responses=None, **configs):
+        responses = {
+            "SENSe1:SWEep:POINts?" : "101",
+            "SENSe1:FREQuency:START?" : "5.0E9",
+            "SENSe1:FREQuency:STOP?" : "5.1E9",
+            **(responses or {}),
+        }
+        configs = {"sparam" : ["S21"], "segments" : None, **configs}
+        return make_driver(responses, driver_class=VNA_Keysight, **configs)
+    return _make
+
+
+def interleave(*traces):
+    return np.hstack([np.column_stack([t.real, t.imag]).ravel() for t in traces])
+
+
+def test_return_complex_data_single_request(vna_factory):
+    s21 = np.exp(1j*np.linspace(0, 3, 101)) * np.linspace(0.1, 1, 101)
+    s11 = 0.5*np.exp(-1j*np.linspace(0, 2, 101))
+    vna, resource = vna_factory({'CALC1:DATA:MFD? "1,2",SDATA' : ieee_block(interleave(s21, s11), "<f8")},
+                                sparam=["S21", "S11"])
+    
+    cmplx_dict = vna.return_complex_data(use_binary=True)
+    
+    assert [cmd for cmd in resource.written if "DATA" in cmd and "?" in cmd] == ['CALC1:DATA:MFD? "1,2",SDATA']
+    np.testing.assert_allclose(cmplx_dict["S21"], s21)
+    np.testing.assert_allclose(cmplx_dict["S11"], s11)
+
+
+def test_return_data_s2p_single_transfer_matches_formats(vna_factory):
+    s21 = np.exp(1j*np.linspace(0, 8, 101)) * np.linspace(0.1, 1, 101)
+    vna, resource = vna_factory({'CALC1:DATA:MFD? "1",SDATA' : ieee_block(interleave(s21), "<f8")})
+    
+    df = vna.return_data_s2p(single_transfer=True, use_binary=True)
+    
+    assert not any("CALC1:FORMat" in cmd for cmd in resource.written)
+    np.testing.assert_allclose(df["Frequency"], np.linspace(5.0e9, 5.1e9, 101))
+    np.testing.assert_allclose(df["S21 magn_dB"], 20*np.log10(np.abs(s21)))
+    np.testing.assert_allclose(df["S21 phase_rad"], np.unwrap(np.angle(s21)))
+
+
+def test_return_data_s2p_binary_fdata(vna_factory):
+    magn, phase = np.linspace(-40, -10, 101), np.linspace(-180, 180, 101)
+    vna, resource = vna_factory()
+    
+    # the fake resource answers the same FDATA query twice, once per CALC1:FORMat
+    replies = iter([ieee_block(phase, "<f8"), ieee_block(magn, "<f8")])
+    write = resource.write
+    def write_fdata(cmd):
+        if cmd == "CALC1:DATA? FDATA":
+            resource.responses[cmd] = next(replies)
+        write(cmd)
+    resource.write = write_fdata
+    
+    df = vna.return_data_s2p(use_binary=True)
+    
+    assert "FORMat:DATA REAL,64" in resource.written and resource.written[-1] == "FORMat ASCII"
+    np.testing.assert_allclose(df["S21 magn_dB"], magn)
+    np.testing.assert_allclose(df["S21 phase_rad"], np.deg2rad(phase))
+
+
+def test_return_data_s2p_keeps_the_instrument_phase(vna_factory):
+    # the VNA's unwrapped phase starts wherever the instrument says, not within (-180, 180]
+    magn, phase = np.linspace(-40, -10, 101), np.linspace(400, 1500, 101)
+    vna, resource = vna_factory()
+    
+    replies = iter([ieee_block(phase, "<f8"), ieee_block(magn, "<f8")])
+    write = resource.write
+    def write_fdata(cmd):
+        if cmd == "CALC1:DATA? FDATA":
+            resource.responses[cmd] = next(replies)
+        write(cmd)
+    resource.write = write_fdata
+    
+    df = vna.return_data_s2p(use_binary=True)
+    
+    # the columns return_data_s2p had before TraceData: MLOG and np.deg2rad(UPHase) as they came in
+    np.testing.assert_array_equal(df["S21 magn_dB"], magn)
+    np.testing.assert_array_equal(df["S21 phase_rad"], np.deg2rad(phase))
+    assert list(df.columns) == ["Frequency", "S21 magn_dB", "S21 phase_rad"]
+
+
+def test_setup_s2p_measurement_only_sends_changes(vna_factory):
+    vna, resource = vna_factory({"CALC1:PAR:CAT:EXTended?" : "NO CATALOG"}, 
+                                edelay=50, n_points=101, f_center=5e9, f_span=1e6, 
+                                power=-30, averages=10, if_bandwidth=1000)
+    vna.setup_s2p_measurement()
+    assert any("DEFine" in msg for msg in resource.written)
+    resource.written.clear()
+    
+    vna.configs.update(power=-33, averages=100)
+    vna.setup_s2p_measurement()
+    
+    assert resource.written == [":SOUR1:POW1 -33;:SENSe1:AVERage:Count 100"]
+    
+    resource.written.clear()
+    vna.setup_s2p_measurement()
+    assert resource.written == []
+
+
+def test_run_measurement_schedules_first_check_from_sweep_time(vna_factory):
+    vna, resource = vna_factory({"SENSe1:SWEep:TIME?" : "+1.0E-2", "STAT:OPER:AVER1:COND?" : "+2"}, averages=5)
+    resource.written.clear()
+    
+    t_elapsed = vna.run_measurement(verbose=False)
+    
+    assert 0.05 <= t_elapsed < 1
+    assert resource.written.count("STAT:OPER:AVER1:COND?") == 1
+
+
+def test_measurement_timeout_scales_with_sweep_and_segments(vna_factory, monkeypatch):
+    segments = [",1,2,5.0e9,5.01e9", ",1,3,5.01e9,5.02e9"]
+    vna, resource = vna_factory({"SENSe1:SWEep:TIME?" : "+2.0E+00", "*ESR?" : "+1"}, averages=100, 
+                                segments=segments, event_driven=True, use_srq=False)
+    
+    assert vna.estimate_measurement_duration() == pytest.approx((2.0 + 2e-3) * 100)
+    
+    waits = []
+    monkeypatch.setattr(vna, "poll_until", lambda is_finished, expected_duration, timeout, **kw: waits.append((expected_duration, timeout)))
+    vna.run_measurement(verbose=False)
+    assert waits == [(pytest.approx(200.2), pytest.approx(200.2*1.5 + 10))]
+
+
+def test_frequency_axis_cached_until_sweep_changes(vna_factory):
+    vna, resource = vna_factory(n_points=101, f_center=5.05e9, f_span=1e8, power=-30, averages=1,
+                                if_bandwidth=1000, edelay=0)
+    vna.setup_s2p_measurement()
+    
+    freqs = vna.get_frequency_axis()
+    assert vna.get_frequency_axis() is freqs
+    assert sum("POIN" in cmd and "?" in cmd for cmd in resource.written) == 1
+    
+    vna.write_setting("SENSe1:SWEep:POINts 201")
+    vna.get_frequency_axis()
+    assert sum("POIN" in cmd and "?" in cmd for cmd in resource.written) == 2
+    
+    vna.configs["segments"] = [",1,3,5e9,5.1e9", ",1,2,5.2e9,5.3e9"]
+    np.testing.assert_allclose(vna.get_frequency_axis(), [5e9, 5.05e9, 5.1e9, 5.2e9, 5.3e9])
+    assert isinstance(vna.configs["segments"], SegmentTable)
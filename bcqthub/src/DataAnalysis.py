@@ -1,25 +1,38 @@
-import uncertainties, sys
-import matplotlib.pyplot as plt
+import sys
 import re as re
 import numpy as np
-import scipy as sp
 import pandas as pd
 
 from datetime import datetime
 from pathlib import Path
 
-# lazy... lab PC 1 and PC 2
-scres_path_1 = Path(r"C:\Users\Lehnert Lab\GitHub\scresonators")
-scres_path_2 = Path(r"E:\GitHub\scresonators")
-scres_path_3 = Path(r"/Users/jlr7/OneDrive - UCB-O365/GitHub/scresonators")
-
-sys.path.append(str(scres_path_1))
-sys.path.append(str(scres_path_2))
-sys.path.append(str(scres_path_3))
-
-
-import fit_resonator.resonator as res
-import fit_resonator.fit as fsd
+# matplotlib, scipy, uncertainties and scresonators are imported inside the 
+#   methods that use them, so that `import bcqthub` stays fast
+
+# lazy... lab PC 1 and PC 2, only searched if scresonators is not importable already
+_SCRESONATORS_PATHS = [
+    Path(r"C:\Users\Lehnert Lab\GitHub\scresonators"),
+    Path(r"E:\GitHub\scresonators"),
+    Path(r"/Users/jlr7/OneDrive - UCB-O365/GitHub/scresonators"),
+]
+
+
+def import_scresonators():
+    """
+        returns the (fit_resonator.resonator, fit_resonator.fit) modules of
+            scresonators, adding the lab PC checkouts to sys.path if needed
+    """
+    try:
+        import fit_resonator.resonator as res
+        import fit_resonator.fit as fsd
+    except ImportError:
+        for path in _SCRESONATORS_PATHS:
+            if str(path) not in sys.path:
+                sys.path.append(str(path))
+        import fit_resonator.resonator as res
+        import fit_resonator.fit as fsd
+    
+    return res, fsd
 
 
 # DataResults Class
@@ -68,6 +81,8 @@ class DataAnalysis():
         """
             Fit a single resonator S21 measurement
         """
+        import matplotlib.pyplot as plt
+        res, fsd = import_scresonators()
         
         # use pathlib to ensure save directory exists
         # TODO: move this to DataProcessor
@@ -184,6 +199,7 @@ class DataAnalysis():
                     df, init_p0 = data_tuple
 
         """
+        import matplotlib.pyplot as plt
         
         # leftover variables from importing
         phi0 = 0
@@ -278,6 +294,7 @@ class DataAnalysis():
         """
             fit power vs loss for a set of resonator data that sweeps power
         """
+        import matplotlib.pyplot as plt
         
         # use pathlib to ensure save directory exists
         # TODO: move this to DataProcessor
@@ -531,6 +548,9 @@ class DataAnalysis():
             delta_tls = F * delta0_tls * tanh(hbar w_c / 2 kB T) (1 + <n> / nc)^-1/2
 
         """
+        import scipy as sp
+        import scipy.optimize
+        import uncertainties
         
         # Convert the inputs to the correct format
         h      = 6.626069934e-34
@@ -0,0 +1,64 @@
+"""
+    `import bcqthub` must not drag in the heavy dependencies, they are only
+        imported by the modules that use them, on first use
+        
+    run this file directly for an import-time benchmark:
+    
+        python bcqthub/src/tests/test_import_time.py
+"""
+import subprocess
+import sys
+import pytest
+
+# modules that should only ever be imported when they are actually used
+HEAVY_MODULES = ["matplotlib", "scipy", "uncertainties", "fit_resonator", "pandas", "pyvisa", "serial"]
+
+# (statement, heavy modules it is allowed to import)
+IMPORT_CASES = [
+    ("import bcqthub", []),
+    ("import bcqthub.drivers, bcqthub.src", []),
+    ("import bcqthub.drivers.sensors.ghs_ctrl", []),
+    ("from bcqthub.drivers.instruments.VNA_Keysight import VNA_Keysight", ["pyvisa"]),
+    ("import bcqthub.src.DataAnalysis", ["pandas"]),
+]
+
+
+def run_import(statement):
+    """
+        import in a fresh interpreter, returns (seconds, loaded heavy modules)
+    """
+    code = f"""
+import sys, time
+tstart = time.perf_counter()
+{statement}
+t_import = time.perf_counter() - tstart
+loaded = [m for m in {HEAVY_MODULES!r} if m in sys.modules]
+print(t_import, ",".join(loaded), sep="|")
+"""
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    t_import, loaded = output.strip().splitlines()[-1].split("|")
+    return float(t_import), [m for m in loaded.split(",") if m]
+
+
+@pytest.mark.parametrize("statement, allowed", IMPORT_CASES)
+def test_import_does_not_load_heavy_modules(statement, allowed):
+    t_import, loaded = run_import(statement)
+    assert set(loaded) <= set(allowed), f"'{statement}' imported {loaded}"
+
+
+def test_lazy_attributes_still_resolve():
+    import bcqthub
+    
+    assert bcqthub.drivers.VNA_Keysight.VNA_Keysight.__name__ == "VNA_Keysight"
+    assert "VNA_Keysight" in dir(bcqthub.drivers.instruments)
+    with pytest.raises(AttributeError):
+        bcqthub.drivers.not_an_instrument
+
+
+if __name__ == "__main__":
+    repeats = 5
+    print(f"{'statement':<70}{'median [ms]':>12}   heavy modules")
+    for statement, _ in IMPORT_CASES:
+        runs = sorted(run_import(statement) for _ in range(repeats))
+        t_median, loaded = runs[repeats//2]
+        print(f"{statement:<70}{t_median*1e3:>12.1f}   {', '.join(loaded)}")